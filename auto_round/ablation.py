@@ -0,0 +1,131 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import torch
+
+from .utils import logger
+
+_WORKER_STATE = {}
+
+
+def _init_worker(func, shared, device_queue, num_threads):
+    """Initializes a worker process."""
+    _WORKER_STATE["func"] = func
+    _WORKER_STATE["shared"] = shared
+    _WORKER_STATE["device"] = device_queue.get()
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+
+def _run_job(job):
+    return _WORKER_STATE["func"](*_WORKER_STATE["shared"], *job, device=_WORKER_STATE["device"], in_worker=True)
+
+
+class AblationScheduler:
+    """Runs independent ablation variants in worker processes and yields their results as they complete.
+
+    The workers are spawned, the function, the state it is bound to and the shared arguments are pickled once per
+    worker, only the arguments of a job are pickled with it. With cuda every worker owns one device, without cuda the
+    cpu threads are split between the workers. The workers are not forked, since a child forked after the parent ran
+    a multi-threaded OpenMP region deadlocks in its first parallel op. As nothing is shared with the parent, every
+    worker holds its own unpickled copy of the model, so the workers take about num_workers times the model size in
+    memory on top of the parent's copy.
+
+    The workers are started by run and shut down when it returns. Used as a context manager, the workers started by
+    the first run are kept for the later ones, which run the same function with the same shared arguments, until the
+    context exits.
+
+    Args:
+        num_workers (int): The number of worker processes, 1 runs the variants in the current process.
+        device: The device of the variants run in the current process.
+    """
+
+    def __init__(self, num_workers=1, device="cpu"):
+        self.device = device
+        self.context = multiprocessing.get_context("spawn")
+        if num_workers > 1 and torch.cuda.is_available():
+            self.devices = [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+            self.num_threads = None
+        else:
+            self.devices = ["cpu"] * num_workers
+            self.num_threads = max(torch.get_num_threads() // max(num_workers, 1), 1)
+        self.num_workers = min(num_workers, len(self.devices))
+        self.keep_workers = False
+        self.executor = None
+        self.worker_state = None
+
+    def __enter__(self):
+        self.keep_workers = True
+        return self
+
+    def __exit__(self, *args):
+        self.keep_workers = False
+        self.close()
+
+    def close(self):
+        """Shuts the worker processes down."""
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        self.executor = None
+        self.worker_state = None
+
+    def start(self, func, shared):
+        """Starts the worker processes, with func and shared pickled into each of them."""
+        logger.info(f"starting {self.num_workers} workers: {self.devices[:self.num_workers]}")
+        device_queue = self.context.Queue()
+        for device in self.devices[:self.num_workers]:
+            device_queue.put(device)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=self.context,
+            initializer=_init_worker,
+            initargs=(func, shared, device_queue, self.num_threads),
+        )
+        self.worker_state = (func, shared)
+
+    def run(self, func, jobs, shared=()):
+        """Runs func(*shared, *job, device=..., in_worker=...) for every job.
+
+        Args:
+            func (callable): The function running one variant, its results must be picklable.
+            jobs (list): The positional arguments of each variant.
+            shared (tuple): The leading positional arguments common to all the variants, such as the model and its
+                cached inputs, which are sent to every worker once.
+
+        Yields:
+            tuple: The job and its result, in the order of completion.
+        """
+        if self.num_workers <= 1:
+            for job in jobs:
+                yield job, func(*shared, *job, device=self.device, in_worker=False)
+            return
+
+        if self.executor is None:
+            self.start(func, shared)
+        else:
+            ## the running workers hold the function and the shared arguments of the first run
+            assert func == self.worker_state[0] and len(shared) == len(self.worker_state[1]) and all(
+                arg is worker_arg for arg, worker_arg in zip(shared, self.worker_state[1])
+            ), "the workers are kept for the runs of the same function with the same shared arguments"
+        logger.info(f"running {len(jobs)} jobs on {self.num_workers} workers")
+        try:
+            futures = {self.executor.submit(_run_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            if not self.keep_workers:
+                self.close()
@@ -0,0 +1,144 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+import torch
+
+
+class ActivationStore:
+    """Cached activations of calibration samples, stored contiguously along one dim of a preallocated tensor.
+
+    It replaces the python lists of per-sample tensors produced by torch.split, so that sampling a batch is a
+    single index_select instead of a torch.cat of many small tensors. It keeps the parts of the list interface
+    used by the tuning loops: len, indexing and releasing samples by assigning None.
+
+    Args:
+        capacity (int): The number of samples to preallocate, the buffer grows if more are appended.
+        dim (int): The dim of the samples.
+        memmap_dir (str): If set, buffers on cpu are memory-mapped files created in this directory.
+    """
+
+    def __init__(self, capacity, dim=0, memmap_dir=None):
+        self.capacity = capacity
+        self.dim = dim
+        self.memmap_dir = memmap_dir
+        self.data = None
+        self.size = 0
+        self.released = set()
+
+    @classmethod
+    def from_tensor(cls, data, dim=0, memmap_dir=None):
+        """Wraps a tensor holding the samples along dim without copying it."""
+        store = cls(data.shape[dim], dim=dim, memmap_dir=memmap_dir)
+        store.data = data
+        store.size = data.shape[dim]
+        return store
+
+    def _allocate(self, shape, dtype, device):
+        if self.memmap_dir is None or torch.device(device).type != "cpu":
+            return torch.empty(shape, dtype=dtype, device=device)
+        numel = 1
+        for size in shape:
+            numel *= size
+        os.makedirs(self.memmap_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.memmap_dir, suffix=".bin", delete=False) as f:
+            f.truncate(max(numel, 1) * torch.empty(0, dtype=dtype).element_size())
+        ##the mapping stays valid after the file is unlinked, so nothing is left on disk once the buffer is freed
+        data = torch.from_file(f.name, shared=True, size=numel, dtype=dtype)
+        os.remove(f.name)
+        return data.view(shape)
+
+    def append(self, batch):
+        """Appends the samples of batch, which are laid along self.dim."""
+        num = batch.shape[self.dim]
+        if self.data is None:
+            shape = list(batch.shape)
+            shape[self.dim] = max(self.capacity, num)
+            self.data = self._allocate(shape, batch.dtype, batch.device)
+        elif self.size + num > self.data.shape[self.dim]:
+            shape = list(self.data.shape)
+            shape[self.dim] = max(2 * self.data.shape[self.dim], self.size + num)
+            data = self._allocate(shape, self.data.dtype, self.data.device)
+            data.narrow(self.dim, 0, self.size).copy_(self.view())
+            self.data = data
+        self.data.narrow(self.dim, self.size, num).copy_(batch)
+        self.size += num
+
+    def view(self):
+        """Returns all the samples as one tensor without copying."""
+        return self.data.narrow(self.dim, 0, self.size)
+
+    def gather(self, indices, device=None):
+        """Returns the samples at indices concatenated along self.dim.
+
+        Args:
+            indices (torch.Tensor or list): The indices of the samples.
+            device: The device of the result, defaults to the device of the store.
+
+        Returns:
+            torch.Tensor: The gathered samples.
+        """
+        if not isinstance(indices, torch.Tensor):
+            indices = torch.tensor(indices, dtype=torch.long)
+        res = self.data.index_select(self.dim, indices.to(self.data.device))
+        if device is not None:
+            res = res.to(device)
+        return res
+
+    def to(self, device=None, dtype=None):
+        """Returns a store on device with dtype, or self if nothing changes."""
+        if self.data is None:
+            return self
+        device = self.data.device if device is None else torch.device(device)
+        dtype = self.data.dtype if dtype is None else dtype
+        if self.data.device == device and self.data.dtype == dtype:
+            return self
+        if device.type == "cpu" and self.memmap_dir is not None:
+            store = ActivationStore(self.size, dim=self.dim, memmap_dir=self.memmap_dir)
+            store.append(self.view().to(device=device, dtype=dtype))
+            return store
+        return ActivationStore.from_tensor(self.view().to(device=device, dtype=dtype), dim=self.dim)
+
+    @property
+    def device(self):
+        return self.data.device
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.size
+        if idx < 0 or idx >= self.size:
+            raise IndexError(f"index {idx} is out of range for {self.size} samples")
+        return self.data.narrow(self.dim, idx, 1)
+
+    def __setitem__(self, idx, value):
+        if value is None:
+            ##the buffer is freed once every sample has been released, like dropping the last ref of a list
+            self.released.add(idx)
+            if len(self.released) >= self.size:
+                self.data = None
+            return
+        self[idx].copy_(value)
+
+    def __iter__(self):
+        for idx in range(self.size):
+            yield self[idx]
@@ -16,19 +16,22 @@
 import copy
 import time
 from typing import Optional, Union
-import os
-import io
-import shutil
 
 import torch
 import transformers
 from torch import autocast
 
-import wandb
-import lm_eval
-
 from .calib_dataset import get_dataloader
-from .quantizer import WrapperMultiblock, wrapper_block, unwrapper_block, WrapperLinear, unwrapper_layer
+from .quantizer import (
+    WrapperMultiblock,
+    wrapper_block,
+    unwrapper_block,
+    WrapperLinear,
+    unwrapper_layer,
+    cache_qdq_weights,
+    release_qdq_weights,
+    project_minmax_scales,
+)
 from .special_model_handler import check_hidden_state_dim, check_share_attention_mask, check_not_share_position_ids
 from .utils import (
     CpuInfo,
@@ -43,20 +46,33 @@ from .utils import (
     get_module,
     htcore,
     is_optimum_habana_available,
+    lm_eval,
     logger,
     sampling_inputs,
     to_device,
     to_dtype,
+    update_best_params,
     get_layer_names_in_block,
     mv_module_from_gpu,
     format_layer_name,
+    set_module,
 )
 
 from .low_cpu_mem.utils import get_layers_before_block
+from .activation_store import ActivationStore
+from .prefetch import BlockPrefetcher
+from .ablation import AblationScheduler
+from .metrics import MetricsBuffer, get_metrics_sink
+from .profiler import PhaseProfiler
+from .eval import EarlyExitEvaluator, get_eval_tokens
+from .calib_cache import CalibInputsCache, get_model_fingerprint
+from .budget import IterationBudgetScheduler
+from .version import __version__
 from .learning_curve_stats_utils import (
     calculate_convergence_iter, 
     calculate_average_absolute_change, 
     calculate_slope, 
+    ConvergenceDetector,
     plot_learning_curve,
     make_pandas_dataframe_from_lm_eval_results,
 )
@@ -95,6 +111,14 @@ def get_block_indices(
             yield _get_block_indices(start_block_idx, num_fine_tune_blocks, num_lookahead_blocks, num_observe_blocks, total_num_blocks)
 
 
+def get_window_block_names(block_names, block_indices, block_step_size):
+    """Returns the names of the blocks a tuning window of quant_blocks runs, including the blocks preceding the
+    fine tune blocks whose outputs are recomputed when the window starts."""
+    fine_tune_block_indices, attach_loss_block_indices, observe_block_indices = block_indices
+    start = max(fine_tune_block_indices.start - block_step_size, 0)
+    stop = max(fine_tune_block_indices.stop, attach_loss_block_indices.stop, observe_block_indices.stop)
+    return block_names[start:stop]
+
 
 class AutoRound(object):
     """This is Signround+ which is an advanced version of Signround. For more information,
@@ -154,6 +178,71 @@ class AutoRound(object):
         act_group_size (int): Group size for activation quantization. Default is None.
         act_sym (bool): Whether to use symmetric activation quantization. Default is None.
         act_dynamic (bool): Whether to use dynamic activation quantization. Default is True.
+        metrics_sink: The destination of the tuning metrics, the name of a registered sink (memory, jsonl, wandb)
+                      or a MetricsSink, None logs to wandb unless disable_wandb is set. Default is None.
+        metrics_flush_interval (int): The number of iterations whose losses are kept on the device before they
+                                      are copied to the host and logged at once. Default is 50.
+        enable_fused_qdq (bool): Whether to fake quantize the weights with a fused forward and STE backward during
+                                 tuning, which allocates far fewer temporaries per iteration. Default is False.
+        calib_cache_dir (str): The directory of a disk cache of the calibration inputs, shared across runs and
+                               processes with the same model, dataset, seqlen, nsamples and seed. Default is None.
+        activation_memmap_dir (str): The directory of the memory-mapped files backing the cached block inputs and
+                                     outputs kept on cpu, None keeps them in RAM. Default is None.
+        enable_prefetch (bool): Whether to move the blocks of the next tuning window to the device, loading them
+                                from disk with low_cpu_mem_usage, on a background thread. Default is False.
+        num_ablation_workers (int): The number of worker processes running the attach loss variants of the
+                                    isolation experiment, one per gpu if cuda is available. Every spawned worker
+                                    holds its own copy of the model in memory. Default is 1.
+        num_block_workers (int): The number of worker processes tuning the windows of blocks concurrently when
+                                 enable_quanted_input is False, one per gpu if cuda is available, otherwise cpu
+                                 processes splitting the threads. Every spawned worker holds its own copy of the
+                                 model in memory. Default is 1, which tunes them one by one.
+        pipeline_staleness (int): With enable_quanted_input, the number of windows whose tuning may still be
+                                  running when a window starts tuning, on the output of their round to nearest
+                                  quantization instead of their tuned one, see quant_blocks_parallel. Default is 0,
+                                  which tunes the windows one by one on their exact quantized inputs.
+        pipeline_retune_iters (int): With pipeline_staleness, the number of iterations re-tuning every window tuned
+                                     on an approximate input on its exact quantized input once the windows before
+                                     it landed, starting from its tuned values. Default is 0, which disables it.
+        enable_gradient_checkpointing (bool): Whether the tuning keeps only the inputs of segments of blocks of the
+                                              fine tune, attach loss and observe blocks and recomputes their
+                                              activations in the backward, which trades a second forward for the
+                                              memory of the activations of all the blocks. Default is False.
+        checkpoint_granularity (int): The number of blocks per checkpointed segment. Default is 1.
+        observe_schedule (str): When the tuning computes the observe block mse. "step" computes it on the training
+                                batch of every iteration, "every" every observe_interval iterations from the first
+                                one, "end" once on the tuned blocks and "never" not at all. "every" and "end"
+                                compute it without gradients on a fixed subset of observe_nsamples calibration
+                                samples, which are not held out from the training samples, so the mse measures
+                                the fit to the calibration data rather than the generalization. Default is None, which is "step" if a metrics sink is set or for the
+                                isolation experiment, and "never" otherwise, since no mse is consumed then.
+        observe_interval (int): The number of iterations between the observations of the "every" schedule.
+                                Default is 10.
+        observe_nsamples (int): The number of samples of the "every" and "end" observations, the training batch
+                                size if None. Default is None.
+        enable_early_exit_eval (bool): Whether the isolation experiment evaluates the wikitext2 token perplexity
+                                       by running only the blocks from the fine tune block on, instead of the
+                                       lm_eval word perplexity of the whole model. Default is False.
+        early_exit_eval_seqlen (int): The window length of the early exit evaluation. Default is 2048.
+        enable_profiling (bool): Whether to record the wall time and the peak memory of the phases of the
+                                 quantization per block, and log them as a table. Default is False.
+        profile_record_function (bool): Whether to also wrap the profiled phases in torch.profiler
+                                        record_function ranges. Default is False.
+        profile_path (str): The json file the profile is written to, after quantize and after
+                            save_quantized. Default is None.
+        enable_early_stop (bool): Whether to stop tuning a block or a layer once its loss has converged, see
+                                  ConvergenceDetector. Default is False.
+        early_stop_threshold (float): The relative slope and relative change of the smoothed loss under which an
+                                      iteration counts as flat. Default is 1e-3.
+        early_stop_patience (int): The number of consecutive flat iterations after which the tuning stops.
+                                   Default is 10.
+        early_stop_window (int): The moving average window of the loss. Default is 5.
+        enable_budget_scheduler (bool): Whether to split the tuning iterations of all the blocks among them
+                                        according to short probe runs, see IterationBudgetScheduler. The
+                                        allocation is saved in the quantization config. Default is False.
+        budget_probe_iters (int): The number of iterations of the probe run of a block. Default is 10.
+        budget_min_iters (int): The minimum number of iterations of a block, iters // 4 if None. Default is None.
+        budget_max_iters (int): The maximum number of iterations of a block, 4 * iters if None. Default is None.
 
     Returns:
         The quantized model.
@@ -211,6 +300,34 @@ class AutoRound(object):
             act_sym: bool = None,
             act_dynamic: bool = True,
             disable_wandb: bool = False,
+            metrics_sink=None,
+            metrics_flush_interval: int = 50,
+            enable_fused_qdq: bool = False,
+            calib_cache_dir: str = None,
+            activation_memmap_dir: str = None,
+            enable_prefetch: bool = False,
+            num_ablation_workers: int = 1,
+            num_block_workers: int = 1,
+            pipeline_staleness: int = 0,
+            pipeline_retune_iters: int = 0,
+            enable_gradient_checkpointing: bool = False,
+            checkpoint_granularity: int = 1,
+            observe_schedule: str = None,
+            observe_interval: int = 10,
+            observe_nsamples: int = None,
+            enable_early_exit_eval: bool = False,
+            early_exit_eval_seqlen: int = 2048,
+            enable_profiling: bool = False,
+            profile_record_function: bool = False,
+            profile_path: str = None,
+            enable_early_stop: bool = False,
+            early_stop_threshold: float = 1e-3,
+            early_stop_patience: int = 10,
+            early_stop_window: int = 5,
+            enable_budget_scheduler: bool = False,
+            budget_probe_iters: int = 10,
+            budget_min_iters: int = None,
+            budget_max_iters: int = None,
             **kwargs,
     ):
         self.quantized = False
@@ -223,6 +340,7 @@ class AutoRound(object):
         self.round_to_nearest = round_to_nearest
         self.enable_quanted_input = enable_quanted_input
         self.enable_minmax_tuning = enable_minmax_tuning
+        self.enable_fused_qdq = enable_fused_qdq
         self.nsamples = nsamples
         self.nblocks = nblocks
         self.block_step_size = block_step_size
@@ -278,6 +396,40 @@ class AutoRound(object):
         self.act_sym = act_sym if not (act_sym is None) else self.sym
         self.act_dynamic = act_dynamic
         self.disable_wandb = disable_wandb
+        if metrics_sink is None and not disable_wandb:
+            metrics_sink = "wandb"
+        self.metrics = get_metrics_sink(metrics_sink)
+        self.metrics_flush_interval = metrics_flush_interval
+        self.calib_cache = CalibInputsCache(calib_cache_dir) if calib_cache_dir is not None else None
+        self.activation_memmap_dir = activation_memmap_dir
+        self.enable_prefetch = enable_prefetch
+        self.num_ablation_workers = num_ablation_workers
+        self.num_block_workers = num_block_workers
+        self.pipeline_staleness = pipeline_staleness
+        self.pipeline_retune_iters = pipeline_retune_iters
+        self.enable_gradient_checkpointing = enable_gradient_checkpointing
+        self.checkpoint_granularity = checkpoint_granularity
+        if observe_schedule is None:
+            observe_schedule = "step" if self.metrics is not None or self.isolation_experiment_v2 else "never"
+        self.observe_schedule = observe_schedule
+        self.observe_interval = observe_interval
+        self.observe_nsamples = observe_nsamples if observe_nsamples is not None else self.train_bs
+        self.observe_iters = {}
+        self.enable_early_exit_eval = enable_early_exit_eval
+        self.early_exit_eval_seqlen = early_exit_eval_seqlen
+        self.early_exit_evaluator = None
+        self.profiler = PhaseProfiler(enable_profiling, record_function=profile_record_function)
+        self.profile_path = profile_path
+        self.enable_early_stop = enable_early_stop
+        self.early_stop_threshold = early_stop_threshold
+        self.early_stop_patience = early_stop_patience
+        self.early_stop_window = early_stop_window
+        self.early_stopped_iters = {}
+        self.enable_budget_scheduler = enable_budget_scheduler
+        self.budget_probe_iters = budget_probe_iters
+        self.budget_min_iters = budget_min_iters
+        self.budget_max_iters = budget_max_iters
+        self.block_iters = None
         
         self.set_layerwise_config(self.layer_config)
         torch.set_printoptions(precision=3, sci_mode=True)
@@ -288,6 +440,14 @@ class AutoRound(object):
             import habana_frameworks.torch.core as htcore  # pylint: disable=E0401
             import habana_frameworks.torch.hpu as hthpu  # pylint: disable=E0401
 
+    def __getstate__(self):
+        """Drops the calibration state, which the worker processes of AblationScheduler do not read, from the
+        copies of the instance pickled into them."""
+        state = self.__dict__.copy()
+        for key in ["dataloader", "inputs", "hook_handles"]:
+            state.pop(key, None)
+        return state
+
     def check_configs(self):
         """Checks if the configurations are valid.
 
@@ -320,6 +480,31 @@ class AutoRound(object):
         
         assert self.train_bs > 0, "batch size must be positive"
         assert self.eval_batch_size > 0, "eval batch size must be positive"
+        assert self.metrics_flush_interval > 0, "metrics flush interval must be positive"
+        if self.enable_early_stop:
+            assert self.early_stop_threshold > 0, "early stop threshold must be positive"
+            assert self.early_stop_patience > 0, "early stop patience must be positive"
+            assert self.early_stop_window >= 2, "early stop window must be at least 2"
+        assert self.num_block_workers >= 1, "num_block_workers must be positive"
+        assert self.pipeline_staleness >= 0, "pipeline_staleness must be non-negative"
+        assert self.pipeline_retune_iters >= 0, "pipeline_retune_iters must be non-negative"
+        if self.num_block_workers > 1 or self.pipeline_staleness > 0:
+            assert not self.cleanly_separated_lookahead and self.nblocks == self.block_step_size, \
+                "block parallel tuning needs windows that do not overlap, nblocks should equal block_step_size"
+            if self.enable_quanted_input and self.pipeline_staleness == 0:
+                logger.warning("block parallel tuning needs enable_quanted_input=False or pipeline_staleness > 0, "
+                               "the blocks are tuned one by one")
+        assert self.checkpoint_granularity > 0, "checkpoint_granularity must be positive"
+        assert self.observe_schedule in ["step", "every", "end", "never"], \
+            f"unknown observe_schedule {self.observe_schedule}, it should be step, every, end or never"
+        assert self.observe_interval > 0, "observe_interval must be positive"
+        assert self.observe_nsamples > 0, "observe_nsamples must be positive"
+        if self.isolation_experiment_v2:
+            assert self.observe_schedule == "step", "the isolation experiment needs the observe_schedule step"
+        if self.enable_budget_scheduler:
+            assert not self.cleanly_separated_lookahead and not self.isolation_experiment_v2, \
+                "the budget scheduler only supports the sliding window tuning"
+            assert 2 <= self.budget_probe_iters < self.iters, "budget probe iters must be in [2, iters)"
         assert self.iters > 0, "iters must be positive"
         assert self.seqlen > 0, "seqlen must be positive"
         assert self.nblocks > 0, "nblocks must be positive"
@@ -356,6 +541,7 @@ class AutoRound(object):
                     block=block, 
                     enable_minmax_tuning=self.enable_minmax_tuning,
                     device=self.device,
+                    enable_fused_qdq=self.enable_fused_qdq,
                 )
                 
                 dump_info = (
@@ -376,7 +562,17 @@ class AutoRound(object):
                 torch.cuda.empty_cache()
         else:
             all_first_block_names = [block[0] for block in all_blocks]
-            all_inputs = self.try_cache_inter_data_gpucpu(all_first_block_names, self.nsamples, layer_names=layer_names)
+            block_parallel = self.is_block_parallel()
+            if block_parallel:
+                ## the full precision inputs of every window are captured in the same calibration pass
+                for block_names in all_blocks:
+                    for window_indices in self.get_all_block_indices(len(block_names)):
+                        block_name = block_names[window_indices[0].start]
+                        if block_name not in all_first_block_names:
+                            all_first_block_names.append(block_name)
+            with self.profiler.phase("cache_inputs"):
+                all_inputs = self.try_cache_inter_data_gpucpu(
+                    all_first_block_names, self.nsamples, layer_names=layer_names)
             for block_names in all_blocks:
                 inputs = all_inputs[block_names[0]]
                 all_inputs.pop(block_names[0])
@@ -392,7 +588,9 @@ class AutoRound(object):
             self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
             torch.cuda.empty_cache()
             
-            if not self.isolation_experiment_v2:
+            if block_parallel:
+                self.quant_blocks_parallel(self.model, inputs, all_inputs, block_names, device=self.device)
+            elif not self.isolation_experiment_v2:
                 self.quant_blocks(
                     self.model,
                     inputs,
@@ -414,13 +612,19 @@ class AutoRound(object):
                     device=self.device,
             )
 
-            self.quant_layers(layer_names, all_inputs)
+            with self.profiler.phase("quant_layers"):
+                self.quant_layers(layer_names, all_inputs)
 
         self.dump_qinfo_to_layer_config()
 
         end_time = time.time()
         cost_time = end_time - self.start_time
         logger.info(f"quantization tuning time {cost_time}")
+        if len(self.early_stopped_iters) > 0:
+            saved_iters = sum(total_iters - iters for iters, total_iters in self.early_stopped_iters.values())
+            logger.info(
+                f"early stopped {len(self.early_stopped_iters)} blocks and layers, saved {saved_iters} iterations")
+        self.profiler.save(self.profile_path)
 
         ## dump a summary
         quantized_layers = []
@@ -537,7 +741,7 @@ class AutoRound(object):
 
 
     @torch.no_grad()
-    def get_block_outputs(self, block, input_ids, input_others, bs, device, cache_device):
+    def get_block_outputs(self, block, input_ids, input_others, bs, device, cache_device, indices=None):
         """Compute the output of a given block of the model for a given input.
 
         Args:
@@ -548,20 +752,22 @@ class AutoRound(object):
         device: The device for computation.
         cache_device: The device for storing the output.
         batch_dim: The batch dimension of the output tensor.
+        indices: The indices of the samples whose outputs are computed, in the order they are stored, all the
+                 samples if None.
 
         Returns:
-        The output tensor of the block.
+        The ActivationStore of the outputs of the block.
         """
 
-        output = []
-        nsamples = len(input_ids)
+        if indices is None:
+            indices = torch.arange(len(input_ids)).to(torch.long)
+        nsamples = len(indices)
+        output = self.new_activation_store(nsamples, self.input_dim, cache_device)
         for i in range(0, nsamples, bs):
-            end_index = min(nsamples, i + bs)
-            indices = torch.arange(i, end_index).to(torch.long)
             tmp_input_ids, tmp_input_others = sampling_inputs(
                 input_ids,
                 input_others,
-                indices,
+                indices[i: i + bs],
                 self.seqlen,
                 self.share_attention_mask_flag,
                 self.not_share_position_ids_flag,
@@ -570,11 +776,52 @@ class AutoRound(object):
             tmp_output = block_forward(block, tmp_input_ids, tmp_input_others, self.amp, self.amp_dtype, device).to(
                 cache_device
             )
-            output.extend(list(torch.split(tmp_output, 1, dim=self.input_dim)))
+            output.append(tmp_output)
         torch.cuda.empty_cache()
 
         return output
 
+    @torch.no_grad()
+    def get_cached_block_outputs(self, blocks, first_block_idx, input_ids, input_others, device, fp_output_cache):
+        """Compute the outputs of consecutive blocks one block at a time, reusing the outputs found in the cache.
+
+        Args:
+        blocks: The consecutive blocks.
+        first_block_idx: The index of the first block in the model.
+        input_ids: The inputs of the first block.
+        input_others: A dictionary containing additional input data.
+        device: The device for computation.
+        fp_output_cache: The outputs of the blocks keyed by block index.
+
+        Returns:
+        The list of the outputs of the blocks.
+        """
+        outputs = []
+        output = input_ids
+        for idx, block in enumerate(blocks):
+            block_idx = first_block_idx + idx
+            if block_idx not in fp_output_cache:
+                fp_output_cache[block_idx] = self.get_block_outputs(
+                    block, output, input_others, self.train_bs * self.infer_bs_coeff, device, self.cache_device
+                )
+            output = fp_output_cache[block_idx]
+            outputs.append(output)
+        return outputs
+
+    def new_activation_store(self, capacity, dim=0, device=torch.device("cpu")):
+        """Creates an empty ActivationStore, memory-mapped if it is on cpu and activation_memmap_dir is set.
+
+        Args:
+        capacity: The number of samples to preallocate.
+        dim: The dim of the samples.
+        device: The device of the stored samples.
+
+        Returns:
+        The ActivationStore.
+        """
+        memmap_dir = self.activation_memmap_dir if torch.device(device).type == "cpu" else None
+        return ActivationStore(capacity, dim=dim, memmap_dir=memmap_dir)
+
     @torch.no_grad()
     def calib(self, nsamples, bs):
         """Perform calibration for quantization.
@@ -591,14 +838,15 @@ class AutoRound(object):
         if isinstance(self.dataset, str):
             dataset = self.dataset.replace(" ", "")  ##remove all whitespaces
             # slow here
-            self.dataloader = get_dataloader(
-                tokenizer=self.tokenizer,
-                seqlen=self.seqlen,
-                dataset_name=dataset,
-                seed=42,
-                bs=bs,
-                nsamples=self.nsamples,
-            )
+            with self.profiler.phase("calibration"):
+                self.dataloader = get_dataloader(
+                    tokenizer=self.tokenizer,
+                    seqlen=self.seqlen,
+                    dataset_name=dataset,
+                    seed=42,
+                    bs=bs,
+                    nsamples=self.nsamples,
+                )
         else:
             self.dataloader = self.dataset
         total_cnt = 0
@@ -685,6 +933,13 @@ class AutoRound(object):
         Raises:
             Exception: If caching on GPU fails, switches to CPU and caches there.
         """
+        cache_spec = self.get_calib_cache_spec(block_names, nsamples, layer_names, last_cache_name)
+        if cache_spec is not None:
+            all_inputs, flags = self.calib_cache.load(cache_spec)
+            if all_inputs is not None:
+                for key, value in flags.items():
+                    setattr(self, key, value)
+                return all_inputs
         try:
             if not self.model.device.type == "meta":
                 self.model = self.model.to(self.device)
@@ -700,8 +955,49 @@ class AutoRound(object):
             all_inputs = self.cache_inter_data(
                 block_names, nsamples, layer_names=layer_names, last_cache_name=last_cache_name
             )
+        if cache_spec is not None:
+            flags = {}
+            for key in ["input_dim", "share_attention_mask_flag", "not_share_position_ids_flag"]:
+                if getattr(self, key, None) is not None:
+                    flags[key] = getattr(self, key)
+            self.calib_cache.save(cache_spec, all_inputs, flags)
         return all_inputs
 
+    def get_calib_cache_spec(self, block_names, nsamples, layer_names=[], last_cache_name=None):
+        """Gets the spec identifying the cached inputs on disk.
+
+        Args:
+            block_names (list): List of block names to cache data for.
+            nsamples (int): Number of samples to use for caching.
+            layer_names (list, optional): List of layer names to cache data for. Defaults to [].
+            last_cache_name (str, optional): Name of the last cache. Defaults to None.
+
+        Returns:
+            dict: The spec, or None if the disk cache is disabled or the dataset is not identified by a name.
+        """
+        if self.calib_cache is None:
+            return None
+        if not isinstance(self.dataset, str):
+            logger.warning("only datasets passed by name are cached on disk, skip the calibration cache")
+            return None
+        return {
+            ## recomputed per call, the layers outside the blocks are cached after the blocks are quantized
+            "model": get_model_fingerprint(self.model),
+            "model_dtype": str(self.model.dtype),
+            "tokenizer": getattr(self.tokenizer, "name_or_path", self.tokenizer.__class__.__name__),
+            "dataset": self.dataset.replace(" ", ""),
+            "seqlen": self.seqlen,
+            "nsamples": nsamples,
+            "seed": 42,  ## the seed used by calib
+            "batch_size": self.train_bs,
+            "block_names": list(block_names),
+            "layer_names": list(layer_names),
+            "last_cache_name": last_cache_name,
+            "amp": self.amp,
+            "low_gpu_mem_usage": self.low_gpu_mem_usage,
+            "version": __version__,
+        }
+
     @torch.no_grad()
     def cache_inter_data(self, block_names, nsamples, layer_names=[], last_cache_name=None):
         """Save the inputs of block_name for calibration. For layers, we cache both of inputs and output.
@@ -745,6 +1041,42 @@ class AutoRound(object):
 
         return res
 
+    @torch.no_grad()
+    def cache_eval_block_inputs(self, block_name, windows, batch_size, device):
+        """Save the inputs of a block on the windows of an evaluation corpus, see EarlyExitEvaluator.
+
+        Args:
+            block_name (str): The name of the block.
+            windows (torch.Tensor): The token ids of the windows, one window per row.
+            batch_size (int): The number of windows per forward.
+            device: The device the model runs on during the capture.
+
+        Returns:
+            dict: The inputs of the block, in the layout of cache_inter_data.
+        """
+        self.inputs = {}
+        self.to_cached_layers = [block_name]
+        self.last_cache_name = block_name
+        self.hook_handles = []
+        if not self.model.device.type == "meta":
+            self.model = self.model.to(device)
+        self._replace_forward()
+        try:
+            for i in range(0, len(windows), batch_size):
+                try:
+                    self.model(windows[i:i + batch_size].to(device))
+                except NotImplementedError:
+                    pass
+        finally:
+            self._recover_forward()
+            self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+            torch.cuda.empty_cache()
+            del self.last_cache_name
+            del self.to_cached_layers
+        res = self.inputs[block_name]
+        self.inputs = {}
+        return res
+
     @torch.no_grad()
     def get_block_forward_func(self, name):
         """Gets the forward function.
@@ -770,11 +1102,10 @@ class AutoRound(object):
                 self.input_dim = check_hidden_state_dim(self.model, positional_args)
                 self.share_attention_mask_flag = check_share_attention_mask(self.model, hidden_states, **kwargs)
                 self.not_share_position_ids_flag = check_not_share_position_ids(self.model, **kwargs)
-            if name in self.inputs:
-                self.inputs[name]["input_ids"].extend(list(torch.split(hidden_states.to("cpu"), 1, dim=self.input_dim)))
-            else:
+            if name not in self.inputs:
                 self.inputs[name] = {}
-                self.inputs[name]["input_ids"] = list(torch.split(hidden_states.to("cpu"), 1, dim=self.input_dim))
+                self.inputs[name]["input_ids"] = self.new_activation_store(self.nsamples, self.input_dim)
+            self.inputs[name]["input_ids"].append(hidden_states.to("cpu"))
 
             if "positional_inputs" not in self.inputs[name]:
                 self.inputs[name]["positional_inputs"] = []
@@ -788,10 +1119,12 @@ class AutoRound(object):
                         if key not in self.inputs[name].keys():
                             self.inputs[name][key] = None
                         if kwargs[key] is not None:
-                            if (not self.share_attention_mask_flag) and self.inputs[name][key] is not None:
-                                self.inputs[name][key].extend(list(torch.split(kwargs[key].to("cpu"), 1, dim=0)))
-                            else:
+                            if self.share_attention_mask_flag:
                                 self.inputs[name][key] = list(torch.split(kwargs[key].to("cpu"), 1, dim=0))
+                            else:
+                                if self.inputs[name][key] is None:
+                                    self.inputs[name][key] = self.new_activation_store(self.nsamples)
+                                self.inputs[name][key].append(kwargs[key].to("cpu"))
                     elif "alibi" in key:
                         if key not in self.inputs[name].keys():
                             self.inputs[name][key] = None
@@ -799,17 +1132,21 @@ class AutoRound(object):
                             alibi = kwargs[key]
                             batch = kwargs["attention_mask"].shape[0]
                             alibi = alibi.reshape(batch, -1, alibi.shape[1], alibi.shape[2])
-                            if (not self.share_attention_mask_flag) and self.inputs[name][key] is not None:
-                                self.inputs[name][key].extend(list(torch.split(alibi.to("cpu"), 1, dim=0)))
-                            else:
+                            if self.share_attention_mask_flag:
                                 self.inputs[name][key] = list(torch.split(alibi.to("cpu"), 1, dim=0))
+                            else:
+                                if self.inputs[name][key] is None:
+                                    self.inputs[name][key] = self.new_activation_store(self.nsamples)
+                                self.inputs[name][key].append(alibi.to("cpu"))
                     elif "position_ids" in key:
                         if key not in self.inputs[name].keys():
-                            self.inputs[name][key] = list(torch.split(kwargs[key].to("cpu"), 1, dim=0)) \
-                                                    if self.not_share_position_ids_flag \
-                                                    else to_device(kwargs[key], device=torch.device("cpu"))
+                            if self.not_share_position_ids_flag:
+                                self.inputs[name][key] = self.new_activation_store(self.nsamples)
+                                self.inputs[name][key].append(kwargs[key].to("cpu"))
+                            else:
+                                self.inputs[name][key] = to_device(kwargs[key], device=torch.device("cpu"))
                         elif kwargs[key] is not None and self.not_share_position_ids_flag:
-                            self.inputs[name][key].extend(list(torch.split(kwargs[key].to("cpu"), 1, dim=0)))
+                            self.inputs[name][key].append(kwargs[key].to("cpu"))
                     elif key not in self.inputs[name].keys():
                         self.inputs[name][key] = to_device(kwargs[key], device=torch.device("cpu"))
             if name == self.last_cache_name:
@@ -859,6 +1196,20 @@ class AutoRound(object):
                 hook_handle = m.register_forward_hook(hook_func)
                 self.hook_handles.append(hook_handle)
 
+    def get_convergence_detector(self):
+        """Creates the convergence detector of a tuning loop, None if early stopping is disabled."""
+        if not self.enable_early_stop:
+            return None
+        return ConvergenceDetector(
+            threshold=self.early_stop_threshold, patience=self.early_stop_patience, window=self.early_stop_window)
+
+    def log_early_stop(self, name, iters, total_iters=None):
+        """Records that the tuning of a block or a layer stopped after iters of its total_iters iterations."""
+        if total_iters is None:
+            total_iters = self.iters
+        self.early_stopped_iters[name] = (iters, total_iters)
+        logger.info(f"early stopped {name} at iter {iters}/{total_iters}, saved {total_iters - iters} iterations")
+
     def quant_layer(self, layer_name, inputs, q_inputs=None, device=torch.device("cpu")):
         """Quantize a specific layer of the model using the provided inputs.
 
@@ -879,7 +1230,8 @@ class AutoRound(object):
             if q_inputs is not None:
                 q_inputs[i] = q_inputs[i].to(layer.weight.dtype)
 
-        wrapper_linear = WrapperLinear(layer, self.enable_minmax_tuning, device).to(device)
+        wrapper_linear = WrapperLinear(layer, self.enable_minmax_tuning, device,
+                                       enable_fused_qdq=self.enable_fused_qdq).to(device)
         round_params = []
         minmax_params = []
         round_params.append(wrapper_linear.value)
@@ -915,10 +1267,12 @@ class AutoRound(object):
 
         if self.sampler != "rand":
             whole_indices = torch.randperm(nsamples)[:pick_samples]
+        convergence_detector = self.get_convergence_detector()
         for i in range(self.iters):
             total_loss = 0
             if self.sampler == "rand":
                 whole_indices = torch.randperm(nsamples)[:pick_samples]
+            cache_qdq_weights(wrapper_linear)
             for tmp_step in range(gradient_accumulate_steps):
                 indices = whole_indices[tmp_step * train_bs: (tmp_step + 1) * train_bs]
                 if q_inputs is not None:
@@ -945,6 +1299,7 @@ class AutoRound(object):
                 total_loss += loss.item() / gradient_accumulate_steps
 
                 self.scale_loss_and_backward(scaler, loss)
+            release_qdq_weights(wrapper_linear)
             if i == 0:
                 init_loss = total_loss
 
@@ -964,10 +1319,18 @@ class AutoRound(object):
             if not self.not_use_best_mse:
                 if self.dynamic_max_gap > 0 and i - last_best_iter >= self.dynamic_max_gap:
                     break
+            if convergence_detector is not None and convergence_detector.update(total_loss):
+                if self.not_use_best_mse:
+                    best_v = copy.deepcopy(wrapper_linear.value.data)
+                    best_min_scale = copy.deepcopy(torch.clamp(wrapper_linear.min_scale.data, 0, 1.0))
+                    best_max_scale = copy.deepcopy(torch.clamp(wrapper_linear.max_scale.data, 0, 1.0))
+                self.log_early_stop(layer_name, i + 1)
+                break
             self.step(scaler, optimizer, lr_schedule)
+            project_minmax_scales(wrapper_linear)
 
         last_loss = total_loss
-        best_iter = self.iters
+        best_iter = i + 1
         if not self.not_use_best_mse:
             last_loss = best_loss
             best_iter = last_best_iter
@@ -976,7 +1339,7 @@ class AutoRound(object):
         dump_info = f"quantized {layer_name},  loss iter 0: {init_loss:.6f} -> iter {best_iter}: {last_loss:.6f}"
         logger.info(dump_info)
 
-    def quant_block(self, block, input_ids, input_others, q_input=None, device=torch.device("cpu")):
+    def quant_block(self, block, input_ids, input_others, q_input=None, device=torch.device("cpu"), block_name=None):
         """Quantize the weights of a given block of the model.
 
         Args:
@@ -985,6 +1348,7 @@ class AutoRound(object):
         input_others: A dictionary containing additional input data.
         q_input: The quantized input tensor.
         device: The device for quantization.
+        block_name: The name of the block in the logs of the early stopping.
 
         Returns:
         Tuple: (q_outputs, output) if self.enable_quanted_input is True, else (None, output)
@@ -997,7 +1361,7 @@ class AutoRound(object):
             input_ids = q_input
 
         quantized_layer_names, unquantized_layer_names = wrapper_block(
-            block, self.enable_minmax_tuning, device=self.device)
+            block, self.enable_minmax_tuning, device=self.device, enable_fused_qdq=self.enable_fused_qdq)
 
         round_params = []
         minmax_params = []
@@ -1039,10 +1403,12 @@ class AutoRound(object):
         scaler = self.get_scaler()  # pylint: disable=assignment-from-none
         init_loss = None
         best_v, best_min_scale, best_max_scale = torch.tensor(0), torch.tensor(1.0), torch.tensor(1.0)
+        convergence_detector = self.get_convergence_detector()
         for i in range(self.iters):
             total_loss = 0
             if self.sampler == "rand":
                 whole_indices = torch.randperm(nsamples)[:pick_samples]
+            cache_qdq_weights(block)
             for tmp_step in range(self.gradient_accumulate_steps):
                 indices = whole_indices[tmp_step * self.train_bs: (tmp_step + 1) * self.train_bs]
                 current_input_ids, current_input_others = sampling_inputs(
@@ -1055,10 +1421,7 @@ class AutoRound(object):
                     input_dim=self.input_dim,
                 )
 
-                current_output = [output[i] for i in indices]
-                current_output = torch.cat(current_output, dim=self.input_dim)
-
-                current_output = to_device(current_output, device)
+                current_output = output.gather(indices, device)
 
                 output_q = block_forward(
                     block, current_input_ids, current_input_others, self.amp, self.amp_dtype, device
@@ -1071,8 +1434,11 @@ class AutoRound(object):
                         output_q.to(torch.float32), current_output.to(torch.float32)
                     )
 
-                total_loss += loss.item() / self.gradient_accumulate_steps
+                ## accumulated on the device and copied to the host once per iteration
+                total_loss += loss.detach().float() / self.gradient_accumulate_steps
                 self.scale_loss_and_backward(scaler, loss)
+            release_qdq_weights(block)
+            total_loss = total_loss.item()
             if i == 0:
                 init_loss = total_loss
 
@@ -1090,10 +1456,17 @@ class AutoRound(object):
             if not self.not_use_best_mse:
                 if self.dynamic_max_gap > 0 and i - last_best_iter >= self.dynamic_max_gap:
                     break
+            if convergence_detector is not None and convergence_detector.update(total_loss):
+                if self.not_use_best_mse:
+                    best_v = collect_round_v(block)
+                    best_min_scale, best_max_scale = collect_minmax_scale(block)
+                self.log_early_stop(block_name or block.__class__.__name__, i + 1)
+                break
             self.step(scaler, optimizer, lr_schedule)
+            project_minmax_scales(block)
 
         last_loss = total_loss
-        best_iter = self.iters
+        best_iter = i + 1
         if not self.not_use_best_mse:
             last_loss = best_loss
             best_iter = last_best_iter
@@ -1136,6 +1509,11 @@ class AutoRound(object):
         fine_tune_block_name: str = "unk_layer",
         attach_loss_block_name: str = "unk_layer",
         observe_block_name: str = "unk_layer",
+        first_block_idx: int = None,
+        fp_output_cache: dict = None,
+        iters: int = None,
+        probe: bool = False,
+        tuned_params: dict = None,
     ):
         """Quantize the weights of a given block of the model.
 
@@ -1145,43 +1523,92 @@ class AutoRound(object):
         input_others: A dictionary containing additional input data.
         q_input: The quantized input tensor.
         device: The device for quantization.
+        first_block_idx: The index of the first fine tune block, required by fp_output_cache.
+        fp_output_cache: The full precision outputs of the blocks keyed by block index, shared by consecutive
+                         windows, missing outputs are computed and added to it.
+        iters: The number of tuning iterations, self.iters by default.
+        probe: Whether this is a probe run of the iteration budget scheduler, which logs no metrics, restores
+               the full precision layers of the fine tune block and returns the attach loss of every iteration
+               in place of the observe block mses.
+        tuned_params: The rounding values and min-max scales of the fine tune block, keyed by v, min_scale and
+                      max_scale. The values it holds initialize the tuning, the best ones are stored in it.
 
         Returns:
-        Tuple: (q_outputs, output) if self.enable_quanted_input is True, else (None, output)
+        Tuple: (q_outputs, output, mses_observe_block), q_outputs is None if self.enable_quanted_input is False
+        or for a probe run.
         """
+        if iters is None:
+            iters = self.iters
         fine_tune_block, attach_loss_block, observe_block = combined_block.layers
-        fine_tune_block_outputs = self.get_block_outputs(
-            fine_tune_block, 
-            input_ids, 
-            input_others, 
-            self.train_bs * self.infer_bs_coeff, 
-            device, 
-            self.cache_device
-        )
+        if self.enable_gradient_checkpointing:
+            for block in combined_block.layers:
+                block.checkpoint_granularity = self.checkpoint_granularity
+        observe_schedule = "never" if probe else self.observe_schedule
+        observe_indices = None
+        if observe_schedule in ["every", "end"]:
+            ## the same samples at every observation, drawn without touching the seeded tuning randomness and not
+            ## held out of the training samples, since holding them out would make the tuning depend on the schedule
+            generator = torch.Generator().manual_seed(self.seed)
+            observe_indices = torch.randperm(len(input_ids), generator=generator)[:self.observe_nsamples]
+        self.profiler.begin("fp_outputs", block=fine_tune_block_name)
+        if fp_output_cache is not None:
+            blocks = list(fine_tune_block.layers) + list(attach_loss_block.layers) + list(observe_block.layers)
+            block_outputs = self.get_cached_block_outputs(
+                blocks, first_block_idx, input_ids, input_others, device, fp_output_cache)
+            attach_loss_block_start_idx = len(fine_tune_block.layers)
+            observe_block_start_idx = attach_loss_block_start_idx + len(attach_loss_block.layers)
+            fine_tune_block_outputs = block_outputs[attach_loss_block_start_idx - 1]
+            attach_loss_block_outputs = block_outputs[observe_block_start_idx - 1]
+            observe_block_outputs = block_outputs[-1]
+            if observe_indices is not None:
+                observe_block_outputs = ActivationStore.from_tensor(
+                    observe_block_outputs.gather(observe_indices), dim=self.input_dim)
+        else:
+            fine_tune_block_outputs = self.get_block_outputs(
+                fine_tune_block, 
+                input_ids, 
+                input_others, 
+                self.train_bs * self.infer_bs_coeff, 
+                device, 
+                self.cache_device
+            )
 
-        attach_loss_block_outputs = self.get_block_outputs(
-            attach_loss_block, 
-            fine_tune_block_outputs, 
-            input_others, 
-            self.train_bs * self.infer_bs_coeff, 
-            device,
-            self.cache_device
-        )
-        
-        observe_block_outputs = self.get_block_outputs(
-            observe_block, 
-            attach_loss_block_outputs,
-            input_others, 
-            self.train_bs * self.infer_bs_coeff, 
-            device,
-            self.cache_device
-        )
+            attach_loss_block_outputs = self.get_block_outputs(
+                attach_loss_block, 
+                fine_tune_block_outputs, 
+                input_others, 
+                self.train_bs * self.infer_bs_coeff, 
+                device,
+                self.cache_device
+            )
+            
+            ## the full precision outputs of the observe block are only computed for the observed samples
+            observe_block_outputs = None
+            if observe_schedule != "never":
+                observe_block_outputs = self.get_block_outputs(
+                    observe_block, 
+                    attach_loss_block_outputs,
+                    input_others, 
+                    self.train_bs * self.infer_bs_coeff, 
+                    device,
+                    self.cache_device,
+                    indices=observe_indices,
+                )
+        self.profiler.end()
 
         if q_input is not None:
             input_ids = q_input
 
         quantized_layer_names, unquantized_layer_names = wrapper_block(
-            fine_tune_block, self.enable_minmax_tuning, device=self.device)
+            fine_tune_block, self.enable_minmax_tuning, device=self.device, enable_fused_qdq=self.enable_fused_qdq)
+        if tuned_params:
+            with torch.no_grad():
+                for n, m in fine_tune_block.named_modules():
+                    if hasattr(m, "orig_layer"):
+                        m.value.copy_(tuned_params["v"][n])
+                        if self.enable_minmax_tuning:
+                            m.min_scale.copy_(tuned_params["min_scale"][n])
+                            m.max_scale.copy_(tuned_params["max_scale"][n])
 
         round_params = []
         minmax_params = []
@@ -1204,12 +1631,12 @@ class AutoRound(object):
                 f"layers in the block"
             )
             logger.info(dump_info)
-            return fine_tune_block_outputs, fine_tune_block_outputs
+            return fine_tune_block_outputs, fine_tune_block_outputs, []
 
         if self.enable_lr_scheduler:
             if self.lr_scheduler is None:
                 lr_schedule = torch.optim.lr_scheduler.LinearLR(
-                    optimizer, start_factor=1.0, end_factor=0.0, total_iters=self.iters, verbose=False
+                    optimizer, start_factor=1.0, end_factor=0.0, total_iters=iters, verbose=False
                 )
             else:
                 lr_schedule = copy.deepcopy(self.lr_scheduler)
@@ -1220,34 +1647,36 @@ class AutoRound(object):
         nsamples = len(input_ids)
         if self.sampler != "rand":
             whole_indices = torch.randperm(nsamples)[:pick_samples]
-        last_best_iter = 0
-        best_loss = torch.finfo(torch.float).max
+        ## the best loss, its iteration and its values are tracked on the device, see update_best_params
+        last_best_iter = torch.tensor(0, device=device)
+        best_loss = torch.tensor(torch.finfo(torch.float).max, device=device)
+        best_params = {"v": {}, "min_scale": {}, "max_scale": {}}
         mse_loss = torch.nn.MSELoss().to(device)
         scaler = self.get_scaler()  # pylint: disable=assignment-from-none
         init_loss = None
         best_v, best_min_scale, best_max_scale = torch.tensor(0), torch.tensor(1.0), torch.tensor(1.0)
         
-        if not self.disable_wandb:
-            wandb.define_metric(f"iter_count/{fine_tune_block_name}->{observe_block_name}")
-            wandb.define_metric(
-                f"attach_loss_block_mse/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}", 
-                step_metric=f"iter_count/{fine_tune_block_name}->{observe_block_name}"
-            )
-            wandb.define_metric(
-                f"observe_block_mse/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}", 
-                step_metric=f"iter_count/{fine_tune_block_name}->{observe_block_name}"
-            )
-            wandb.define_metric(
-                f"lr/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}", 
-                step_metric=f"iter_count/{fine_tune_block_name}->{observe_block_name}"
-            )
-        
-        mses_observe_block = []
-        for i in range(self.iters):
+        step_metric = f"iter_count/{fine_tune_block_name}->{observe_block_name}"
+        attach_loss_metric = f"attach_loss_block_mse/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}"
+        observe_metric = f"observe_block_mse/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}"
+        lr_metric = f"lr/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}"
+        if self.metrics is not None:
+            self.metrics.define_metric(step_metric)
+            for metric in [attach_loss_metric, observe_metric, lr_metric]:
+                self.metrics.define_metric(metric, step_metric=step_metric)
+        ## the losses stay on the device and are copied to the host every metrics_flush_interval iterations
+        metrics_buffer = MetricsBuffer(None if probe else self.metrics, self.metrics_flush_interval)
+        convergence_detector = None if probe else self.get_convergence_detector()
+        observe_iters = []
+
+        self.profiler.begin("probe" if probe else "tune", block=fine_tune_block_name)
+        for i in range(iters):
             total_attach_loss_block_mse = 0
             total_observe_block_mse = 0
             if self.sampler == "rand":
                 whole_indices = torch.randperm(nsamples)[:pick_samples]
+            ## the weights are fake quantized once per iteration, not once per micro-batch
+            cache_qdq_weights(fine_tune_block)
             for tmp_step in range(self.gradient_accumulate_steps):
                 indices = whole_indices[tmp_step * self.train_bs: (tmp_step + 1) * self.train_bs]
                 current_input_ids, current_input_others = sampling_inputs(
@@ -1259,16 +1688,16 @@ class AutoRound(object):
                     not_share_position_ids_flag=self.not_share_position_ids_flag,
                     input_dim=self.input_dim,
                 )
+                ## the other inputs of the batch are moved once and shared by the forwards of all the blocks
+                current_input_others = to_device(current_input_others, device)
 
-                high_precision_attach_loss_block_output = [attach_loss_block_outputs[i] for i in indices]
-                high_precision_attach_loss_block_output = torch.cat(high_precision_attach_loss_block_output, dim=self.input_dim)
-                high_precision_attach_loss_block_output = to_device(high_precision_attach_loss_block_output, device)
+                high_precision_attach_loss_block_output = attach_loss_block_outputs.gather(indices, device)
 
                 quantized_fine_tune_block_output = block_forward(
-                    fine_tune_block, current_input_ids, copy.deepcopy(current_input_others), self.amp, self.amp_dtype, device
+                    fine_tune_block, current_input_ids, current_input_others, self.amp, self.amp_dtype, device
                 )
                 quantized_attach_loss_block_output = block_forward(
-                    attach_loss_block, quantized_fine_tune_block_output, copy.deepcopy(current_input_others), self.amp, self.amp_dtype, device
+                    attach_loss_block, quantized_fine_tune_block_output, current_input_others, self.amp, self.amp_dtype, device
                 )
                 quantized_fine_tune_block_output = None
                 del quantized_fine_tune_block_output
@@ -1292,30 +1721,35 @@ class AutoRound(object):
                 del high_precision_attach_loss_block_output
                 torch.cuda.empty_cache()
                 
-                # Observe
-                high_precision_observe_block_output = [observe_block_outputs[i] for i in indices]
-                high_precision_observe_block_output = torch.cat(high_precision_observe_block_output, dim=self.input_dim)
-                high_precision_observe_block_output = to_device(high_precision_observe_block_output, device)
-                
-                quantized_observe_block_output = block_forward(
-                    observe_block, quantized_attach_loss_block_output, copy.deepcopy(current_input_others), self.amp, self.amp_dtype, device
-                )
-                
-                quantized_attach_loss_block_output = None
-                del quantized_attach_loss_block_output
-                torch.cuda.empty_cache()
+                total_attach_loss_block_mse += attach_loss_block_mse.detach().float() / self.gradient_accumulate_steps
+                self.scale_loss_and_backward(scaler, attach_loss_block_mse)
+                if observe_schedule != "step":
+                    continue
+
+                # Observe, without building a graph on the output whose backward already ran
+                high_precision_observe_block_output = observe_block_outputs.gather(indices, device)
                 
-                if self.amp:
-                    with autocast(device_type=device.split(":")[0], dtype=self.amp_dtype):
-                        observe_block_mse = mse_loss(
-                            quantized_observe_block_output, 
-                            high_precision_observe_block_output,
-                        )  # pylint: disable=not-callable
-                else:
-                    observe_block_mse = mse_loss(  # pylint: disable=not-callable
-                        quantized_observe_block_output.to(torch.float32), 
-                        high_precision_observe_block_output.to(torch.float32)
+                with torch.no_grad():
+                    quantized_observe_block_output = block_forward(
+                        observe_block, quantized_attach_loss_block_output, current_input_others, self.amp,
+                        self.amp_dtype, device
                     )
+
+                    quantized_attach_loss_block_output = None
+                    del quantized_attach_loss_block_output
+                    torch.cuda.empty_cache()
+
+                    if self.amp:
+                        with autocast(device_type=device.split(":")[0], dtype=self.amp_dtype):
+                            observe_block_mse = mse_loss(
+                                quantized_observe_block_output, 
+                                high_precision_observe_block_output,
+                            )  # pylint: disable=not-callable
+                    else:
+                        observe_block_mse = mse_loss(  # pylint: disable=not-callable
+                            quantized_observe_block_output.to(torch.float32), 
+                            high_precision_observe_block_output.to(torch.float32)
+                        )
                 
                 high_precision_observe_block_output = None
                 quantized_observe_block_output = None
@@ -1323,63 +1757,93 @@ class AutoRound(object):
                 del quantized_observe_block_output
                 torch.cuda.empty_cache()
 
-                total_attach_loss_block_mse += attach_loss_block_mse.item() / self.gradient_accumulate_steps
-                self.scale_loss_and_backward(scaler, attach_loss_block_mse)
-                total_observe_block_mse += observe_block_mse.item() / self.gradient_accumulate_steps
+                total_observe_block_mse += observe_block_mse.detach().float() / self.gradient_accumulate_steps
 
-            mses_observe_block.append(total_observe_block_mse)
-            
-            if i == 0:
-                init_loss = total_attach_loss_block_mse
+            release_qdq_weights(fine_tune_block)
+            learning_rate = lr_schedule.get_last_lr()[0] if lr_schedule is not None else self.lr
+            record = {step_metric: i, attach_loss_metric: total_attach_loss_block_mse, lr_metric: learning_rate}
+            if observe_schedule == "step":
+                record[observe_metric] = total_observe_block_mse
+            elif observe_schedule == "every" and i % self.observe_interval == 0:
+                with self.profiler.phase("observe", block=fine_tune_block_name):
+                    record[observe_metric] = self.get_observe_block_mse(
+                        combined_block, input_ids, input_others, observe_block_outputs, observe_indices, device)
+                observe_iters.append(i)
+            metrics_buffer.log(record)
 
-            if total_attach_loss_block_mse < best_loss:
-                best_loss = total_attach_loss_block_mse
-                if not self.not_use_best_mse:
-                    # print(f"get better result at iter {i}, the loss is {total_attach_loss_block_mse}", flush=True)
-                    best_v = collect_round_v(fine_tune_block)
-                    best_min_scale, best_max_scale = collect_minmax_scale(fine_tune_block)
-                    last_best_iter = i
-            if self.not_use_best_mse and i == self.iters - 1:
+            if not self.not_use_best_mse:
+                improved = torch.lt(total_attach_loss_block_mse, best_loss)
+                best_loss = torch.where(improved, total_attach_loss_block_mse, best_loss)
+                last_best_iter = torch.where(improved, i, last_best_iter)
+                update_best_params(fine_tune_block, best_params, improved)
+                best_v, best_min_scale, best_max_scale = (
+                    best_params["v"], best_params["min_scale"], best_params["max_scale"])
+            if self.not_use_best_mse and i == iters - 1:
                 best_v = collect_round_v(fine_tune_block)
                 best_min_scale, best_max_scale = collect_minmax_scale(fine_tune_block)
 
             if not self.not_use_best_mse:
-                if self.dynamic_max_gap > 0 and i - last_best_iter >= self.dynamic_max_gap:
+                ## the best iteration is only copied to the host when the gap needs it
+                if self.dynamic_max_gap > 0 and i - last_best_iter.item() >= self.dynamic_max_gap:
                     break
+            if convergence_detector is not None and convergence_detector.update(total_attach_loss_block_mse):
+                if self.not_use_best_mse:
+                    best_v = collect_round_v(fine_tune_block)
+                    best_min_scale, best_max_scale = collect_minmax_scale(fine_tune_block)
+                self.log_early_stop(fine_tune_block_name, i + 1, iters)
+                break
             self.step(scaler, optimizer, lr_schedule)
-            if not self.disable_wandb:
-                learning_rate = lr_schedule.get_last_lr()[0] if lr_schedule is not None else self.lr
-                wandb.log(
-                    data={
-                        f"iter_count/{fine_tune_block_name}->{observe_block_name}": i,
-                        f"attach_loss_block_mse/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}": total_attach_loss_block_mse,
-                        f"observe_block_mse/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}": total_observe_block_mse,
-                        f"lr/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}": learning_rate,
-                    }, 
-                )
-
-        last_loss = total_attach_loss_block_mse
-        best_iter = self.iters
+            project_minmax_scales(fine_tune_block)
+
+        mses_attach_loss_block = metrics_buffer.values(attach_loss_metric)
+        self.profiler.end()
+        if probe:
+            for n, m in list(fine_tune_block.named_modules()):
+                if hasattr(m, "orig_layer"):
+                    set_module(fine_tune_block, n, m.orig_layer)
+            logger.info(
+                f"probed {fine_tune_block_name}, loss iter 0: {mses_attach_loss_block[0]:.6f} -> "
+                f"iter {iters}: {mses_attach_loss_block[-1]:.6f}")
+            return None, fine_tune_block_outputs, mses_attach_loss_block
+        if tuned_params is not None:
+            tuned_params.update(v=best_v, min_scale=best_min_scale, max_scale=best_max_scale)
+        with self.profiler.phase("unwrap", block=fine_tune_block_name), torch.no_grad():
+            unwrapper_block(fine_tune_block, best_v, best_min_scale, best_max_scale)
+        if observe_schedule == "end":
+            with self.profiler.phase("observe", block=fine_tune_block_name):
+                observe_iters.append(len(mses_attach_loss_block) - 1)
+                metrics_buffer.log({
+                    step_metric: observe_iters[-1],
+                    observe_metric: self.get_observe_block_mse(
+                        combined_block, input_ids, input_others, observe_block_outputs, observe_indices, device),
+                })
+        mses_observe_block = metrics_buffer.values(observe_metric)
+        if observe_schedule != "step":
+            self.observe_iters[fine_tune_block_name] = observe_iters
+        init_loss = mses_attach_loss_block[0]
+        last_loss = mses_attach_loss_block[-1]
+        best_iter = len(mses_attach_loss_block)
         if not self.not_use_best_mse:
-            last_loss = best_loss
-            best_iter = last_best_iter
+            last_loss = best_loss.item()
+            best_iter = last_best_iter.item()
         dump_info = (
             f"quantized {len(quantized_layer_names)}/{(len(quantized_layer_names) + len(unquantized_layer_names))} "
             f"layers in the block, loss iter 0: {init_loss:.6f} -> iter {best_iter}: {last_loss:.6f}"
-            f", observe block mse: {total_observe_block_mse:.6f}"
         )
+        if len(mses_observe_block) > 0:
+            dump_info += f", observe block mse: {mses_observe_block[-1]:.6f}"
         logger.info(dump_info)
         if len(unquantized_layer_names) != 0:
             logger.info(f"{unquantized_layer_names} have not been quantized")
-        with torch.no_grad():
-            unwrapper_block(fine_tune_block, best_v, best_min_scale, best_max_scale)
         if self.enable_quanted_input:
+            self.profiler.begin("q_outputs", block=fine_tune_block_name)
             fine_tune_block = fine_tune_block.to(device)
             q_outputs = self.get_block_outputs(
                 fine_tune_block, input_ids, input_others, self.train_bs * self.infer_bs_coeff, device,
                 cache_device=self.cache_device
             )
             fine_tune_block = mv_module_from_gpu(fine_tune_block, self.low_cpu_mem_usage)
+            self.profiler.end()
             # for i in range(len(input_ids)):
             #     input_ids[i] = None
             # torch.cuda.empty_cache()
@@ -1393,6 +1857,421 @@ class AutoRound(object):
             return None, fine_tune_block_outputs, mses_observe_block
 
 
+    @torch.no_grad()
+    def get_observe_block_mse(self, combined_block, input_ids, input_others, observe_block_outputs, indices, device):
+        """Computes the mse of the outputs of the observe block to the full precision ones on the samples at
+        indices, running the fine tune, attach loss and observe blocks in batches of train_bs * infer_bs_coeff.
+
+        Args:
+        combined_block: The fine tune, attach loss and observe blocks.
+        input_ids: The inputs of the fine tune block.
+        input_others: A dictionary containing additional input data.
+        observe_block_outputs: The full precision outputs of the observe block on the samples at indices, in
+                               their order.
+        indices: The indices of the samples.
+        device: The device for computation.
+
+        Returns:
+        torch.Tensor: The mse, on the device.
+        """
+        bs = self.train_bs * self.infer_bs_coeff
+        squared_error, numel = 0, 0
+        for i in range(0, len(indices), bs):
+            batch_indices = indices[i: i + bs]
+            current_input_ids, current_input_others = sampling_inputs(
+                input_ids,
+                input_others,
+                batch_indices,
+                seqlen=self.seqlen,
+                share_attention_mask_flag=self.share_attention_mask_flag,
+                not_share_position_ids_flag=self.not_share_position_ids_flag,
+                input_dim=self.input_dim,
+            )
+            output = current_input_ids
+            for block in combined_block.layers:
+                output = block_forward(block, output, current_input_others, self.amp, self.amp_dtype, device)
+            high_precision_output = observe_block_outputs.gather(torch.arange(i, i + len(batch_indices)), device)
+            squared_error += torch.sum((output.float() - high_precision_output.float()) ** 2)
+            numel += output.numel()
+        return squared_error / numel
+
+    def prepare_block_inputs(self, inputs):
+        """Splits the cached inputs of a block into its input ids and other inputs, on the cache device and in the
+        tuning dtype.
+
+        Args:
+        inputs: The cached inputs of the block, input_ids is popped from it.
+
+        Returns:
+        Tuple: (input_ids, input_others)
+        """
+        input_ids = inputs["input_ids"]
+        inputs.pop("input_ids", None)
+        input_others = inputs
+        torch.cuda.empty_cache()
+        input_ids = to_device(input_ids, self.cache_device)
+        input_others = to_device(input_others, self.cache_device)
+        ## as in calibration phase, we may use bf16 for calibration due to low_gpu_memory usage
+        tmp_dtype = self.amp_dtype if self.amp else torch.float32
+        input_ids = to_dtype(input_ids, tmp_dtype)
+
+        for key in input_others.keys():
+            if isinstance(input_others[key], torch.Tensor) and (
+                    input_others[key].dtype == torch.float16 or input_others[key].dtype == torch.bfloat16
+            ):
+                input_others[key] = input_others[key].to(tmp_dtype)
+            elif isinstance(input_others[key], list):
+                for i in range(len(input_others[key])):
+                    input_others[key][i].to(tmp_dtype)
+        return input_ids, input_others
+
+    def get_all_block_indices(self, total_num_blocks, nblocks=None, block_step_size=None, num_lookahead_blocks=None,
+                              num_observe_blocks=None):
+        """Lists the block index ranges of every tuning window, see get_block_indices, the unset arguments
+        default to the attributes of the same name."""
+        return list(
+            get_block_indices(
+                nblocks=nblocks if nblocks is not None else self.nblocks,
+                block_step_size=block_step_size if block_step_size is not None else self.block_step_size,
+                num_lookahead_blocks=(
+                    num_lookahead_blocks if num_lookahead_blocks is not None else self.num_lookahead_blocks),
+                num_observe_blocks=num_observe_blocks if num_observe_blocks is not None else self.num_observe_blocks,
+                total_num_blocks=total_num_blocks,
+            )
+        )
+
+    def get_window_block(self, model, block_names, window_indices, device):
+        """Builds the combined block of a tuning window.
+
+        Args:
+        model: The PyTorch model.
+        block_names: The names of the blocks of the model.
+        window_indices: The fine tune, attach loss and observe block index ranges of the window.
+        device: The device the blocks are moved to.
+
+        Returns:
+        Tuple: (combined_block, names), names holds the formatted names of the last fine tune, attach loss and
+        observe blocks.
+        """
+        fine_tune_block_indices, attach_loss_block_indices, observe_block_indices = window_indices
+        fine_tune_block_names = block_names[fine_tune_block_indices]
+        logger.info(f"fine tune block {fine_tune_block_names}")
+        fine_tune_block = WrapperMultiblock(
+            [get_module(model, fine_tune_block_name) for fine_tune_block_name in fine_tune_block_names]
+        )
+
+        attach_loss_block_names = block_names[attach_loss_block_indices]
+        attach_loss_block = WrapperMultiblock(
+            [get_module(model, attach_loss_block_name) for attach_loss_block_name in attach_loss_block_names]
+        )
+        if len(attach_loss_block_names) == 0:
+            attach_loss_block_names = fine_tune_block_names
+        logger.info(f"attach loss block {attach_loss_block_names}")
+
+        observe_block_names = block_names[observe_block_indices]
+        observe_block = WrapperMultiblock(
+            [get_module(model, observe_block_name) for observe_block_name in observe_block_names]
+        )
+        if len(observe_block_names) == 0:
+            observe_block_names = attach_loss_block_names
+        logger.info(f"observe block {observe_block_names}")
+
+        combined_block = WrapperMultiblock([fine_tune_block, attach_loss_block, observe_block])
+        combined_block = combined_block.to(device)
+        names = [
+            format_layer_name(window_block_names if isinstance(window_block_names, str) else window_block_names[-1])
+            for window_block_names in [fine_tune_block_names, attach_loss_block_names, observe_block_names]
+        ]
+        return combined_block, names
+
+    def schedule_window_iters(self, model, block_names, all_block_indices, input_ids, input_others, device):
+        """Probes every tuning window on its full precision inputs and splits the iteration budget among them.
+
+        Args:
+        model: The PyTorch model.
+        block_names: The names of the blocks of the model.
+        all_block_indices: The block index ranges of every window, see get_block_indices.
+        input_ids: The full precision inputs of the first block.
+        input_others: A dictionary containing additional input data.
+        device: The device for the probes.
+
+        Returns:
+        list: The number of tuning iterations of every window.
+        """
+        scheduler = IterationBudgetScheduler(
+            len(all_block_indices), self.iters, probe_iters=self.budget_probe_iters, min_iters=self.budget_min_iters,
+            max_iters=self.budget_max_iters)
+        ## the probes change no weight, so the full precision inputs of a window are those of the model
+        window_input_ids = input_ids
+        window_first_block_idx = 0
+        for window_idx, window_indices in enumerate(all_block_indices):
+            torch.manual_seed(self.seed + window_idx)
+            first_block_idx = window_indices[0].start
+            if first_block_idx > window_first_block_idx:
+                skipped_block = WrapperMultiblock(
+                    [get_module(model, block_name) for block_name in block_names[window_first_block_idx:first_block_idx]]
+                ).to(device)
+                window_input_ids = self.get_block_outputs(
+                    skipped_block, window_input_ids, input_others, self.train_bs * self.infer_bs_coeff, device,
+                    self.cache_device)
+                window_first_block_idx = first_block_idx
+            combined_block, window_names = self.get_window_block(model, block_names, window_indices, device)
+            _, _, probe_losses = self.quant_block_with_lookahead(
+                combined_block,
+                window_input_ids,
+                input_others,
+                device=device,
+                fine_tune_block_name=window_names[0],
+                attach_loss_block_name=window_names[1],
+                observe_block_name=window_names[2],
+                iters=self.budget_probe_iters,
+                probe=True,
+            )
+            if len(probe_losses) == 0:
+                ## no layer to tune in the window
+                probe_losses = [0.0] * self.budget_probe_iters
+            scheduler.add_probe(window_names[0], probe_losses)
+            self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+            torch.cuda.empty_cache()
+        self.block_iters = scheduler.allocate()
+        return list(self.block_iters.values())
+
+    def is_block_parallel(self):
+        """Whether quantize tunes the windows of blocks with quant_blocks_parallel rather than quant_blocks."""
+        if self.isolation_experiment_v2:
+            return False
+        if self.enable_quanted_input:
+            return self.pipeline_staleness > 0
+        return self.num_block_workers > 1
+
+    def quant_blocks_parallel(self, model: torch.nn.Module, inputs, all_inputs, block_names, device="cpu"):
+        """Tunes the windows of blocks concurrently, in waves of windows tuned by the workers of an
+        AblationScheduler with num_block_workers workers. The workers are started once, with the model, and every
+        job sends a worker the inputs of its window, a window only reads its own fine tune blocks and the full
+        precision blocks after them. The tuned fine tune blocks are set back into the model after every wave.
+
+        With enable_quanted_input=False the windows are independent, since every window is tuned on its full
+        precision inputs, and all of them form a single wave. With enable_quanted_input=True a wave holds
+        pipeline_staleness + 1 windows. The first window of a wave is tuned on its exact quantized input. Every
+        later window is tuned on an approximation of it, the output of the round to nearest quantization of the
+        windows before it in the wave, whose tuning has not landed yet. Once a wave lands, the exact quantized
+        input of the next wave is computed through its tuned blocks. With pipeline_retune_iters, the later windows
+        of the wave are first re-tuned on their exact quantized inputs for pipeline_retune_iters iterations, one
+        by one in the current process, starting from their tuned values.
+
+        Args:
+        model: The PyTorch model to be quantized.
+        inputs: The cached inputs of the first block.
+        all_inputs: The cached inputs of the first blocks of the other windows, keyed by block name, they are
+                    popped from it.
+        block_names: The names of the blocks to be quantized.
+        device: The device of the tuning in the current process.
+
+        Returns:
+        None
+        """
+        for n, m in model.named_parameters():
+            m.requires_grad_(False)
+        all_block_indices = self.get_all_block_indices(len(block_names))
+        ## the inputs of a window are sent with its job, they are not kept on self, which is pickled into the workers
+        window_inputs = []
+        for window_indices in all_block_indices:
+            first_block_idx = window_indices[0].start
+            first_block_inputs = inputs if first_block_idx == 0 else all_inputs.pop(block_names[first_block_idx])
+            window_inputs.append(self.prepare_block_inputs(first_block_inputs))
+
+        window_iters = [None] * len(all_block_indices)
+        if self.enable_budget_scheduler:
+            with self.profiler.phase("budget"):
+                window_iters = self.schedule_window_iters(
+                    model, block_names, all_block_indices, *window_inputs[0], device)
+
+        wave_size = self.pipeline_staleness + 1 if self.enable_quanted_input else len(all_block_indices)
+        retune = self.enable_quanted_input and self.pipeline_retune_iters > 0
+        q_input = None
+        with AblationScheduler(self.num_block_workers, device=device) as scheduler:
+            for wave_start in range(0, len(all_block_indices), wave_size):
+                wave = range(wave_start, min(wave_start + wave_size, len(all_block_indices)))
+                input_others = window_inputs[wave_start][1]
+                ## the first window of the model is tuned on its full precision input, as in quant_blocks
+                wave_input = q_input
+                stale_windows = wave[1:] if retune else []
+                ## the full precision fine tune blocks of the stale windows, from which they are re-tuned
+                fp_blocks = {
+                    block_name: copy.deepcopy(get_module(model, block_name))
+                    for window_idx in stale_windows for block_name in block_names[all_block_indices[window_idx][0]]
+                }
+                jobs = [
+                    (wave_start, all_block_indices[wave_start], *window_inputs[wave_start], window_iters[wave_start],
+                     q_input, None)
+                ]
+                with self.profiler.phase("approx_inputs"):
+                    approx_input = q_input if q_input is not None else window_inputs[wave_start][0]
+                    for window_idx in wave[1:]:
+                        if self.enable_quanted_input:
+                            rtn_block = self.get_rtn_block(
+                                [get_module(model, name) for name in block_names[all_block_indices[window_idx - 1][0]]],
+                                device)
+                            approx_input = self.get_block_outputs(
+                                rtn_block, approx_input, input_others, self.train_bs * self.infer_bs_coeff, device,
+                                self.cache_device)
+                        jobs.append(
+                            (window_idx, all_block_indices[window_idx], *window_inputs[window_idx],
+                             window_iters[window_idx], approx_input if self.enable_quanted_input else None,
+                             {} if window_idx in stale_windows else None))
+                    rtn_block, approx_input = None, None
+
+                tuned_params = {}
+                with self.profiler.phase("parallel_tune"):
+                    for job, result in scheduler.run(self.tune_window, jobs, shared=(block_names,)):
+                        for block_name, block in result["blocks"].items():
+                            set_module(model, block_name, block)
+                        tuned_params[job[0]] = result["tuned_params"]
+                        if result["early_stop"] is not None:
+                            self.early_stopped_iters[result["names"][0]] = result["early_stop"]
+                        if self.metrics is not None and scheduler.num_workers > 1:
+                            self.log_observe_block_mses(
+                                result["mses_observe_block"], *result["names"], observe_iters=result["observe_iters"])
+                jobs = None
+
+                if len(stale_windows) > 0:
+                    with self.profiler.phase("retune"):
+                        q_input = self.retune_stale_windows(
+                            model, block_names, all_block_indices, wave, window_inputs, wave_input, fp_blocks,
+                            tuned_params, device)
+                elif self.enable_quanted_input and wave.stop < len(all_block_indices):
+                    with self.profiler.phase("window_inputs"):
+                        wave_block_names = block_names[all_block_indices[wave_start][0].start:
+                                                       all_block_indices[wave.stop - 1][0].stop]
+                        wave_block = WrapperMultiblock(
+                            [get_module(model, block_name) for block_name in wave_block_names]).to(device)
+                        q_input = self.get_block_outputs(
+                            wave_block, wave_input if wave_input is not None else window_inputs[wave_start][0],
+                            input_others, self.train_bs * self.infer_bs_coeff, device, self.cache_device)
+                        self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+        self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+        torch.cuda.empty_cache()
+
+    def retune_stale_windows(
+            self, model, block_names, all_block_indices, wave, window_inputs, wave_input, fp_blocks, tuned_params,
+            device):
+        """Re-tunes the windows of a wave of quant_blocks_parallel that were tuned on approximate inputs, one by
+        one on their exact quantized inputs, for pipeline_retune_iters iterations from their tuned values.
+
+        Args:
+        model: The PyTorch model to be quantized.
+        block_names: The names of the blocks.
+        all_block_indices: The fine tune, attach loss and observe block index ranges of every window.
+        wave: The range of the indices of the windows of the wave.
+        window_inputs: The full precision input_ids and input_others of every window.
+        wave_input: The exact quantized input of the first window of the wave, None for its full precision input.
+        fp_blocks: The full precision fine tune blocks of the re-tuned windows keyed by name, they are set back
+                   into the model before the re-tuning.
+        tuned_params: The rounding values and min-max scales of the re-tuned windows keyed by window index.
+        device: The device for quantization.
+
+        Returns:
+        The exact quantized input of the window after the wave.
+        """
+        q_input = wave_input if wave_input is not None else window_inputs[wave[0]][0]
+        for window_idx in wave:
+            fine_tune_block_names = block_names[all_block_indices[window_idx][0]]
+            if window_idx == wave[0]:
+                window_block = WrapperMultiblock(
+                    [get_module(model, block_name) for block_name in fine_tune_block_names]).to(device)
+                q_input = self.get_block_outputs(
+                    window_block, q_input, window_inputs[window_idx][1], self.train_bs * self.infer_bs_coeff, device,
+                    self.cache_device)
+            else:
+                for block_name in fine_tune_block_names:
+                    set_module(model, block_name, fp_blocks.pop(block_name))
+                torch.manual_seed(self.seed + window_idx)
+                combined_block, window_names = self.get_window_block(
+                    model, block_names, all_block_indices[window_idx], device)
+                q_input, _, _ = self.quant_block_with_lookahead(
+                    combined_block,
+                    *window_inputs[window_idx],
+                    q_input=q_input,
+                    device=device,
+                    fine_tune_block_name=window_names[0],
+                    attach_loss_block_name=window_names[1],
+                    observe_block_name=window_names[2],
+                    iters=self.pipeline_retune_iters,
+                    tuned_params=tuned_params[window_idx],
+                )
+            self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+        torch.cuda.empty_cache()
+        return q_input
+
+    @torch.no_grad()
+    def get_rtn_block(self, blocks, device):
+        """Copies blocks with their weights quantized by round to nearest, the starting point of the tuning.
+
+        Args:
+        blocks: The blocks to copy.
+        device: The device of the copy.
+
+        Returns:
+        WrapperMultiblock: The quantized copies of the blocks.
+        """
+        rtn_block = copy.deepcopy(WrapperMultiblock(blocks)).to(device)
+        wrapper_block(rtn_block, self.enable_minmax_tuning, device=device, enable_fused_qdq=self.enable_fused_qdq)
+        unwrapper_block(rtn_block, vs=0, min_scales=torch.tensor(1.0), max_scales=torch.tensor(1.0))
+        return rtn_block
+
+    def tune_window(self, block_names, window_idx, window_indices, input_ids, input_others, iters=None, q_input=None,
+                    tuned_params=None, device="cpu", in_worker=False):
+        """Tunes a window of blocks of quant_blocks_parallel.
+
+        Args:
+        block_names: The names of the blocks.
+        window_idx: The index of the window, which seeds its tuning as in quant_blocks.
+        window_indices: The fine tune, attach loss and observe block index ranges of the window.
+        input_ids: The full precision inputs of the window.
+        input_others: A dictionary containing additional input data.
+        iters: The number of tuning iterations, self.iters if None.
+        q_input: The quantized input of the window, None tunes it on its full precision input.
+        tuned_params: A dict the rounding values and min-max scales of the window are stored in, None skips them.
+        device: The device for quantization.
+        in_worker: Whether it runs in a worker process of AblationScheduler, which does not log metrics.
+
+        Returns:
+        dict: The tuned fine tune blocks keyed by name, empty if they were tuned in place in the current process,
+        the formatted names of the window blocks, the observe block mses, the early stop record and tuned_params.
+        """
+        if in_worker:
+            self.metrics = None
+            self.device = device
+        torch.manual_seed(self.seed + window_idx)
+        combined_block, window_names = self.get_window_block(self.model, block_names, window_indices, device)
+        _, _, mses_observe_block = self.quant_block_with_lookahead(
+            combined_block,
+            input_ids,
+            input_others,
+            q_input=q_input,
+            device=device,
+            fine_tune_block_name=window_names[0],
+            attach_loss_block_name=window_names[1],
+            observe_block_name=window_names[2],
+            iters=iters,
+            tuned_params=tuned_params,
+        )
+        blocks = {}
+        if in_worker:
+            ## the tuned layers, with their scales and zero points, are sent back to the parent process
+            for block_name in block_names[window_indices[0]]:
+                blocks[block_name] = get_module(self.model, block_name).to("cpu")
+        self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+        torch.cuda.empty_cache()
+        return {
+            "blocks": blocks,
+            "names": window_names,
+            "mses_observe_block": mses_observe_block,
+            "early_stop": self.early_stopped_iters.get(window_names[0]),
+            "observe_iters": self.observe_iters.get(window_names[0]),
+            "tuned_params": tuned_params,
+        }
+
     def quant_blocks(
             self,
             model: torch.nn.Module,
@@ -1420,25 +2299,7 @@ class AutoRound(object):
         torch.cuda.empty_cache()
         for n, m in model.named_parameters():
             m.requires_grad_(False)
-        input_ids = inputs["input_ids"]
-        inputs.pop("input_ids", None)
-        input_others = inputs
-        torch.cuda.empty_cache()
-        input_ids = to_device(input_ids, self.cache_device)
-        input_others = to_device(input_others, self.cache_device)
-        ## as in calibration phase, we may use bf16 for calibration due to low_gpu_memory usage
-        tmp_dtype = self.amp_dtype if self.amp else torch.float32
-        for i in range(len(input_ids)):
-            input_ids[i] = input_ids[i].to(tmp_dtype)
-
-        for key in input_others.keys():
-            if isinstance(input_others[key], torch.Tensor) and (
-                    input_others[key].dtype == torch.float16 or input_others[key].dtype == torch.bfloat16
-            ):
-                input_others[key] = input_others[key].to(tmp_dtype)
-            elif isinstance(input_others[key], list):
-                for i in range(len(input_others[key])):
-                    input_others[key][i].to(tmp_dtype)
+        input_ids, input_others = self.prepare_block_inputs(inputs)
                     
         if self.cleanly_separated_lookahead: 
             for substructure_first_block_idx in range(0, len(block_names), self.num_lookahead_blocks + 1):
@@ -1488,16 +2349,29 @@ class AutoRound(object):
             last_fully_fine_tuned_block_idx = -1
             unquantized_last_fully_fine_tuned_block_output = input_ids
             quantized_last_fully_fine_tuned_block_output = None
-            for idx_for_seed, (fine_tune_block_indices, attach_loss_block_indices, observe_block_indices) in enumerate(
-                get_block_indices(
-                    nblocks=nblocks, 
-                    block_step_size=block_step_size, 
-                    num_lookahead_blocks=num_lookahead_blocks, 
-                    num_observe_blocks=num_observe_blocks,
-                    total_num_blocks=len(block_names),
-                )
-            ): 
+            all_block_indices = self.get_all_block_indices(
+                len(block_names), nblocks, block_step_size, num_lookahead_blocks, num_observe_blocks)
+            window_iters = None
+            if self.enable_budget_scheduler:
+                with self.profiler.phase("budget"):
+                    window_iters = self.schedule_window_iters(
+                        model, block_names, all_block_indices, input_ids, input_others, device)
+            prefetcher = BlockPrefetcher(model, device) if self.enable_prefetch else None
+            ## the window inputs are full precision only if every window starts after the previous fine tune blocks
+            fp_output_cache = {} if nblocks == block_step_size else None
+            try:
+                for idx_for_seed, (fine_tune_block_indices, attach_loss_block_indices, observe_block_indices) in \
+                        enumerate(all_block_indices):
                     torch.manual_seed(self.seed + idx_for_seed)  # we set a new seed for each block to keep things reproducible
+                    if prefetcher is not None:
+                        prefetcher.wait()
+                        current_block_names = get_window_block_names(
+                            block_names, all_block_indices[idx_for_seed], block_step_size)
+                        next_block_names = []
+                        if idx_for_seed + 1 < len(all_block_indices):
+                            next_block_names = get_window_block_names(
+                                block_names, all_block_indices[idx_for_seed + 1], block_step_size)
+                        prefetcher.prefetch([name for name in next_block_names if name not in current_block_names])
                     if fine_tune_block_indices.start > 0 and fine_tune_block_indices.start - 1 > last_fully_fine_tuned_block_idx:
                         assert fine_tune_block_indices.start - last_fully_fine_tuned_block_idx == block_step_size + 1
                         last_fully_fine_tuned_block_idx = fine_tune_block_indices.start - 1
@@ -1508,6 +2382,7 @@ class AutoRound(object):
                         )
                         last_fine_tuned_multiblock.to(device)
                         logger.info(f"last fine tuned multiblock {last_fine_tuned_block_names}")
+                        self.profiler.begin("window_inputs", block=format_layer_name(last_fine_tuned_block_names[-1]))
                         if self.enable_quanted_input:
                             input_ids = unquantized_last_fully_fine_tuned_block_output if last_fine_tuned_multiblock_start_idx == 0 else quantized_last_fully_fine_tuned_block_output
                             quantized_last_fully_fine_tuned_block_output = self.get_block_outputs(
@@ -1526,32 +2401,11 @@ class AutoRound(object):
                             device=device,
                             cache_device=self.cache_device,
                         )
+                        self.profiler.end()
                             
                     logger.info(f"last fully fine tuned block {last_fully_fine_tuned_block_idx}")
-                    fine_tune_block_names = block_names[fine_tune_block_indices]
-                    logger.info(f"fine tune block {fine_tune_block_names}")
-                    fine_tune_block = WrapperMultiblock(
-                        [get_module(model, fine_tune_block_name) for fine_tune_block_name in fine_tune_block_names]
-                    )
-                
-                    attach_loss_block_names = block_names[attach_loss_block_indices]
-                    attach_loss_block = WrapperMultiblock(
-                        [get_module(model, attach_loss_block_name) for attach_loss_block_name in attach_loss_block_names]
-                    )
-                    if len(attach_loss_block_names) == 0:
-                        attach_loss_block_names = fine_tune_block_names
-                    logger.info(f"attach loss block {attach_loss_block_names}") 
-                                
-                    observe_block_names = block_names[observe_block_indices]
-                    observe_block = WrapperMultiblock(
-                        [get_module(model, observe_block_name) for observe_block_name in observe_block_names]
-                    )
-                    if len(observe_block_names) == 0:
-                        observe_block_names = attach_loss_block_names
-                    logger.info(f"observe block {observe_block_names}") 
-                    
-                    combined_block = WrapperMultiblock([fine_tune_block, attach_loss_block, observe_block])
-                    combined_block = combined_block.to(device)
+                    combined_block, window_names = self.get_window_block(
+                        model, block_names, all_block_indices[idx_for_seed], device)
 
                     q_input, input_ids, _ = self.quant_block_with_lookahead(
                         combined_block,
@@ -1559,11 +2413,20 @@ class AutoRound(object):
                         input_others,
                         q_input=quantized_last_fully_fine_tuned_block_output,
                         device=device,
-                        fine_tune_block_name=format_layer_name(fine_tune_block_names if isinstance(fine_tune_block_names, str) else fine_tune_block_names[-1]),
-                        attach_loss_block_name=format_layer_name(attach_loss_block_names if isinstance(attach_loss_block_names, str) else attach_loss_block_names[-1]),
-                        observe_block_name=format_layer_name(observe_block_names if isinstance(observe_block_names, str) else observe_block_names[-1]),
+                        fine_tune_block_name=window_names[0],
+                        attach_loss_block_name=window_names[1],
+                        observe_block_name=window_names[2],
+                        first_block_idx=fine_tune_block_indices.start,
+                        fp_output_cache=fp_output_cache,
+                        iters=window_iters[idx_for_seed] if window_iters is not None else None,
                     )
                     
+                    if fp_output_cache is not None:
+                        ## later windows start after these fine tune blocks, so they never read the earlier outputs
+                        for block_idx in list(fp_output_cache.keys()):
+                            if block_idx < fine_tune_block_indices.stop:
+                                del fp_output_cache[block_idx]
+
                     if nblocks == block_step_size:
                         last_fully_fine_tuned_block_idx = fine_tune_block_indices.stop - 1
                         for i in range(len(input_ids)):
@@ -1584,8 +2447,18 @@ class AutoRound(object):
                             del q_input
                         del input_ids
                     
-                    self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+                    if prefetcher is not None:
+                        ## the blocks prefetched for the next window stay on the device
+                        for name in current_block_names:
+                            if name not in next_block_names:
+                                mv_module_from_gpu(get_module(model, name), self.low_cpu_mem_usage)
+                    else:
+                        self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
                     torch.cuda.empty_cache()
+            finally:
+                ## the in-flight prefetch is waited for even if the tuning of a window raised
+                if prefetcher is not None:
+                    prefetcher.close()
 
         # del q_input
         # del input_ids
@@ -1622,7 +2495,6 @@ class AutoRound(object):
         
         logger.info("Quantizing blocks with lookahead ablation")
         
-        q_input = None
         torch.cuda.empty_cache()
         for n, m in model.named_parameters():
             m.requires_grad_(False)
@@ -1634,8 +2506,7 @@ class AutoRound(object):
         input_others = to_device(input_others, self.cache_device)
         ## as in calibration phase, we may use bf16 for calibration due to low_gpu_memory usage
         tmp_dtype = self.amp_dtype if self.amp else torch.float32
-        for i in range(len(input_ids)):
-            input_ids[i] = input_ids[i].to(tmp_dtype)
+        input_ids = to_dtype(input_ids, tmp_dtype)
 
         for key in input_others.keys():
             if isinstance(input_others[key], torch.Tensor) and (
@@ -1662,136 +2533,247 @@ class AutoRound(object):
         del input_ids
         torch.cuda.empty_cache()
         
-        fine_tune_block_name = block_names[fine_tune_block_idx]
         if attach_loss_block_indices[0] == -1:
             attach_loss_block_indices = list(range(fine_tune_block_idx, observe_block_idx + 1))
-        
+
+        table_columns = [
+            "model_name", "num_bits", "group_size", "fine_tune_block", "attach_loss_block", "observe_block",
+            "num_iters", "learning_rate", "lr_scheduler", "num_fine_tuning_samples", "optimizer", 
+            "wikitext_2_perplexity", "wikitext_2_perplexity_delta", "wikitext_2_token_perplexity",
+            "wikitext_2_token_perplexity_delta", "last_mse", "min_mse", "min_mse_iter", "convergence_iter",
+            "slope_first_tenth", "slope", "avg_abs_change_mse", "leraning_curve_plot"
+        ]
         log_data = []
-        for attach_loss_block_idx in attach_loss_block_indices:
-            fine_tune_block = copy.deepcopy(get_module(model, fine_tune_block_name))  # copy.deepcopy since quantization will change the block
-            logger.info(f"fine tune block {fine_tune_block_name}")
-            
-            if attach_loss_block_idx == fine_tune_block_idx:
-                attach_loss_block_names = fine_tune_block_name
-                attach_loss_block = WrapperMultiblock([])  # empty block
-            else:
-                attach_loss_block_names = block_names[fine_tune_block_idx + 1: attach_loss_block_idx + 1]
-                attach_loss_block =  WrapperMultiblock(
-                    [get_module(model, attach_loss_block_name) for attach_loss_block_name in attach_loss_block_names]
-                )
-            logger.info(f"attach loss block {attach_loss_block_names}")
-            
-            if attach_loss_block_idx == observe_block_idx:
-                observe_block_names = attach_loss_block_names
-                observe_block = WrapperMultiblock([])
+        ## the word perplexity of lm_eval and the token perplexity of the early exit evaluator are not comparable,
+        ## the delta of a variant is taken against the same metric of the model before tuning
+        reference_perplexity = None
+        perplexity_key, perplexity_name = "wikitext_perplexity", "perplexity"
+        if self.enable_early_exit_eval:
+            perplexity_key, perplexity_name = "wikitext_token_perplexity", "token perplexity"
+        if self.metrics is not None:
+            if self.enable_early_exit_eval:
+                tokens = get_eval_tokens("wikitext2", self.tokenizer, seqlen=self.early_exit_eval_seqlen)
+                self.early_exit_evaluator = EarlyExitEvaluator(
+                    self, tokens, block_names, fine_tune_block_idx, seqlen=self.early_exit_eval_seqlen,
+                    batch_size=self.eval_batch_size, device=device)
+                reference_perplexity = self.early_exit_evaluator.evaluate(model)
             else:
-                observe_block_names = block_names[attach_loss_block_idx + 1: observe_block_idx + 1]
-                observe_block = WrapperMultiblock(
-                    [get_module(model, observe_block_name) for observe_block_name in observe_block_names]
-                )
-            logger.info(f"observe block {observe_block_names}") 
+                reference_perplexity = self.eval_wikitext_perplexity(model, device)
+            self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+            torch.cuda.empty_cache()
+            logger.info(
+                f"wikitext2 {perplexity_name} before tuning "
+                f"{block_names[fine_tune_block_idx]}: {reference_perplexity}"
+            )
+        ## the model and the inputs are sent to every worker once, a job only holds the indices of its variant
+        shared = (model, block_names, preceding_block_outputs, input_others)
+        jobs = [
+            (fine_tune_block_idx, attach_loss_block_idx, observe_block_idx)
+            for attach_loss_block_idx in attach_loss_block_indices
+        ]
+        scheduler = AblationScheduler(self.num_ablation_workers, device=device)
+        for _, result in scheduler.run(self.run_isolation_variant, jobs, shared=shared):
+            if self.metrics is None:
+                continue
+            ## results arrive in completion order, the table is logged again with every new row
+            fine_tune_block_name = result["fine_tune_block_name"]
+            attach_loss_block_name = result["attach_loss_block_name"]
+            observe_block_name = result["observe_block_name"]
+            mses_observe_block = result["mses_observe_block"]
+            if scheduler.num_workers > 1:
+                self.log_observe_block_mses(
+                    mses_observe_block, fine_tune_block_name, attach_loss_block_name, observe_block_name)
+
+            convergence_iter = calculate_convergence_iter(mses_observe_block)
+            slope_first_tenth = calculate_slope(mses_observe_block, last_iter=len(mses_observe_block) // 10)
+            slope = calculate_slope(mses_observe_block)
+            average_absolute_change = calculate_average_absolute_change(mses_observe_block, window=1)
             
-            combined_block = WrapperMultiblock([fine_tune_block, attach_loss_block, observe_block])
-            combined_block = combined_block.to(device)
+            learning_curve_plot_title = f"Learning Curve: {observe_block_name}: {fine_tune_block_name} -> {attach_loss_block_name}"
+            learning_curve_plot = plot_learning_curve(
+                mses_observe_block, 
+                title=learning_curve_plot_title, 
+                convergence_iter=convergence_iter,
+            )
 
-            fine_tune_block_name = fine_tune_block_name if isinstance(fine_tune_block_name, str) else fine_tune_block_name[-1]
-            attach_loss_block_name = attach_loss_block_names if isinstance(attach_loss_block_names, str) else attach_loss_block_names[-1]
-            observe_block_name = observe_block_names if isinstance(observe_block_names, str) else observe_block_names[-1]
-            
-            _, _, mses_observe_block = self.quant_block_with_lookahead(
-                combined_block,
-                copy.deepcopy(preceding_block_outputs),
-                input_others,
-                q_input=q_input,
-                device=device,
-                fine_tune_block_name=format_layer_name(fine_tune_block_name),
-                attach_loss_block_name=format_layer_name(attach_loss_block_name),
-                observe_block_name=format_layer_name(observe_block_name),
+            last_mse = mses_observe_block[-1]
+            min_mse = min(mses_observe_block)
+            min_mse_iter = mses_observe_block.index(min_mse)
+            perplexity = result[perplexity_key]
+            perplexity_delta = perplexity - reference_perplexity
+            perplexity_columns = [perplexity, perplexity_delta, None, None]
+            if self.enable_early_exit_eval:
+                perplexity_columns = [None, None, perplexity, perplexity_delta]
+            logger.info(
+                f"{fine_tune_block_name} -> {attach_loss_block_name} -> {observe_block_name}: "
+                f"wikitext {perplexity_name} {perplexity}, "
+                f"last observe block mse {last_mse:.6f}"
+            )
+                            
+            lr_scheduler = "none" if not self.enable_lr_scheduler else "linear_decay"
+            log_data.append(
+                [
+                    self.model_name, self.bits, self.group_size, 
+                    format_layer_name(fine_tune_block_name), format_layer_name(attach_loss_block_name), 
+                    format_layer_name(observe_block_name), 
+                    self.iters, self.lr, lr_scheduler, self.nsamples, "signed_sgd",
+                    *perplexity_columns, last_mse, min_mse, min_mse_iter, convergence_iter,
+                    slope_first_tenth, slope, average_absolute_change, learning_curve_plot
+                ]
             )
+            self.metrics.log_table("stats_table", table_columns, log_data)
 
-            self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
-            torch.cuda.empty_cache()
-            
-            if not self.disable_wandb:
-                convergence_iter = calculate_convergence_iter(mses_observe_block)
-                slope_first_tenth = calculate_slope(mses_observe_block, last_iter=len(mses_observe_block) // 10)
-                slope = calculate_slope(mses_observe_block)
-                average_absolute_change = calculate_average_absolute_change(mses_observe_block, window=1)
-                
-                learning_curve_plot_title = f"Learning Curve: {observe_block_name}: {fine_tune_block_name} -> {attach_loss_block_name}"
-                learning_curve_plot = plot_learning_curve(
-                    mses_observe_block, 
-                    title=learning_curve_plot_title, 
-                    convergence_iter=convergence_iter,
-                )
-                buffer = io.StringIO()
-                learning_curve_plot.write_html(buffer, auto_play=False)
-                learning_curve_plot_wandb_html = wandb.Html(buffer)
-                buffer.close()
-                
-                last_mse = mses_observe_block[-1]
-                min_mse = min(mses_observe_block)
-                min_mse_iter = mses_observe_block.index(min_mse)
-                
-                logger.info("Evaluating the model on the Wikitext 2 dataset")
-                output_dir = os.path.join("tmp_autoround", f"{self.model_name}", f"{fine_tune_block_name}_{observe_block_name}")
-                
-                original_fine_tune_block = get_module(model, fine_tune_block_name)
-                setattr(model, fine_tune_block_name, fine_tune_block)
-                self.model.save_pretrained(output_dir)
-                self.tokenizer.save_pretrained(output_dir)
-                setattr(model, fine_tune_block_name, original_fine_tune_block)
-                
-                model_args = f"pretrained={output_dir}"
-                
-                lm_eval_results = lm_eval.simple_evaluate(
-                    model="hf", 
-                    model_args=model_args,
-                    device=device, 
-                    tasks="wikitext", 
-                    batch_size=self.eval_batch_size,
-                    random_seed=self.lm_eval_random_seed,
-                    numpy_random_seed=self.lm_eval_numpy_random_seed,
-                    torch_random_seed=self.lm_eval_torch_random_seed,
-                )
-                
-                lm_eval_results_df = make_pandas_dataframe_from_lm_eval_results(lm_eval_results)
-                wikitext_perplexity = lm_eval_results_df.loc[
-                    lm_eval_results_df["Metric"] == "word_perplexity", "Value"
-                ].values[0]
-                                
-                lr_scheduler = "none" if not self.enable_lr_scheduler else "linear_decay"
-                log_data.append(
-                    [
-                        self.model_name, self.bits, self.group_size, 
-                        format_layer_name(fine_tune_block_name), format_layer_name(attach_loss_block_name), 
-                        format_layer_name(observe_block_name), 
-                        self.iters, self.lr, lr_scheduler, self.nsamples, "signed_sgd",
-                        wikitext_perplexity, last_mse, min_mse, min_mse_iter, convergence_iter,
-                        slope_first_tenth, slope, average_absolute_change, learning_curve_plot_wandb_html
-                    ]
-                )
-        
-                # delete the checkpoint
-                shutil.rmtree(output_dir)
-                
-        if not self.disable_wandb:
-            table_columns = [
-                "model_name", "num_bits", "group_size", "fine_tune_block", "attach_loss_block", "observe_block",
-                "num_iters", "learning_rate", "lr_scheduler", "num_fine_tuning_samples", "optimizer", 
-                "wikitext_2_perplexity", "last_mse", "min_mse", "min_mse_iter", "convergence_iter",
-                "slope_first_tenth", "slope", "avg_abs_change_mse", "leraning_curve_plot"
-            ]
-
-            wandb_table = wandb.Table(data=log_data, columns=table_columns)
-            wandb.log({"stats_table": wandb_table})
-
-        del q_input
+        self.early_exit_evaluator = None
         del input_others
         del inputs
 
         torch.cuda.empty_cache()
 
+    def run_isolation_variant(
+            self,
+            model: torch.nn.Module,
+            block_names,
+            preceding_block_outputs,
+            input_others,
+            fine_tune_block_idx: int,
+            attach_loss_block_idx: int,
+            observe_block_idx: int,
+            device=torch.device("cpu"),
+            in_worker: bool = False,
+    ):
+        """Tunes a copy of the fine tune block with the loss attached after attach_loss_block_idx, then evaluates
+        the model patched with it.
+
+        Args:
+        model: The PyTorch model to be quantized.
+        block_names: The names of the blocks.
+        preceding_block_outputs: The full precision inputs of the fine tune block.
+        input_others: A dictionary containing additional input data.
+        fine_tune_block_idx: The index of the fine tune block.
+        attach_loss_block_idx: The index of the block whose output the loss is computed on.
+        observe_block_idx: The index of the block whose output mse is observed.
+        device: The device for quantization and evaluation.
+        in_worker: Whether it runs in a worker process of AblationScheduler, which does not log metrics.
+
+        Returns:
+        dict: The names of the blocks, the observe block mse of every iteration and, if the metrics are enabled,
+        either the wikitext word perplexity of lm_eval under "wikitext_perplexity" or, if the early exit evaluator
+        is enabled, its token perplexity under "wikitext_token_perplexity".
+        """
+        evaluate = self.metrics is not None
+        if in_worker:
+            self.metrics = None
+            self.device = device
+        ## seeded per variant, so that results do not depend on the order the variants are run in
+        torch.manual_seed(self.seed + attach_loss_block_idx)
+
+        fine_tune_block_name = block_names[fine_tune_block_idx]
+        fine_tune_block = copy.deepcopy(get_module(model, fine_tune_block_name))  # copy.deepcopy since quantization will change the block
+        logger.info(f"fine tune block {fine_tune_block_name}")
+        
+        if attach_loss_block_idx == fine_tune_block_idx:
+            attach_loss_block_names = fine_tune_block_name
+            attach_loss_block = WrapperMultiblock([])  # empty block
+        else:
+            attach_loss_block_names = block_names[fine_tune_block_idx + 1: attach_loss_block_idx + 1]
+            attach_loss_block =  WrapperMultiblock(
+                [get_module(model, attach_loss_block_name) for attach_loss_block_name in attach_loss_block_names]
+            )
+        logger.info(f"attach loss block {attach_loss_block_names}")
+        
+        if attach_loss_block_idx == observe_block_idx:
+            observe_block_names = attach_loss_block_names
+            observe_block = WrapperMultiblock([])
+        else:
+            observe_block_names = block_names[attach_loss_block_idx + 1: observe_block_idx + 1]
+            observe_block = WrapperMultiblock(
+                [get_module(model, observe_block_name) for observe_block_name in observe_block_names]
+            )
+        logger.info(f"observe block {observe_block_names}") 
+        
+        combined_block = WrapperMultiblock([fine_tune_block, attach_loss_block, observe_block])
+        combined_block = combined_block.to(device)
+
+        attach_loss_block_name = attach_loss_block_names if isinstance(attach_loss_block_names, str) else attach_loss_block_names[-1]
+        observe_block_name = observe_block_names if isinstance(observe_block_names, str) else observe_block_names[-1]
+
+        _, _, mses_observe_block = self.quant_block_with_lookahead(
+            combined_block,
+            copy.deepcopy(preceding_block_outputs),
+            input_others,
+            q_input=None,
+            device=device,
+            fine_tune_block_name=format_layer_name(fine_tune_block_name),
+            attach_loss_block_name=format_layer_name(attach_loss_block_name),
+            observe_block_name=format_layer_name(observe_block_name),
+        )
+
+        self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+        torch.cuda.empty_cache()
+
+        result = {
+            "fine_tune_block_name": fine_tune_block_name,
+            "attach_loss_block_name": attach_loss_block_name,
+            "observe_block_name": observe_block_name,
+            "mses_observe_block": mses_observe_block,
+        }
+        if evaluate:
+            logger.info("Evaluating the model on the Wikitext 2 dataset")
+            original_fine_tune_block = get_module(model, fine_tune_block_name)
+            set_module(model, fine_tune_block_name, fine_tune_block)
+            try:
+                if self.early_exit_evaluator is not None:
+                    result["wikitext_token_perplexity"] = self.early_exit_evaluator.evaluate(model, device)
+                else:
+                    result["wikitext_perplexity"] = self.eval_wikitext_perplexity(model, device)
+            finally:
+                set_module(model, fine_tune_block_name, original_fine_tune_block)
+                self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+                torch.cuda.empty_cache()
+
+        return result
+
+    @torch.no_grad()
+    def eval_wikitext_perplexity(self, model, device):
+        """Evaluates the word perplexity of the in-memory model on wikitext with lm_eval, without saving it.
+
+        Args:
+        model: The model to evaluate.
+        device: The device for evaluation.
+
+        Returns:
+        float: The word perplexity.
+        """
+        from lm_eval.models.huggingface import HFLM
+
+        model = model.to(device)
+        lm = HFLM(pretrained=model, tokenizer=self.tokenizer, batch_size=self.eval_batch_size)
+        lm_eval_results = lm_eval.simple_evaluate(
+            model=lm,
+            tasks="wikitext",
+            random_seed=self.lm_eval_random_seed,
+            numpy_random_seed=self.lm_eval_numpy_random_seed,
+            torch_random_seed=self.lm_eval_torch_random_seed,
+        )
+        lm_eval_results_df = make_pandas_dataframe_from_lm_eval_results(lm_eval_results)
+        return lm_eval_results_df.loc[lm_eval_results_df["Metric"] == "word_perplexity", "Value"].values[0]
+
+    def log_observe_block_mses(self, mses_observe_block, fine_tune_block_name, attach_loss_block_name,
+                               observe_block_name, observe_iters=None):
+        """Logs the observe block mse curve of a variant tuned in a worker process, which does not log metrics,
+        observe_iters are the iterations of the mses, every iteration if None."""
+        fine_tune_block_name = format_layer_name(fine_tune_block_name)
+        attach_loss_block_name = format_layer_name(attach_loss_block_name)
+        observe_block_name = format_layer_name(observe_block_name)
+        step_metric = f"iter_count/{fine_tune_block_name}->{observe_block_name}"
+        metric = f"observe_block_mse/{fine_tune_block_name}->{observe_block_name}/{attach_loss_block_name}"
+        self.metrics.define_metric(step_metric)
+        self.metrics.define_metric(metric, step_metric=step_metric)
+        if observe_iters is None:
+            observe_iters = range(len(mses_observe_block))
+        for i, mse in zip(observe_iters, mses_observe_block):
+            self.metrics.log({step_metric: i, metric: mse})
+
     def save_quantized(self, output_dir=None, format="auto_gptq", inplace=True, **kwargs):
         """Save the quantized model to the specified output directory in the specified format.
 
@@ -1845,6 +2827,8 @@ class AutoRound(object):
         ]
         if isinstance(self.dataset, str):
             serialization_keys.append("dataset")
+        if self.block_iters is not None:
+            serialization_keys.extend(["block_iters", "budget_probe_iters"])
         serialization_dict = {}
         for key in serialization_keys:
             serialization_dict[key] = getattr(self, key)
@@ -1854,6 +2838,7 @@ class AutoRound(object):
         if "scale_dtype" in serialization_dict.keys():
             serialization_dict["scale_dtype"] = str(serialization_dict["scale_dtype"])
 
+        self.profiler.begin("export")
         compressed_model = save_quantized_as_format(  ##TODO refine the code
             output_dir,
             model=self.model,
@@ -1876,6 +2861,8 @@ class AutoRound(object):
             multimodal=self.multimodal,
             **kwargs
         )
+        self.profiler.end()
+        self.profiler.save(self.profile_path)
         return compressed_model
 
     def get_quantized_layer_names_outside_blocks(self):
@@ -0,0 +1,130 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .utils import logger
+
+
+def allocate_iters(difficulties, total_iters, min_iters, max_iters):
+    """Splits an iteration budget in proportion to the difficulties, within [min_iters, max_iters] per entry.
+
+    The allocation is clip(scale * difficulty, min_iters, max_iters), with the scale found by bisection so that
+    the allocations add up to total_iters, then rounded down to integers with the remainder given to the largest
+    fractional parts. The allocations add up to less than total_iters only when every entry gets max_iters.
+
+    Args:
+        difficulties (list): The non negative difficulties.
+        total_iters (int): The budget, at least min_iters per entry.
+        min_iters (int): The minimum number of iterations of an entry.
+        max_iters (int): The maximum number of iterations of an entry.
+
+    Returns:
+        list: The number of iterations of each entry.
+    """
+    difficulties = np.asarray(difficulties, dtype=np.float64)
+    num = len(difficulties)
+    assert 0 < min_iters <= max_iters, "min_iters should be positive and not larger than max_iters"
+    assert total_iters >= num * min_iters, f"a budget of {total_iters} iterations is below {min_iters} per block"
+    if total_iters >= num * max_iters:
+        return [max_iters] * num
+    if difficulties.sum() <= 0:
+        difficulties = np.ones(num)
+
+    def allocation(scale):
+        return np.clip(scale * difficulties, min_iters, max_iters)
+
+    low, high = 0.0, max_iters / max(difficulties[difficulties > 0].min(), np.finfo(np.float64).tiny)
+    for _ in range(100):
+        middle = (low + high) / 2
+        if allocation(middle).sum() < total_iters:
+            low = middle
+        else:
+            high = middle
+    iters = allocation(high)
+    result = np.floor(iters).astype(np.int64)
+    ## the iterations lost in the rounding go to the largest fractional parts below max_iters
+    remainder = int(total_iters - result.sum())
+    for idx in np.argsort(-(iters - result), kind="stable"):
+        if remainder <= 0:
+            break
+        if result[idx] < max_iters:
+            result[idx] += 1
+            remainder -= 1
+    return [int(value) for value in result]
+
+
+class IterationBudgetScheduler:
+    """Distributes the tuning iterations of num_windows windows of blocks according to short probe runs.
+
+    Every window is first tuned for probe_iters iterations on its full precision inputs and restored. Its
+    difficulty is sqrt(initial loss / mean initial loss) * (0.5 + 0.5 * decrease rate / mean decrease rate),
+    where the decrease rate is the negated slope of the log loss over the probe: blocks with a large loss and
+    blocks whose loss still falls quickly get more iterations, blocks whose loss is flat after the probe get
+    fewer. The budget is num_windows * iters minus the probe iterations, so that the total number of tuning
+    iterations never exceeds the one of a uniform schedule.
+
+    Args:
+        num_windows (int): The number of tuning windows.
+        iters (int): The number of iterations of a window in the uniform schedule.
+        probe_iters (int): The number of iterations of a probe run.
+        min_iters (int): The minimum number of iterations of a window, iters // 4 by default.
+        max_iters (int): The maximum number of iterations of a window, 4 * iters by default.
+    """
+
+    def __init__(self, num_windows, iters, probe_iters=10, min_iters=None, max_iters=None):
+        assert probe_iters >= 2, "probe_iters should be at least 2 to estimate a slope"
+        self.iters = iters
+        self.probe_iters = probe_iters
+        self.min_iters = min_iters if min_iters is not None else max(iters // 4, 1)
+        self.max_iters = max_iters if max_iters is not None else 4 * iters
+        self.total_iters = num_windows * (iters - probe_iters)
+        assert self.total_iters >= num_windows * self.min_iters, (
+            f"the budget of {iters - probe_iters} iterations per block after the probe is below min_iters "
+            f"{self.min_iters}, lower probe_iters or min_iters")
+        self.probes = OrderedDict()
+
+    def add_probe(self, name, loss_values):
+        """Records the loss values of the probe run of a window.
+
+        Args:
+            name (str): The name of the window.
+            loss_values (list): The loss of every probe iteration.
+        """
+        loss_values = np.maximum(np.asarray(loss_values, dtype=np.float64), np.finfo(np.float32).tiny)
+        slope = np.polyfit(np.arange(len(loss_values)), np.log(loss_values), 1)[0]
+        self.probes[name] = {"init_loss": float(loss_values[0]), "decrease_rate": float(max(-slope, 0.0))}
+
+    def difficulties(self):
+        init_losses = np.array([probe["init_loss"] for probe in self.probes.values()])
+        decrease_rates = np.array([probe["decrease_rate"] for probe in self.probes.values()])
+        difficulties = np.sqrt(init_losses / init_losses.mean())
+        if decrease_rates.mean() > 0:
+            difficulties = difficulties * (0.5 + 0.5 * decrease_rates / decrease_rates.mean())
+        return difficulties
+
+    def allocate(self):
+        """Allocates the budget to the probed windows.
+
+        Returns:
+            OrderedDict: The number of tuning iterations of every window, in the order of the probes.
+        """
+        iters = allocate_iters(self.difficulties(), self.total_iters, self.min_iters, self.max_iters)
+        allocation = OrderedDict(zip(self.probes.keys(), iters))
+        logger.info(
+            f"allocated {sum(iters)} of {len(iters) * self.iters} tuning iterations after "
+            f"{len(iters) * self.probe_iters} probe iterations: {dict(allocation)}")
+        return allocation
@@ -0,0 +1,175 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import uuid
+
+import torch
+from safetensors.torch import load_file, save_file
+
+from .activation_store import ActivationStore
+from .utils import logger
+
+CACHE_FORMAT_VERSION = 2
+
+
+def get_model_fingerprint(model, num_sampled_bytes=1 << 16):
+    """Computes a fingerprint of the model from its config, its tensor layout and a sample of its weights.
+
+    Hashing all the weights would cost as much as a calibration pass, so only the first bytes of every floating
+    tensor are hashed, which is enough to tell apart checkpoints sharing the same architecture.
+
+    Args:
+        model (torch.nn.Module): The model.
+        num_sampled_bytes (int): The number of bytes hashed per tensor.
+
+    Returns:
+        str: The hex digest of the fingerprint.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(model.__class__.__name__.encode())
+    if hasattr(model, "config"):
+        hasher.update(model.config.to_json_string(use_diff=False).encode())
+    for name, tensor in model.state_dict().items():
+        hasher.update(f"{name}:{tuple(tensor.shape)}:{tensor.dtype}".encode())
+        if tensor.device.type == "meta" or not tensor.is_floating_point() or tensor.numel() == 0:
+            continue
+        sample = tensor.detach().reshape(-1)[: max(num_sampled_bytes // tensor.element_size(), 1)]
+        hasher.update(sample.to("cpu").contiguous().view(torch.uint8).numpy().tobytes())
+    return hasher.hexdigest()
+
+
+def _encode(obj, tensors, prefix):
+    """Flattens the cached inputs into a json layout and a dict of tensors, returns None if obj is not supported."""
+    if isinstance(obj, torch.Tensor):
+        tensors[prefix] = obj.detach().to("cpu").contiguous()
+        return {"tensor": prefix}
+    if isinstance(obj, ActivationStore):
+        tensors[prefix] = obj.view().detach().to("cpu").contiguous()
+        return {"store": prefix, "dim": obj.dim}
+    if isinstance(obj, (list, tuple)):
+        items = [_encode(item, tensors, f"{prefix}.{idx}") for idx, item in enumerate(obj)]
+        if any(item is None for item in items):
+            return None
+        return {"tuple" if isinstance(obj, tuple) else "list": items}
+    if isinstance(obj, dict):
+        items = {key: _encode(value, tensors, f"{prefix}.{key}") for key, value in obj.items()}
+        if any(not isinstance(key, str) for key in obj) or any(item is None for item in items.values()):
+            return None
+        return {"dict": items}
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return {"value": obj}
+    return None
+
+
+def _decode(layout, tensors):
+    """Rebuilds the cached inputs from the json layout and the loaded tensors."""
+    if "tensor" in layout:
+        return tensors[layout["tensor"]]
+    if "store" in layout:
+        return ActivationStore.from_tensor(tensors[layout["store"]], dim=layout["dim"])
+    if "list" in layout:
+        return [_decode(item, tensors) for item in layout["list"]]
+    if "tuple" in layout:
+        return tuple(_decode(item, tensors) for item in layout["tuple"])
+    if "dict" in layout:
+        return {key: _decode(value, tensors) for key, value in layout["dict"].items()}
+    return layout["value"]
+
+
+class CalibInputsCache:
+    """A content-addressed disk cache of the inputs captured by AutoRound.cache_inter_data.
+
+    Every entry is a safetensors file holding the tensors and a manifest holding the spec it was captured with,
+    the layout of the inputs dict and the flags detected while capturing. Both are named after the sha256 of the
+    spec, the manifest is written last and atomically, so concurrent processes sharing the directory either see
+    a complete entry or none. Tensors are memory-mapped when loaded.
+
+    Args:
+        cache_dir (str): The directory of the cache.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(spec):
+        """Returns the key of a spec, a dict of json serializable values."""
+        spec = dict(spec, cache_format_version=CACHE_FORMAT_VERSION)
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, f"{key}.safetensors"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, spec):
+        """Loads the inputs captured with spec.
+
+        Args:
+            spec (dict): The spec of the entry.
+
+        Returns:
+            tuple: The inputs dict and the flags dict, or (None, None) on a miss.
+        """
+        key = self.get_key(spec)
+        tensor_path, manifest_path = self._paths(key)
+        if not os.path.exists(manifest_path) or not os.path.exists(tensor_path):
+            return None, None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            tensors = load_file(tensor_path)
+            inputs = _decode(manifest["layout"], tensors)
+        except Exception as error:  # a corrupted entry is treated as a miss
+            logger.warning(f"failed to load the calibration cache {key}: {error}")
+            return None, None
+        logger.info(f"loaded the cached calibration inputs from {tensor_path}")
+        return inputs, manifest["flags"]
+
+    def save(self, spec, inputs, flags):
+        """Saves the inputs captured with spec, inputs that can not be serialized are skipped.
+
+        Args:
+            spec (dict): The spec of the entry.
+            inputs (dict): The captured inputs.
+            flags (dict): The flags detected while capturing, json serializable.
+
+        Returns:
+            bool: Whether the entry is saved.
+        """
+        tensors = {}
+        layout = _encode(inputs, tensors, "inputs")
+        if layout is None:
+            logger.warning("the calibration inputs contain unsupported types, skip caching them")
+            return False
+        key = self.get_key(spec)
+        tensor_path, manifest_path = self._paths(key)
+        ##safetensors refuses tensors sharing a storage, e.g. a mask referenced by several samples
+        unique = {}
+        for name, tensor in tensors.items():
+            unique.setdefault(tensor.untyped_storage().data_ptr(), []).append(name)
+        for names in unique.values():
+            for name in names[1:]:
+                tensors[name] = tensors[name].clone()
+        tmp_suffix = f".tmp-{uuid.uuid4().hex}"
+        save_file(tensors, tensor_path + tmp_suffix)
+        os.replace(tensor_path + tmp_suffix, tensor_path)
+        manifest = {"spec": spec, "layout": layout, "flags": flags}
+        with open(manifest_path + tmp_suffix, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + tmp_suffix, manifest_path)
+        logger.info(f"cached the calibration inputs to {tensor_path}")
+        return True
@@ -13,13 +13,13 @@
 # limitations under the License.
 
 import torch
-from .utils import floor_ste, round_ste
+from .utils import floor_ste, qdq_ste, round_ste
 from auto_round.data_type.register import register_dtype, QUANT_FUNC_WITH_DTYPE
 
 
 @register_dtype("int_asym")
 def quant_tensor_asym(weight, num_bits=4, v=0, min_scale=1.0, max_scale=1.0, scale_dtype=torch.float16,
-                      weight_min=None, weight_max=None, q_scale_thresh=0.0,**kwargs):
+                      weight_min=None, weight_max=None, q_scale_thresh=0.0, enable_fused_qdq=False, **kwargs):
     """Quantizes and dequantizes weight asymmetrically.
 
     Args:
@@ -30,6 +30,7 @@ def quant_tensor_asym(weight, num_bits=4, v=0, min_scale=1.0, max_scale=1.0, sca
         max_scale: Maximum scale coefficient for weight
         weight_min (Tensor, optional): Minimum weight value for quantization. Defaults to None.
         weight_max (Tensor, optional): Maximum weight value for quantization. Defaults to None.
+        enable_fused_qdq (bool, optional): Whether to use the fused QuantDequantSTE. Defaults to False.
 
     Returns:
         Quantized and dequantized weight, scale, zero-point
@@ -62,13 +63,15 @@ def quant_tensor_asym(weight, num_bits=4, v=0, min_scale=1.0, max_scale=1.0, sca
     zp = round_ste(-wmin / scale)  # pylint: disable=E1130
     scale = scale.unsqueeze(dim=-1)
     zp = zp.unsqueeze(dim=-1)
+    if enable_fused_qdq:
+        return qdq_ste(weight, scale, zp, v, maxq), scale, zp
     int_w = round_ste(weight / scale + v)
     q = torch.clamp(int_w + zp, 0, maxq)
     return scale * (q - zp), scale, zp
 
 @register_dtype("int_sym")
 def quant_tensor_sym(weight, num_bits=4, v=0, min_scale=1.0, max_scale=1.0, scale_dtype=torch.float16, weight_min=None,
-                     weight_max=None, q_scale_thresh=0.0,**kargs):
+                     weight_max=None, q_scale_thresh=0.0, enable_fused_qdq=False, **kargs):
     """Quantizes and dequantizes weight symmetrically.
 
     Args:
@@ -79,6 +82,7 @@ def quant_tensor_sym(weight, num_bits=4, v=0, min_scale=1.0, max_scale=1.0, scal
         max_scale: Maximum scale coefficient for weight
         weight_min (Tensor, optional): Minimum weight value for quantization. Defaults to None.
         weight_max (Tensor, optional): Maximum weight value for quantization. Defaults to None.
+        enable_fused_qdq (bool, optional): Whether to use the fused QuantDequantSTE. Defaults to False.
 
     Returns:
         Quantized and dequantized weight, scale, zero-point
@@ -116,6 +120,8 @@ def quant_tensor_sym(weight, num_bits=4, v=0, min_scale=1.0, max_scale=1.0, scal
     scale = torch.clamp(scale, min=q_scale_thresh)
     scale = scale.unsqueeze(dim=-1)
     zp = torch.full_like(scale, (maxq + 1) / 2)
+    if enable_fused_qdq:
+        return qdq_ste(weight, scale, zp, v, maxq), scale, zp
 
     int_w = round_ste(weight / scale + v)
     q = torch.clamp(int_w + zp, 0, maxq)
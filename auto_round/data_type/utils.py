@@ -85,3 +85,65 @@ def floor_ste(x: torch.Tensor):
         torch.Tensor
     """
     return (x.floor() - x).detach() + x
+
+
+class QuantDequantSTE(torch.autograd.Function):
+    """Fused fake quantization `scale * (clamp(round(weight / scale + v) + zp, 0, maxq) - zp)` with the STE backward.
+
+    It computes the same values and gradients as the composition of round_ste, clamp and the dequantization, but
+    updates a single buffer in place in the forward pass and recomputes the clamp mask in the backward pass
+    instead of keeping the whole autograd graph of weight-sized temporaries alive.
+    """
+
+    @staticmethod
+    def forward(ctx, weight, scale, zp, v, maxq):
+        ctx.save_for_backward(weight, scale, zp, v)
+        ctx.maxq = maxq
+        out, scale, zp = QuantDequantSTE._quant(weight, scale, zp, v)
+        out.clamp_(0, maxq).sub_(zp).mul_(scale)
+        return out
+
+    @staticmethod
+    def _quant(weight, scale, zp, v):
+        ##same float operations as round_ste(weight / scale + v) + zp, so the clamp boundaries match exactly.
+        ##scale and zp are cast once to the dtype of the result, mixed dtype broadcasting is slow on CPU
+        x = weight / scale.to(torch.result_type(weight, scale))
+        x = x.add_(v) if x.dtype == torch.result_type(x, v) else x + v
+        q = x.round()
+        scale, zp = scale.to(q.dtype), zp.to(torch.result_type(q, zp))
+        q.sub_(x).add_(x)
+        q = q.add_(zp) if q.dtype == zp.dtype else q + zp
+        return q, scale.to(q.dtype), zp.to(q.dtype)
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        weight, orig_scale, orig_zp, v = ctx.saved_tensors
+        q, scale, zp = QuantDequantSTE._quant(weight, orig_scale, orig_zp, v)
+        out_of_range = (q <= 0) | (q >= ctx.maxq)  # the clamp backward of torch passes no gradient on the boundaries
+        q.clamp_(0, ctx.maxq).sub_(zp)
+        grad_out = grad_out.to(q.dtype)
+        grad_q = (grad_out * scale).masked_fill_(out_of_range, 0)
+
+        grad_weight = grad_scale = grad_zp = grad_v = None
+        if ctx.needs_input_grad[0]:
+            grad_weight = (grad_q / scale).to(weight.dtype)
+        if ctx.needs_input_grad[1]:
+            ##d(scale * (q - zp)) / dscale - d(weight / scale) / dscale passed through the STE
+            grad_scale = q.mul_(grad_out).sub_(grad_q * weight / (scale * scale))
+            grad_scale = grad_scale.sum_to_size(orig_scale.shape).to(orig_scale.dtype)
+        if ctx.needs_input_grad[2]:
+            grad_zp = (grad_q - grad_out * scale).sum_to_size(orig_zp.shape).to(orig_zp.dtype)
+        if ctx.needs_input_grad[3]:
+            grad_v = grad_q.sum_to_size(v.shape).to(v.dtype)
+        return grad_weight, grad_scale, grad_zp, grad_v, None
+
+
+def qdq_ste(weight, scale, zp, v, maxq):
+    """Fake quantizes the weight with the fused QuantDequantSTE, see quant_tensor_asym for the arguments.
+
+    Returns:
+        torch.Tensor: The quantized and dequantized weight.
+    """
+    if not isinstance(v, torch.Tensor):
+        v = torch.tensor(v, dtype=weight.dtype, device=weight.device)
+    return QuantDequantSTE.apply(weight, scale, zp, v, float(maxq))
@@ -0,0 +1,132 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import torch
+
+from ..utils import block_forward, get_module, logger, sampling_inputs
+
+## the modules between the last block and the lm head, in the order they are applied
+FINAL_MODULE_NAMES = [
+    "model.norm",
+    "model.final_layernorm",
+    "model.decoder.final_layer_norm",
+    "model.decoder.project_out",
+    "transformer.ln_f",
+    "transformer.norm_f",
+    "gpt_neox.final_layer_norm",
+]
+
+
+def get_final_modules(model):
+    """Gets the modules applied to the output of the last block, the final norm and the lm head.
+
+    Args:
+        model: The causal language model.
+
+    Returns:
+        list: The modules in the order they are applied.
+    """
+    final_modules = []
+    for name in FINAL_MODULE_NAMES:
+        module = get_module(model, name)
+        if isinstance(module, torch.nn.Module):
+            final_modules.append(module)
+    lm_head = model.get_output_embeddings()
+    assert lm_head is not None, f"{model.__class__.__name__} has no lm head"
+    return final_modules + [lm_head]
+
+
+class EarlyExitEvaluator:
+    """Evaluates the perplexity of variants of a model that differ from it only from one block on.
+
+    The hidden states entering the block at start_block_idx are captured once on the evaluation corpus with the
+    same forward replacement AutoRound uses to cache the calibration inputs, then every evaluation only runs the
+    blocks from start_block_idx on, the final norm and the lm head. The corpus is cut into non overlapping windows
+    of seqlen tokens, so the perplexity matches eval_perplexity with the default stride.
+
+    Args:
+        autoround: The AutoRound object holding the model, it is only used to capture the inputs.
+        tokens (torch.Tensor): The 1D token ids of the corpus.
+        block_names (list): The names of all the blocks of the model.
+        start_block_idx (int): The index of the first block that may differ between the variants.
+        seqlen (int): The length of a window.
+        batch_size (int): The number of windows per forward.
+        device: The device of the capture and the default device of the evaluations.
+    """
+
+    def __init__(self, autoround, tokens, block_names, start_block_idx, seqlen=2048, batch_size=1, device=None):
+        assert 0 <= start_block_idx < len(block_names), "start_block_idx is out of range"
+        tokens = tokens.reshape(-1)
+        nwindows = tokens.numel() // seqlen
+        assert nwindows > 0, f"the corpus has fewer than {seqlen} tokens"
+        windows = tokens[:nwindows * seqlen].reshape(nwindows, seqlen)
+        self.block_names = list(block_names)
+        self.start_block_idx = start_block_idx
+        self.seqlen = seqlen
+        self.batch_size = batch_size
+        self.device = device if device is not None else autoround.device
+        self.labels = windows[:, 1:].clone()
+        self.block_inputs = autoround.cache_eval_block_inputs(
+            self.block_names[start_block_idx], windows, batch_size, self.device)
+        self.input_ids = self.block_inputs.pop("input_ids")
+        self.share_attention_mask_flag = autoround.share_attention_mask_flag
+        self.not_share_position_ids_flag = autoround.not_share_position_ids_flag
+        self.input_dim = autoround.input_dim
+        self.amp = autoround.amp
+        self.amp_dtype = autoround.amp_dtype
+        assert len(self.input_ids) == nwindows, "failed to capture the inputs of every window"
+        logger.info(
+            f"cached the inputs of {self.block_names[start_block_idx]} on {nwindows} windows, "
+            f"evaluations run {len(self.block_names) - start_block_idx}/{len(self.block_names)} blocks")
+
+    @torch.no_grad()
+    def evaluate(self, model, device=None):
+        """Computes the perplexity of the model, which must share the blocks before start_block_idx with the model
+        the inputs were captured on.
+
+        Args:
+            model: The model to evaluate, its suffix blocks, final norm and lm head are moved to the device.
+            device: The device of the evaluation, defaults to the device given at construction.
+
+        Returns:
+            float: The perplexity.
+        """
+        device = device if device is not None else self.device
+        blocks = [get_module(model, name).to(device) for name in self.block_names[self.start_block_idx:]]
+        final_modules = [module.to(device) for module in get_final_modules(model)]
+        nwindows = len(self.input_ids)
+        total_nll = torch.zeros((), dtype=torch.float64, device=device)
+        for i in range(0, nwindows, self.batch_size):
+            indices = torch.arange(i, min(nwindows, i + self.batch_size)).to(torch.long)
+            hidden_states, input_others = sampling_inputs(
+                self.input_ids,
+                self.block_inputs,
+                indices,
+                self.seqlen,
+                self.share_attention_mask_flag,
+                self.not_share_position_ids_flag,
+                self.input_dim,
+            )
+            for block in blocks:
+                hidden_states = block_forward(block, hidden_states, input_others, self.amp, self.amp_dtype, device)
+            for module in final_modules:
+                hidden_states = module(hidden_states)
+            logits = hidden_states[:, :-1, :]
+            labels = self.labels[indices].to(device)
+            nll = torch.nn.functional.cross_entropy(
+                logits.reshape(-1, logits.shape[-1]).float(), labels.reshape(-1), reduction="sum")
+            total_nll += nll.to(torch.float64)
+        return math.exp(total_nll.item() / self.labels.numel())
@@ -0,0 +1,177 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import math
+import os
+import uuid
+
+import torch
+
+from ..utils import logger
+
+EVAL_DATASETS = {}
+
+DEFAULT_EVAL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "auto_round", "eval")
+
+
+def register_eval_dataset(name):
+    """Decorator to register a perplexity evaluation corpus.
+
+    The registered function takes the tokenizer and the sequence length and returns the token ids of the whole
+    corpus as a 1D tensor.
+
+    Args:
+        name: A string. Define the dataset name.
+
+    Returns:
+        function: The registered function.
+    """
+
+    def register(dataset):
+        EVAL_DATASETS[name] = dataset
+        return dataset
+
+    return register
+
+
+@register_eval_dataset("wikitext2")
+def get_wikitext2_tokens(tokenizer, seqlen):
+    from datasets import load_dataset
+
+    testdata = load_dataset("wikitext", "wikitext-2-raw-v1", split="test")
+    return tokenizer("\n\n".join(testdata["text"]), return_tensors="pt").input_ids[0]
+
+
+@register_eval_dataset("ptb")
+def get_ptb_tokens(tokenizer, seqlen):
+    from datasets import load_dataset
+
+    testdata = load_dataset("ptb_text_only", "penn_treebank", split="test")
+    return tokenizer(" ".join(testdata["sentence"]), return_tensors="pt").input_ids[0]
+
+
+@register_eval_dataset("c4")
+def get_c4_tokens(tokenizer, seqlen):
+    from datasets import load_dataset
+
+    valdata = load_dataset(
+        "allenai/c4", data_files={"validation": "en/c4-validation.00000-of-00008.json.gz"}, split="validation")
+    return tokenizer(" ".join(valdata[:1100]["text"]), return_tensors="pt").input_ids[0, :(256 * seqlen)]
+
+
+def get_tokenizer_fingerprint(tokenizer):
+    """Hashes the name, the class and the encoding of a probe text, to tell tokenizers apart in the cache."""
+    probe = "The quick brown fox jumps over the lazy dog.\n\n 1234 ÄÖÜ こんにちは"
+    hasher = hashlib.sha256()
+    hasher.update(f"{tokenizer.__class__.__name__}:{getattr(tokenizer, 'name_or_path', '')}".encode())
+    hasher.update(str(tokenizer(probe)["input_ids"]).encode())
+    return hasher.hexdigest()[:16]
+
+
+def get_eval_tokens(dataset_name, tokenizer, seqlen=2048, cache_dir=DEFAULT_EVAL_CACHE_DIR):
+    """Gets the tokenized evaluation corpus, loading it from the disk cache if it was tokenized before.
+
+    Args:
+        dataset_name (str): The name of a registered dataset, one of wikitext2, ptb and c4 by default.
+        tokenizer: The tokenizer.
+        seqlen (int): The sequence length, some corpora are truncated to a number of windows.
+        cache_dir (str): The directory of the cache, None disables it.
+
+    Returns:
+        torch.Tensor: The 1D token ids of the corpus.
+    """
+    assert dataset_name in EVAL_DATASETS, f"{dataset_name} is not supported, choose from {list(EVAL_DATASETS)}"
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(
+            cache_dir, f"{dataset_name}-{get_tokenizer_fingerprint(tokenizer)}-{seqlen}.pt")
+        if os.path.exists(cache_file):
+            return torch.load(cache_file)
+    tokens = EVAL_DATASETS[dataset_name](tokenizer, seqlen).to(torch.long)
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file}.tmp-{uuid.uuid4().hex}"
+        torch.save(tokens.clone(), tmp_file)
+        os.replace(tmp_file, cache_file)
+        logger.info(f"cached the tokenized {dataset_name} to {cache_file}")
+    return tokens
+
+
+@torch.no_grad()
+def eval_perplexity(model, tokens, seqlen=2048, stride=None, batch_size=1, device=None):
+    """Computes the perplexity of a causal language model on a tokenized corpus, in memory.
+
+    The corpus is cut into windows of seqlen tokens starting every stride tokens. With the default stride of
+    seqlen the windows do not overlap and the result matches eval_ppl_same_with_gptq. With a smaller stride each
+    window only scores the tokens the previous window did not, so they are predicted with a longer context.
+
+    Args:
+        model: The model, its forward takes input_ids and returns logits.
+        tokens (torch.Tensor): The 1D token ids of the corpus.
+        seqlen (int): The length of a window.
+        stride (int): The distance between the starts of two windows, defaults to seqlen.
+        batch_size (int): The number of windows per forward.
+        device: The device of the inputs, defaults to the device of the model parameters.
+
+    Returns:
+        float: The perplexity.
+    """
+    stride = seqlen if stride is None else stride
+    assert 0 < stride <= seqlen, "stride should be in (0, seqlen]"
+    assert tokens.numel() >= seqlen, f"the corpus has fewer than {seqlen} tokens"
+    if device is None:
+        device = next(model.parameters()).device
+    tokens = tokens.reshape(-1)
+    starts = list(range(0, tokens.numel() - seqlen + 1, stride))
+    use_cache = None
+    if hasattr(model, "config") and hasattr(model.config, "use_cache"):
+        use_cache = model.config.use_cache
+        model.config.use_cache = False
+
+    total_nll = torch.zeros((), dtype=torch.float64, device=device)
+    total_cnt = 0
+    try:
+        for i in range(0, len(starts), batch_size):
+            batch_starts = starts[i:i + batch_size]
+            batch = torch.stack([tokens[start:start + seqlen] for start in batch_starts]).to(device)
+            labels = batch[:, 1:].clone()
+            for idx, start in enumerate(batch_starts):
+                if start > 0 and stride < seqlen:  ## the tokens scored by the previous window are ignored
+                    labels[idx, :seqlen - stride - 1] = -100
+            logits = model(batch).logits[:, :-1, :]
+            nll = torch.nn.functional.cross_entropy(
+                logits.reshape(-1, logits.shape[-1]).float(), labels.reshape(-1), ignore_index=-100, reduction="sum")
+            total_nll += nll.to(total_nll.device, torch.float64)
+            total_cnt += int((labels != -100).sum())
+    finally:
+        if use_cache is not None:
+            model.config.use_cache = use_cache
+    return math.exp(total_nll.item() / total_cnt)
+
+
+def eval_datasets_perplexity(model, tokenizer, dataset_names=("wikitext2", "ptb", "c4"), seqlen=2048,
+                             stride=None, batch_size=1, cache_dir=DEFAULT_EVAL_CACHE_DIR):
+    """Computes the perplexity on several registered datasets, see get_eval_tokens and eval_perplexity.
+
+    Returns:
+        dict: The perplexity of every dataset.
+    """
+    results = {}
+    for dataset_name in dataset_names:
+        tokens = get_eval_tokens(dataset_name, tokenizer, seqlen=seqlen, cache_dir=cache_dir)
+        results[dataset_name] = eval_perplexity(
+            model, tokens, seqlen=seqlen, stride=stride, batch_size=batch_size)
+        logger.info(f"{dataset_name} perplexity: {results[dataset_name]:.4f}")
+    return results
@@ -16,10 +16,16 @@
 import copy
 import json
 import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import torch.nn as nn
 import transformers
+from safetensors.torch import save_file as safe_save_file
+from transformers.utils import SAFE_WEIGHTS_INDEX_NAME, SAFE_WEIGHTS_NAME
+from transformers.utils.hub import convert_file_size_to_int
 
 from auto_round.export.register import register_format
 from auto_round.utils import get_layer_names_in_block, get_module, logger, set_module
@@ -149,6 +155,12 @@ def save_quantized_as_autoround(output_dir, inplace=True, backend="auto_round:ex
             - layer_config (dict): The layer configuration for each layer.
             - serialization_dict (dict): The serialization configuration.
             - tokenizer (Tokenizer, optional): The tokenizer to be saved.
+            - num_workers (int, optional): The number of threads packing layers concurrently. Default is the
+                                           number of cpu cores, capped at 8.
+            - max_shard_size (str, optional): The maximum size of a safetensors shard. Default is "5GB".
+            - safe_serialization (bool, optional): Whether to stream the packed layers into safetensors shards.
+                                                   If False, all layers are packed first and saved with
+                                                   `save_pretrained` in the pickle format. Default is True.
 
     Returns:
         None
@@ -167,8 +179,10 @@ def save_quantized_as_autoround(output_dir, inplace=True, backend="auto_round:ex
     model = kwargs["model"]
     multimodal = kwargs["multimodal"]
     model = model.to(torch.float16)  ##force to fp16
+    safe_serialization = kwargs.get("safe_serialization", True)
     if not inplace:
-        model = copy.deepcopy(model.to("cpu"))
+        ##the streaming path never modifies the model, so there is no need to hold a deepcopy of it in memory
+        model = model.to("cpu") if safe_serialization else copy.deepcopy(model.to("cpu"))
     layer_names_in_block = get_layer_names_in_block(model, multimodal=multimodal)
 
     layer_config = kwargs["layer_config"]
@@ -197,61 +211,223 @@ def save_quantized_as_autoround(output_dir, inplace=True, backend="auto_round:ex
                 extra_config[layer_name][key] = layer_config[layer_name][key]
     if len(extra_config) > 0:
         quantization_config["extra_config"] = extra_config
-    with tctl.threadpool_limits(limits=1):
-        for name in layer_config.keys():
-
-            config = kwargs["layer_config"][name]
-            if config["bits"] > 8:
-                continue
-            logger.info(f"packing {name}")
-
-            bits = config["bits"]
-            group_size = config["group_size"]
-            sym = config["sym"]
-
-            layer = get_module(model, name)
-            device = layer.weight.device
-
-            QuantLinear = dynamic_import_quantLinear_for_packing(backend, bits, group_size, sym)
-
-            if isinstance(layer, nn.Linear):
-                in_features = layer.in_features
-                out_features = layer.out_features
-            elif isinstance(layer, nn.Conv2d):
-                in_features = layer.in_channels
-                out_features = layer.out_channels
-            elif isinstance(layer, transformers.pytorch_utils.Conv1D):
-                in_features = layer.weight.shape[0]
-                out_features = layer.weight.shape[1]
-            bias = layer.bias is not None and torch.any(layer.bias)
-
-            new_layer = QuantLinear(  ##pylint: disable=E1123
-                bits, group_size, in_features, out_features, bias, weight_dtype=layer.weight.dtype
-            )
+    names = [name for name in layer_config.keys() if layer_config[name]["bits"] <= 8]
+    tokenizer = kwargs["tokenizer"]
+    if tokenizer is not None:
+        tokenizer.save_pretrained(output_dir)
+
+    if not safe_serialization:
+        if hasattr(model, "config"):
+            model.config.quantization_config = quantization_config
+        with tctl.threadpool_limits(limits=1):
+            for name in names:
+                logger.info(f"packing {name}")
+                qlayer = pack_layer(name, model, layer_config, backend)
+                set_module(model, name, qlayer)
+        save(model, output_dir, max_shard_size=kwargs.get("max_shard_size", "5GB"), safe_serialization=False)
+        return
+
+    num_workers = kwargs.get("num_workers", min(8, os.cpu_count() or 1))
+    os.makedirs(output_dir, exist_ok=True)
+    writer = ShardWriter(output_dir, max_shard_size=kwargs.get("max_shard_size", "5GB"))
+    ##keep a bounded number of layers in flight so that packed layers never pile up ahead of the writer
+    pending = deque()
+    with tctl.threadpool_limits(limits=1), ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for name in names:
+            pending.append((name, executor.submit(pack_layer, name, model, layer_config, backend)))
+            if len(pending) >= 2 * num_workers:
+                _write_packed_layer(model, writer, *pending.popleft(), inplace=inplace)
+        while len(pending) > 0:
+            _write_packed_layer(model, writer, *pending.popleft(), inplace=inplace)
+
+    for key, tensor in get_unpacked_state_dict(model, names).items():
+        writer.add(key, tensor)
+    writer.close()
+    save_config(model, output_dir, quantization_config, inplace=inplace)
+
+
+def pack_layer(name, model, layer_config, backend):
+    """
+    Packs a single quantized layer of the model into a QuantLinear layer, the model is left untouched.
+
+    Args:
+        name (str): The name of the layer to be packed.
+        model (nn.Module): The model containing the layer.
+        layer_config (dict): The layer configuration for each layer, holding the scale and zp.
+        backend (str): The backend to be used for packing.
+
+    Returns:
+        nn.Module: The packed QuantLinear layer, placed on the device of the original layer.
+    """
+    config = layer_config[name]
+    bits = config["bits"]
+    group_size = config["group_size"]
+    sym = config["sym"]
+
+    layer = get_module(model, name)
+    device = layer.weight.device
+
+    QuantLinear = dynamic_import_quantLinear_for_packing(backend, bits, group_size, sym)
+
+    if isinstance(layer, nn.Linear):
+        in_features = layer.in_features
+        out_features = layer.out_features
+    elif isinstance(layer, nn.Conv2d):
+        in_features = layer.in_channels
+        out_features = layer.out_channels
+    elif isinstance(layer, transformers.pytorch_utils.Conv1D):
+        in_features = layer.weight.shape[0]
+        out_features = layer.weight.shape[1]
+    bias = layer.bias is not None and torch.any(layer.bias)
+
+    qlayer = QuantLinear(  ##pylint: disable=E1123
+        bits, group_size, in_features, out_features, bias, weight_dtype=layer.weight.dtype
+    )
+
+    qlayer.device = device
+    scale = config["scale"]
+    zero = config["zp"]
+    # so far can only pack layer on CPU
+    qlayer.to("cpu")
+    ##force to float32 to be compatible with torch 2.0
+    layer, scale, zero = layer.to("cpu"), scale.to("cpu"), zero.to("cpu").to(torch.float32)
+    sig = inspect.signature(qlayer.pack)
+    param_count = len(sig.parameters)
+    if param_count == 2:
+        qlayer.pack(layer, scale)
+    else:
+        qlayer.pack(layer, scale, zero, None)
+    qlayer.to(device)
+    return qlayer
+
+
+def _write_packed_layer(model, writer, name, future, inplace=True):
+    """Waits for a packing job and writes the packed tensors, the original fp16 layer is released if inplace."""
+    qlayer = future.result()
+    logger.info(f"packed {name}")
+    for key, tensor in qlayer.state_dict().items():
+        writer.add(f"{name}.{key}", tensor)
+    if inplace:
+        set_module(model, name, qlayer)
+
 
-            new_layer.device = device
-            set_module(model, name, new_layer)
-            qlayer = new_layer
-            scale = layer_config[name]["scale"]
-            zero = layer_config[name]["zp"]
-            # so far can only pack layer on CPU
-            qlayer.to("cpu")
-            ##force to float32 to be compatible with torch 2.0
-            layer, scale, zero = layer.to("cpu"), scale.to("cpu"), zero.to("cpu").to(torch.float32)
-            sig = inspect.signature(qlayer.pack)
-            param_count = len(sig.parameters)
-            if param_count == 2:
-                qlayer.pack(layer, scale)
+def get_unpacked_state_dict(model, packed_names):
+    """
+    Collects the tensors of the model that do not belong to a packed layer, dropping tied duplicates the same way
+    `save_pretrained` does.
+
+    Args:
+        model (nn.Module): The model.
+        packed_names (list): The names of the packed layers.
+
+    Returns:
+        dict: The remaining state dict.
+    """
+    prefixes = tuple(name + "." for name in packed_names)
+    state_dict = {key: tensor for key, tensor in model.state_dict().items() if not key.startswith(prefixes)}
+    ignore_keys = getattr(model, "_keys_to_ignore_on_save", None) or []
+    state_dict = {key: tensor for key, tensor in state_dict.items() if key not in ignore_keys}
+
+    tied_keys = getattr(model, "_tied_weights_keys", None) or []
+    storages = {}
+    for key, tensor in state_dict.items():
+        storages.setdefault((tensor.device, tensor.untyped_storage().data_ptr()), []).append(key)
+    for keys in storages.values():
+        if len(keys) < 2:
+            continue
+        keep = [key for key in keys if not any(re.search(pattern, key) for pattern in tied_keys)]
+        keep = keep[0] if len(keep) > 0 else keys[0]
+        for key in keys:
+            if key != keep:
+                state_dict.pop(key)
+    return state_dict
+
+
+class ShardWriter:
+    """Writes tensors into safetensors shards incrementally, a shard is flushed to disk as soon as it is full.
+
+    The shards are named like `save_pretrained` does and an index file is written if there is more than one.
+
+    Args:
+        save_dir (str): The directory to write the shards to.
+        max_shard_size (str or int): The maximum size of a shard, e.g. "5GB".
+    """
+
+    def __init__(self, save_dir, max_shard_size="5GB"):
+        self.save_dir = save_dir
+        if isinstance(max_shard_size, str):
+            max_shard_size = convert_file_size_to_int(max_shard_size)
+        self.max_shard_size = max_shard_size
+        self.shard = {}
+        self.shard_size = 0
+        self.shard_files = []
+        self.weight_map = {}
+        self.total_size = 0
+
+    def add(self, key, tensor):
+        """Adds a tensor to the current shard, the shard is flushed first if the tensor does not fit."""
+        size = tensor.numel() * tensor.element_size()
+        if self.shard_size > 0 and self.shard_size + size > self.max_shard_size:
+            self.flush()
+        self.shard[key] = tensor.detach().to("cpu").contiguous()
+        self.shard_size += size
+        self.total_size += size
+
+    def flush(self):
+        """Writes the current shard to disk and releases its tensors."""
+        if len(self.shard) == 0:
+            return
+        shard_file = f"tmp-shard-{len(self.shard_files):05d}.safetensors"
+        safe_save_file(self.shard, os.path.join(self.save_dir, shard_file), metadata={"format": "pt"})
+        self.shard_files.append((shard_file, list(self.shard.keys())))
+        self.shard = {}
+        self.shard_size = 0
+
+    def close(self):
+        """Flushes the last shard, renames the shards to their final names and writes the index file."""
+        self.flush()
+        num_shards = len(self.shard_files)
+        for idx, (shard_file, keys) in enumerate(self.shard_files):
+            if num_shards == 1:
+                final_name = SAFE_WEIGHTS_NAME
             else:
-                qlayer.pack(layer, scale, zero, None)
-            qlayer.to(device)
+                final_name = SAFE_WEIGHTS_NAME.replace(".safetensors", f"-{idx + 1:05d}-of-{num_shards:05d}.safetensors")
+            os.replace(os.path.join(self.save_dir, shard_file), os.path.join(self.save_dir, final_name))
+            for key in keys:
+                self.weight_map[key] = final_name
+        ##remove the weights left in the directory by a previous save, as `save_pretrained` does
+        stale_prefix = SAFE_WEIGHTS_NAME.replace(".safetensors", "")
+        for file in os.listdir(self.save_dir):
+            if file.startswith(stale_prefix) and file.endswith(".safetensors") and file not in self.weight_map.values():
+                os.remove(os.path.join(self.save_dir, file))
+        if num_shards == 1 and os.path.exists(os.path.join(self.save_dir, SAFE_WEIGHTS_INDEX_NAME)):
+            os.remove(os.path.join(self.save_dir, SAFE_WEIGHTS_INDEX_NAME))
+        if num_shards > 1:
+            index ={"metadata": {"total_size": self.total_size}, "weight_map": self.weight_map}
+            with open(os.path.join(self.save_dir, SAFE_WEIGHTS_INDEX_NAME), "w", encoding="utf-8") as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+
+
+def save_config(model: nn.Module, save_dir: str, quantization_config: dict, inplace: bool = True):
+    """Save the model configs, which `save_pretrained` writes alongside the weights.
 
+    Args:
+        model (`nn.Module`): The packed model.
+        save_dir (`str`): Directory to which to save.
+        quantization_config (`dict`): The quantization config to be attached to the model config.
+        inplace (`bool`): Whether to attach the quantization config to the model config or to a copy of it.
+    """
     if hasattr(model, "config"):
-        model.config.quantization_config = quantization_config
-    tokenizer = kwargs["tokenizer"]
-    if tokenizer is not None:
-        tokenizer.save_pretrained(output_dir)
-    save(model, output_dir)
+        config = model.config if inplace else copy.deepcopy(model.config)
+        config.quantization_config = quantization_config
+        config.torch_dtype = torch.float16
+        config.architectures = [model.__class__.__name__]
+        config.save_pretrained(save_dir)
+    if getattr(model, "generation_config", None) is not None and model.can_generate():
+        model.generation_config.save_pretrained(save_dir)
+    config_file = "quantization_config.json"
+    with open(os.path.join(save_dir, config_file), "w", encoding="utf-8") as f:
+        json.dump(quantization_config, f, indent=2)
 
 
 def save(model: nn.Module, save_dir: str, max_shard_size: str = "5GB", safe_serialization: bool = True):
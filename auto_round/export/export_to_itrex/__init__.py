@@ -13,3 +13,4 @@
 # limitations under the License.
 from .export import save_quantized_as_itrex, pack_model
 from .config import QuantConfig
+from .model_wrapper import DequantizedWeightCache, set_weight_cache
@@ -18,6 +18,8 @@
 # Note: Do not import this file unless you have already imported torch,
 # since the model classes inherit torch.nn.Module.
 import math
+import weakref
+from collections import OrderedDict
 
 import torch
 from packaging.version import Version
@@ -70,7 +72,117 @@ def get_torch_version():
 PT_VERSION = get_torch_version().release
 
 
+class DequantizedWeightCache:
+    """A bounded LRU cache of the dequantized weights of WeightOnlyLinear layers.
+
+    By default a WeightOnlyLinear keeps its recovered weight forever, which doubles the memory of a packed model.
+    With this cache, the recovered weights are shared under a byte budget and the least recently used ones are
+    evicted, the hit/miss counters help to size the budget for a given workload.
+
+    Args:
+        max_bytes (int): The budget of the cached weights in bytes. A weight larger than the budget is never cached.
+    """
+
+    def __init__(self, max_bytes):
+        assert max_bytes >= 0, "max_bytes should be non-negative"
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.tracked_layers = set()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, layer):
+        """Returns the dequantized weight of the layer, recovering it on a miss."""
+        key = id(layer)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        weight = layer.dequantize()
+        size = weight.numel() * weight.element_size()
+        if size > self.max_bytes:
+            return weight
+        while self.cached_bytes + size > self.max_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted.numel() * evicted.element_size()
+            self.evictions += 1
+        self.cache[key] = weight
+        self.cached_bytes += size
+        if key not in self.tracked_layers:
+            self.tracked_layers.add(key)
+            weakref.finalize(layer, self._release, key)
+        return weight
+
+    def _release(self, key):
+        self.tracked_layers.discard(key)
+        self.invalidate(key)
+
+    def invalidate(self, key):
+        """Drops the weight cached for a layer id, e.g. once the layer is repacked or freed."""
+        weight = self.cache.pop(key, None)
+        if weight is not None:
+            self.cached_bytes -= weight.numel() * weight.element_size()
+
+    def clear(self):
+        """Drops all the cached weights and resets the counters."""
+        self.cache.clear()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Returns the counters of the cache as a dict."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "cached_layers": len(self.cache),
+            "cached_bytes": self.cached_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def set_weight_cache(model=None, max_bytes=None):
+    """Enables a bounded cache of dequantized weights for WeightOnlyLinear layers, replacing the per-layer weights.
+
+    The recovered weights the layers already hold are dropped, so that the budget bounds their memory.
+
+    Args:
+        model (torch.nn.Module, optional): The model whose WeightOnlyLinear layers use the cache. If None, the cache
+                                           is set for all the WeightOnlyLinear layers, including those given a cache
+                                           of their own through model before.
+        max_bytes (int, optional): The budget of the cache in bytes. If None, the cache is disabled and the layers
+                                   keep their recovered weight again.
+
+    Returns:
+        DequantizedWeightCache: The cache, or None if it is disabled.
+    """
+    cache = DequantizedWeightCache(max_bytes) if max_bytes is not None else None
+    if model is None:
+        WeightOnlyLinear.weight_cache = cache
+        layers = list(WeightOnlyLinear.instances)
+        for layer in layers:
+            layer.__dict__.pop("weight_cache", None)  # the layer follows the class attribute again
+    else:
+        layers = [m for m in model.modules() if isinstance(m, WeightOnlyLinear)]
+        for layer in layers:
+            layer.weight_cache = cache
+    for layer in layers:
+        if hasattr(layer, "weight"):
+            del layer.weight  # the cache takes over the recovered weight, or it is recovered again
+    return cache
+
+
 class WeightOnlyLinear(torch.nn.Module):
+    weight_cache = None
+    instances = weakref.WeakSet()  # the live layers, which set_weight_cache without a model applies to
+
     def __init__(
         self,
         in_features,
@@ -87,6 +199,7 @@ class WeightOnlyLinear(torch.nn.Module):
         use_optimum_format=True,
     ):
         super().__init__()
+        WeightOnlyLinear.instances.add(self)
         self.use_optimum_format = use_optimum_format
         self.dtype = dtype
         if "int" not in self.dtype:  # for nf4, fp4
@@ -187,12 +300,56 @@ class WeightOnlyLinear(torch.nn.Module):
             else:
                 self.bias = None
 
-    def pack(self, int_weight, scale, zp, bias):
-        if self.use_optimum_format:
-            self.scales = self.scales.t_().contiguous()
-            self.qweight = self.qweight.t_().contiguous()
-            self.qzeros = self.qzeros.t_().contiguous()
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        WeightOnlyLinear.instances.add(self)  # copies and unpickled layers are not built by __init__
 
+    def pack_tensor(self, raw_tensor):
+        """Packs every n_pack consecutive values along the last dim into one value of compression_dtype.
+
+        Args:
+            raw_tensor (torch.Tensor): 2D integer tensor, the last dim is padded with zeros up to a multiple of n_pack.
+
+        Returns:
+            torch.Tensor: The packed tensor of shape (raw_tensor.shape[0], ceil(raw_tensor.shape[1] / n_pack)).
+        """
+        rows, cols = raw_tensor.shape
+        packed_cols = math.ceil(cols / self.n_pack)
+        mask = torch.tensor(2**self.bits - 1, dtype=self.compression_dtype).to(raw_tensor.device)
+        raw_tensor = raw_tensor.type(self.compression_dtype) & mask
+        if packed_cols * self.n_pack != cols:
+            raw_tensor = F.pad(raw_tensor, (0, packed_cols * self.n_pack - cols))
+        raw_tensor = raw_tensor.reshape(rows, packed_cols, self.n_pack)
+        packed_tensor = torch.zeros(rows, packed_cols, dtype=self.compression_dtype).to(raw_tensor.device)
+        for e in range(self.n_pack):
+            packed_tensor |= raw_tensor[:, :, e] << (self.bits * e)
+        return packed_tensor
+
+    def unpack_tensor(self, packed_tensor, cols, dtype, remove_sign=True):
+        """Unpacks a tensor packed by `pack_tensor`.
+
+        Args:
+            packed_tensor (torch.Tensor): 2D packed tensor of compression_dtype.
+            cols (int): The number of values to keep along the last dim, the padding is dropped.
+            dtype (torch.dtype): The dtype of the unpacked tensor.
+            remove_sign (bool): Whether to mask off the sign bits, otherwise the values are sign extended.
+
+        Returns:
+            torch.Tensor: The unpacked tensor of shape (packed_tensor.shape[0], cols).
+        """
+        device = packed_tensor.device
+        left_shifts = torch.tensor(
+            [self.compress_bits - self.bits * (e + 1) for e in range(self.n_pack)], dtype=self.compression_dtype
+        ).to(device)
+        unpacked = (packed_tensor.unsqueeze(-1) << left_shifts) >> (self.compress_bits - self.bits)
+        if remove_sign:
+            unpacked &= torch.tensor(2**self.bits - 1, dtype=self.compression_dtype).to(device)
+        unpacked = unpacked.reshape(packed_tensor.shape[0], -1)[:, :cols]
+        return unpacked.type(dtype)
+
+    def pack(self, int_weight, scale, zp, bias):
+        if self.weight_cache is not None:
+            self.weight_cache.invalidate(id(self))
         int_weight = int_weight.to(self.device)
         if self.use_optimum_format and zp is None:
             # to avoid overflow
@@ -203,142 +360,101 @@ class WeightOnlyLinear(torch.nn.Module):
         if bias is not None:
             assert hasattr(self, "bias"), "bias is not set when initializing."
             self.bias = bias.type(self.float_type).to(self.device)
-        assert scale.shape == self.scales.shape, "Scale shape is mismatched."
+        scales_shape = self.scales.t().shape if self.use_optimum_format else self.scales.shape
+        assert scale.shape == scales_shape, "Scale shape is mismatched."
         self.scales = scale.type(self.float_type).to(self.device)
         if not self.use_optimum_format and self.compression_dim == 0:
-            int_weight = int_weight.t_().contiguous()
-            self.qweight = self.qweight.t_().contiguous()
-        origin_shape = int_weight.shape
-        target_shape = self.qweight.shape
-        assert origin_shape[0] == target_shape[0], "output channels mismatch, please check."
-        mask = torch.tensor(2**self.bits - 1, dtype=self.compression_dtype).to(self.device)
+            int_weight = int_weight.t().contiguous()
+        compressed_on_input = not self.use_optimum_format and self.compression_dim == 1
+        target_rows = self.qweight.shape[0] if compressed_on_input else self.qweight.shape[1]
+        assert int_weight.shape[0] == target_rows, "output channels mismatch, please check."
 
         # pack weight
-        for j in range(target_shape[1]):
-            start = self.n_pack * j
-            end = self.n_pack * (j + 1)
-            tmp = int_weight[:, start:end].type(self.compression_dtype)
-            for e in range(tmp.shape[1]):
-                tmp[:, e] &= mask
-                tmp[:, e] = tmp[:, e] << (self.bits * e)
-                self.qweight[:, j] |= tmp[:, e]
+        self.qweight = self.pack_tensor(int_weight)
         if not self.use_optimum_format and self.compression_dim == 0:
-            self.qweight = self.qweight.t_().contiguous()
+            self.qweight = self.qweight.t().contiguous()
 
         if zp is not None:
+            assert hasattr(self, "qzeros"), "zp is not set when initializing."
             zp = zp.to(self.device)
             if self.use_optimum_format:
-                zp -= 1
+                zp = zp - 1
             if self.use_optimum_format or self.compression_dim == 0:
-                zp = zp.t_().contiguous()
-                self.qzeros = self.qzeros.t_().contiguous()
-            assert hasattr(self, "qzeros"), "zp is not set when initializing."
-            target_shape = self.qzeros.shape
-            for j in range(target_shape[1]):
-                start = self.n_pack * j
-                end = self.n_pack * (j + 1)
-                tmp = zp[:, start:end].type(self.compression_dtype)
-                for e in range(tmp.shape[1]):
-                    tmp[:, e] &= mask
-                    tmp[:, e] = tmp[:, e] << (self.bits * e)
-                    self.qzeros[:, j] |= tmp[:, e]
+                zp = zp.t().contiguous()
+            self.qzeros = self.pack_tensor(zp)
             if self.use_optimum_format or self.compression_dim == 0:
-                self.qzeros = self.qzeros.t_().contiguous()
+                self.qzeros = self.qzeros.t().contiguous()
         if self.use_optimum_format:
-            self.scales = self.scales.t_().contiguous()
-            self.qweight = self.qweight.t_().contiguous()
-            self.qzeros = self.qzeros.t_().contiguous()
+            self.scales = self.scales.t().contiguous()
+            self.qweight = self.qweight.t().contiguous()
+            self.qzeros = self.qzeros.t().contiguous()
 
     def recover(self):
         logger.debug(f"Recovering {self} weight")
-        scales = self.scales.t_().contiguous() if self.use_optimum_format else self.scales
-        qweight = self.qweight.t_().contiguous() if self.use_optimum_format else self.qweight
+        scales = self.scales.t() if self.use_optimum_format else self.scales
+        qweight = self.qweight.t().contiguous() if self.use_optimum_format else self.qweight
 
-        device = scales.device
-        fp32_weight = torch.zeros(self.out_features, self.in_features, dtype=self.float_type).to(device)
-        mask = torch.tensor(2**self.bits - 1, dtype=self.compression_dtype).to(device)
         if hasattr(self, "qzeros"):
             weight_dtype = torch.uint8
         else:
             weight_dtype = torch.int8
         # unpack weight
-        weight = torch.zeros(self.out_features, self.in_features, dtype=weight_dtype).to(device)
         if not self.use_optimum_format and self.compression_dim == 0:
-            weight = weight.t_().contiguous()
-            qweight = qweight.t_().contiguous()
-        origin_shape = weight.shape
-        target_shape = qweight.shape
-        for j in range(target_shape[1]):
-            for e in range(self.n_pack):
-                index = j * self.n_pack + e
-                if index >= origin_shape[1]:
-                    continue
-                tmp = qweight[:, j]
-                tmp = tmp << (self.compress_bits - self.bits * (e + 1))
-                tmp = tmp >> self.compress_bits - self.bits
-                if weight_dtype == torch.uint8:
-                    tmp &= mask  # remove sign bit
-                weight[:, index] = tmp.type(weight_dtype)
-        if not self.use_optimum_format and self.compression_dim == 0:
-            weight = weight.t_().contiguous()
+            weight = self.unpack_tensor(qweight.t(), self.out_features, weight_dtype, weight_dtype == torch.uint8)
+            weight = weight.t().contiguous()
+        else:
+            weight = self.unpack_tensor(qweight, self.in_features, weight_dtype, weight_dtype == torch.uint8)
         if "int" not in self.dtype:
-            new_weight = torch.zeros(self.out_features, self.in_features).to(device)
+            new_weight = torch.zeros(self.out_features, self.in_features).to(weight.device)
             for k, v in self.int2float_mapping.items():
                 new_weight += torch.where(weight == k, v, 0)
             weight = new_weight
+        if self.in_features == scales.shape[1] * self.groupsize:
+            # broadcast over the groups instead of gathering scale/zp for every input channel
+            weight = weight.reshape(self.out_features, scales.shape[1], self.groupsize)
+            expand_group = lambda t: t.unsqueeze(-1)
+        else:
+            g_idx = torch.arange(self.in_features, device=weight.device) // self.groupsize
+            expand_group = lambda t: t[:, g_idx]
         # unpack zero_point
         if hasattr(self, "qzeros"):
             zp_dtype = self.compression_dtype  # to avoid overflow when weight-zp
-            zp = torch.zeros(scales.shape, dtype=zp_dtype).to(device)
-            qzeros = self.qzeros.t_().contiguous() if self.use_optimum_format else self.qzeros
             if self.use_optimum_format or self.compression_dim == 0:
-                zp = zp.t_().contiguous()
-                qzeros = qzeros.t_().contiguous()
-            origin_shape = zp.shape
-            target_shape = qzeros.shape
-            for j in range(target_shape[1]):
-                for e in range(self.n_pack):
-                    index = j * self.n_pack + e
-                    if index >= origin_shape[1]:
-                        continue
-                    tmp = qzeros[:, j]
-                    tmp = tmp << (self.compress_bits - self.bits * (e + 1))
-                    tmp = tmp >> self.compress_bits - self.bits
-                    tmp &= mask
-                    zp[:, index] = tmp.type(zp_dtype)
-            if self.use_optimum_format or self.compression_dim == 0:
-                zp = zp.t_().contiguous()
+                qzeros = self.qzeros if self.use_optimum_format else self.qzeros.t()
+                zp = self.unpack_tensor(qzeros, scales.shape[0], zp_dtype).t().contiguous()
+            else:
+                zp = self.unpack_tensor(self.qzeros, scales.shape[1], zp_dtype)
             if self.use_optimum_format:
                 # zp -= 1 may cause zp == -1, after recover it becomes 2**self.bits - 1
                 zp += 1
                 zp = torch.where(zp > (2**self.bits - 1), 0, zp)
             # recover fp32 weight with int_weight, scale, and zero_point
-            for idx in range(self.in_features):
-                g_idx = idx // self.groupsize
-                fp32_weight[:, idx] = (weight[:, idx] - zp[:, g_idx]) * scales[:, g_idx]
+            fp32_weight = (weight - expand_group(zp)) * expand_group(scales)
         else:
             # recover fp32 weight with int_weight, scale
-            for idx in range(self.in_features):
-                g_idx = idx // self.groupsize
-                fp32_weight[:, idx] = weight[:, idx] * scales[:, g_idx]
-        return fp32_weight
+            fp32_weight = weight * expand_group(scales)
+        return fp32_weight.reshape(self.out_features, self.in_features).type(self.float_type)
+
+    def dequantize(self):
+        """Recovers the weight, fp16 weights on CPU are upcast to fp32 together with the bias."""
+        weight = self.recover()
+        device = self.scales.device
+        if weight.dtype == torch.float16 and device.type == "cpu":
+            weight = weight.float()
+            self.bias = self.bias.float() if self.bias is not None else None
+        return weight
 
     def forward(self, input):
-        if not hasattr(self, "weight"):
-            weight = self.recover()
-            device = self.scales.device
-            if weight.dtype == torch.float16 and device.type == "cpu":
-                weight = weight.float()
-                self.bias = self.bias.float() if self.bias is not None else None
-        if True:  # keep reusing self.weight due to recover is too slow.
-            if not hasattr(self, "weight"):
-                self.weight = weight
-            input = input.type(self.weight.dtype)
-            logger.debug(f"Calculating {self}")
-            return F.linear(input, self.weight, self.bias)
-        else:
+        if self.weight_cache is not None:  # bounded cache shared by the layers, see set_weight_cache
+            weight = self.weight_cache.get(self)
             input = input.type(weight.dtype)
             return F.linear(input, weight, self.bias)
+        # keep reusing self.weight due to recover is too slow.
+        if not hasattr(self, "weight"):
+            self.weight = self.dequantize()
+        input = input.type(self.weight.dtype)
+        logger.debug(f"Calculating {self}")
+        return F.linear(input, self.weight, self.bias)
 
     def extra_repr(self) -> str:
         tmp_str = "in_features={}, out_features={}, bits={}, group_size={}, bias={}".format(
@@ -0,0 +1,39 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+
+def pack_along_axis(intweight, bits, axis=0):
+    """Packs every 32 // bits consecutive uint32 values along `axis` into one uint32 word.
+
+    The i-th value of each pack is shifted left by bits * i, the same layout the triton/exllamav2 kernels expect.
+
+    Args:
+        intweight (np.ndarray): 2D uint32 array, its size along `axis` must be divisible by 32 // bits.
+        bits (int): Number of bits per value, one of 2, 4, 8.
+        axis (int): The axis to pack along, 0 for qweight and 1 for qzeros.
+
+    Returns:
+        np.ndarray: The packed uint32 array.
+    """
+    if bits not in [2, 4, 8]:
+        raise NotImplementedError("Only 2,4,8 bits are supported.")
+    pack_num = 32 // bits
+    shifts = np.arange(pack_num, dtype=np.uint32) * bits
+    if axis == 0:
+        intweight = intweight.reshape(-1, pack_num, intweight.shape[1]) << shifts[None, :, None]
+    else:
+        intweight = intweight.reshape(intweight.shape[0], -1, pack_num) << shifts[None, None, :]
+    return np.bitwise_or.reduce(intweight, axis=axis + 1)
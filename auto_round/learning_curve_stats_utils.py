@@ -1,7 +1,8 @@
+from collections import deque
+
 import numpy as np
-import scipy.stats
-import plotly.graph_objects as go
-import pandas as pd
+
+from .utils import go, pd, scipy_stats
 
 
 def calculate_convergence_iter(loss_values, std_fraction=0.1, window=5, consecutive_iters=10):
@@ -70,11 +71,68 @@ def calculate_slope(loss_values, last_iter: int = -1, window: int = 5):
     moving_avg = np.convolve(loss_values, np.ones(window)/window, mode='valid')
     
     loss_values_to_consider = moving_avg if last_iter == -1 else moving_avg[:last_iter]
-    slope, _, _, _, _ = scipy.stats.linregress(range(len(loss_values_to_consider)), loss_values_to_consider)
+    slope, _, _, _, _ = scipy_stats.linregress(range(len(loss_values_to_consider)), loss_values_to_consider)
     
     return slope
 
 
+class ConvergenceDetector:
+    """
+    Online counterpart of calculate_convergence_iter, fed one loss value per iter while a block is tuned.
+
+    The loss values are smoothed with a moving average over the last `window` values. An iter is flat when both
+    the slope of the least squares line through the last `window` smoothed values and the change of the smoothed
+    value since the previous iter are under `threshold`, both relative to the current smoothed value. The loss is
+    converged once `patience` consecutive iters are flat.
+
+    Parameters:
+        threshold (float): The relative slope and relative change under which an iter is flat.
+        patience (int): The number of consecutive flat iters to declare the convergence.
+        window (int): The size of the moving average window, also the number of smoothed values in the slope.
+    """
+
+    def __init__(self, threshold=1e-3, patience=10, window=5):
+        assert threshold > 0, "threshold should be positive"
+        assert patience > 0, "patience should be positive"
+        assert window >= 2, "window should be at least 2"
+        self.threshold = threshold
+        self.patience = patience
+        self.window = window
+        self.loss_values = deque(maxlen=window)
+        self.moving_avg = deque(maxlen=window)
+        ## the centered iter indices of the window, the slope is sum(x * y) / sum(x * x) for centered x
+        self.x = np.arange(window) - (window - 1) / 2
+        self.x_norm = float(np.sum(self.x * self.x))
+        self.num_iters = 0
+        self.flat_iters = 0
+
+    def update(self, loss):
+        """
+        Adds the loss value of an iter.
+
+        Parameters:
+            loss (float): The loss value of the iter.
+
+        Returns:
+            bool: Whether the loss is converged.
+        """
+        self.num_iters += 1
+        self.loss_values.append(float(loss))
+        if len(self.loss_values) < self.window:
+            return False
+        self.moving_avg.append(sum(self.loss_values) / self.window)
+        if len(self.moving_avg) < self.window:
+            return False
+        scale = max(abs(self.moving_avg[-1]), np.finfo(np.float32).tiny)
+        slope = float(np.dot(self.x, self.moving_avg)) / self.x_norm / scale
+        relative_change = abs(self.moving_avg[-1] - self.moving_avg[-2]) / scale
+        if abs(slope) < self.threshold and relative_change < self.threshold:
+            self.flat_iters += 1
+        else:
+            self.flat_iters = 0
+        return self.flat_iters >= self.patience
+
+
 def plot_learning_curve(loss_values, convergence_iter=-1, title="Learning Curve", xaxis_title="iter", yaxis_title="mse"):
     """
     Plots the learning curve using the provided loss values.
@@ -175,7 +233,7 @@ def plot_learning_curve(loss_values, convergence_iter=-1, title="Learning Curve"
 def make_pandas_dataframe_from_lm_eval_results(
     result_dict, 
     column: str = "results"
-) -> pd.DataFrame:
+) -> "pd.DataFrame":
     """Generate dataframe of results."""
 
     if column == "results":
@@ -0,0 +1,202 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+import torch
+
+from .utils import wandb
+
+METRICS_SINKS = {}
+
+
+def register_metrics_sink(name):
+    """Decorator to register a metrics sink.
+
+    Args:
+        name: A string. Define the sink name.
+
+    Returns:
+        cls: The registered class.
+    """
+
+    def register(sink):
+        METRICS_SINKS[name] = sink
+        return sink
+
+    return register
+
+
+def get_metrics_sink(sink, **kwargs):
+    """Gets a metrics sink by name, a sink object is returned as is and None disables the metrics.
+
+    Args:
+        sink: The name of a registered sink, one of memory, jsonl and wandb by default, or a MetricsSink.
+        **kwargs: The arguments of the sink class.
+
+    Returns:
+        MetricsSink: The sink, or None.
+    """
+    if sink is None or isinstance(sink, MetricsSink):
+        return sink
+    assert sink in METRICS_SINKS, f"metrics sink {sink} is not supported, choose from {list(METRICS_SINKS)}"
+    return METRICS_SINKS[sink](**kwargs)
+
+
+class MetricsSink(ABC):
+    """The interface of the destinations of the metrics of the tuning, values are python scalars."""
+
+    def define_metric(self, name, step_metric=None):
+        """Declares a metric, plotted against step_metric if it is given."""
+        pass
+
+    @abstractmethod
+    def log(self, data):
+        """Logs a dict of metric values."""
+
+    @abstractmethod
+    def log_table(self, name, columns, rows):
+        """Logs a table, it is logged again with all its rows every time one is added."""
+
+    def close(self):
+        pass
+
+
+@register_metrics_sink("memory")
+class InMemoryMetricsSink(MetricsSink):
+    """Keeps the metrics in memory, history maps a metric to its values and tables a table name to its rows."""
+
+    def __init__(self):
+        self.history = defaultdict(list)
+        self.tables = {}
+
+    def log(self, data):
+        for key, value in data.items():
+            self.history[key].append(value)
+
+    def log_table(self, name, columns, rows):
+        self.tables[name] = [dict(zip(columns, row)) for row in rows]
+
+
+def _to_json(obj):
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    return str(obj)
+
+
+@register_metrics_sink("jsonl")
+class JsonlMetricsSink(MetricsSink):
+    """Appends every log call as one json line to a file.
+
+    The file is opened per call, so the sink can be pickled into worker processes.
+
+    Args:
+        path (str): The path of the file.
+    """
+
+    def __init__(self, path="autoround_metrics.jsonl"):
+        self.path = path
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+
+    def _write(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=_to_json) + "\n")
+
+    def log(self, data):
+        self._write(data)
+
+    def log_table(self, name, columns, rows):
+        ## only the new row is written, the rows before it are in the file already
+        self._write({"table": name, **dict(zip(columns, rows[-1]))})
+
+
+@register_metrics_sink("wandb")
+class WandbMetricsSink(MetricsSink):
+    """Logs to the active wandb run, figures in table cells are logged as html."""
+
+    def define_metric(self, name, step_metric=None):
+        if step_metric is None:
+            wandb.define_metric(name)
+        else:
+            wandb.define_metric(name, step_metric=step_metric)
+
+    def log(self, data):
+        wandb.log(data=data)
+
+    def log_table(self, name, columns, rows):
+        data = []
+        for row in rows:
+            data.append([])
+            for value in row:
+                if hasattr(value, "write_html"):
+                    buffer = io.StringIO()
+                    value.write_html(buffer, auto_play=False)
+                    value = wandb.Html(buffer)
+                    buffer.close()
+                data[-1].append(value)
+        wandb.log({name: wandb.Table(data=data, columns=columns)})
+
+
+class MetricsBuffer:
+    """Buffers per iteration metrics whose values may be tensors on the device, and logs them every flush_interval
+    iterations, so that the tuning loop does not synchronize with the device at every step.
+
+    Args:
+        sink (MetricsSink): The destination of the metrics, None only keeps the values for values().
+        flush_interval (int): The number of records converted to python scalars at once.
+    """
+
+    def __init__(self, sink, flush_interval=50):
+        assert flush_interval > 0, "flush_interval should be positive"
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.flushed = defaultdict(list)
+
+    def log(self, data):
+        """Buffers a record, flushing the buffer once it holds flush_interval records."""
+        self.pending.append(data)
+        if len(self.pending) >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Converts the buffered tensors with a single device to host copy and logs the records in order."""
+        if len(self.pending) == 0:
+            return
+        ## the records may log different metrics, every tensor is keyed by its record and metric
+        keys = [(i, key) for i, record in enumerate(self.pending) for key, value in record.items()
+                if isinstance(value, torch.Tensor)]
+        host_values = {}
+        if len(keys) > 0:
+            stacked = torch.stack([self.pending[i][key].detach().float().reshape(()) for i, key in keys])
+            host_values = dict(zip(keys, stacked.cpu().tolist()))
+        for i, record in enumerate(self.pending):
+            record = {key: host_values.get((i, key), value) for key, value in record.items()}
+            for key, value in record.items():
+                self.flushed[key].append(value)
+            if self.sink is not None:
+                self.sink.log(record)
+        self.pending = []
+
+    def values(self, key):
+        """Flushes and returns all the logged values of a metric."""
+        self.flush()
+        return list(self.flushed[key])
@@ -0,0 +1,85 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from .utils import get_module, logger
+
+
+class BlockPrefetcher:
+    """Moves the blocks of the next tuning window to the device on a background thread.
+
+    With low_cpu_mem_usage the blocks are on meta and their patched `to` loads the weights from disk, so both the
+    disk reads and the host to device copies overlap with the tuning of the current window. On cuda the copies are
+    issued on a side stream which is synchronized before the prefetch is reported as done.
+
+    Args:
+        model (torch.nn.Module): The model holding the blocks.
+        device: The device the blocks are tuned on.
+    """
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autoround_prefetch")
+        self.future = None
+        self.prefetched_names = []
+        self.total_wait_time = 0.0
+        self.total_load_time = 0.0
+
+    def _load(self, block_names):
+        start = time.time()
+        stream = torch.cuda.Stream() if torch.device(self.device).type == "cuda" else None
+        with torch.no_grad():
+            if stream is not None:
+                with torch.cuda.stream(stream):
+                    for name in block_names:
+                        get_module(self.model, name).to(self.device)
+                stream.synchronize()
+            else:
+                for name in block_names:
+                    get_module(self.model, name).to(self.device)
+        return time.time() - start
+
+    def prefetch(self, block_names):
+        """Starts moving the blocks to the device, the previous prefetch must have been waited for."""
+        assert self.future is None, "wait for the previous prefetch first"
+        self.prefetched_names = list(block_names)
+        if len(self.prefetched_names) > 0:
+            self.future = self.executor.submit(self._load, self.prefetched_names)
+
+    def wait(self):
+        """Waits for the pending prefetch and returns the time spent waiting in seconds."""
+        if self.future is None:
+            return 0.0
+        start = time.time()
+        load_time = self.future.result()
+        wait_time = time.time() - start
+        self.future = None
+        self.total_wait_time += wait_time
+        self.total_load_time += load_time
+        logger.info(
+            f"prefetched {len(self.prefetched_names)} blocks in {load_time:.3f}s, waited {wait_time:.3f}s for them")
+        return wait_time
+
+    def close(self):
+        """Waits for the pending prefetch, stops the thread and logs the total time spent waiting."""
+        self.wait()
+        self.executor.shutdown()
+        logger.info(
+            f"block prefetch: loading took {self.total_load_time:.3f}s in total, "
+            f"{self.total_wait_time:.3f}s of it was not hidden behind tuning")
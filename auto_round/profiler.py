@@ -0,0 +1,146 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psutil
+import torch
+
+from .utils import logger
+
+
+class PhaseProfiler:
+    """Records the wall time and the peak memory of the phases of the quantization, per block.
+
+    Phases may be nested, the time of a phase includes the phases it contains. The peak memory is the peak cuda
+    memory allocated during the phase when cuda is available, otherwise the resident memory of the process at the
+    end of the phase, since cpu allocations have no per phase peak. A disabled profiler records nothing and adds no
+    device synchronization.
+
+    Args:
+        enabled (bool): Whether to record the phases.
+        record_function (bool): Whether to also wrap the phases in torch.profiler.record_function ranges, so that
+                                they show up in the traces of a torch.profiler.profile around quantize.
+    """
+
+    def __init__(self, enabled=False, record_function=False):
+        self.enabled = enabled
+        self.record_function = record_function
+        self.records = []
+        self._stack = []
+        self.use_cuda = torch.cuda.is_available()
+
+    def _memory(self):
+        if self.use_cuda:
+            return torch.cuda.max_memory_allocated() / 2 ** 20
+        return psutil.Process().memory_info().rss / 2 ** 20
+
+    def _update_open_peaks(self):
+        memory = self._memory()
+        for record, _, _ in self._stack:
+            record["peak_memory_mb"] = max(record["peak_memory_mb"], memory)
+
+    def begin(self, name, block=None):
+        """Starts a phase, the block defaults to the block of the enclosing phase.
+
+        Args:
+            name (str): The name of the phase.
+            block (str): The name of the block the phase belongs to, None for phases outside the blocks.
+        """
+        if not self.enabled:
+            return
+        if block is None and len(self._stack) > 0:
+            block = self._stack[-1][0]["block"]
+        if self.use_cuda:
+            torch.cuda.synchronize()
+            ## the peak of the enclosing phases is kept before the peak is reset for this one
+            self._update_open_peaks()
+            torch.cuda.reset_peak_memory_stats()
+        record = {"phase": name, "block": block, "depth": len(self._stack), "time": 0.0, "peak_memory_mb": 0.0}
+        range_context = None
+        if self.record_function:
+            range_context = torch.profiler.record_function(f"autoround::{name}")
+            range_context.__enter__()
+        self._stack.append((record, range_context, time.perf_counter()))
+
+    def end(self):
+        """Ends the innermost phase."""
+        if not self.enabled:
+            return
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        record, range_context, start = self._stack[-1]
+        record["time"] = time.perf_counter() - start
+        if range_context is not None:
+            range_context.__exit__(None, None, None)
+        self._update_open_peaks()
+        self._stack.pop()
+        self.records.append(record)
+
+    @contextmanager
+    def phase(self, name, block=None):
+        """Records the phase of the enclosed code, see begin."""
+        self.begin(name, block)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def report(self):
+        """Gets the structured report.
+
+        Returns:
+            dict: The totals per phase, the totals per phase of every block and the raw records in the order the
+            phases ended.
+        """
+        phases = OrderedDict()
+        blocks = OrderedDict()
+        for record in self.records:
+            for totals in [phases, blocks.setdefault(record["block"] or "-", OrderedDict())]:
+                total = totals.setdefault(record["phase"], {"time": 0.0, "count": 0, "peak_memory_mb": 0.0})
+                total["time"] += record["time"]
+                total["count"] += 1
+                total["peak_memory_mb"] = max(total["peak_memory_mb"], record["peak_memory_mb"])
+        return {
+            "memory": "cuda_max_allocated" if self.use_cuda else "cpu_rss",
+            "phases": phases,
+            "blocks": blocks,
+            "records": self.records,
+        }
+
+    def table(self):
+        """Formats the totals per block and phase as a text table."""
+        lines = [f"{'block':<32} {'phase':<20} {'count':>6} {'time(s)':>10} {'peak mem(MB)':>13}"]
+        for block, phases in self.report()["blocks"].items():
+            for phase, total in phases.items():
+                lines.append(
+                    f"{block:<32} {phase:<20} {total['count']:>6} {total['time']:>10.3f} "
+                    f"{total['peak_memory_mb']:>13.1f}")
+        return "\n".join(lines)
+
+    def save(self, path=None):
+        """Logs the table and writes the report as json if a path is given."""
+        if not self.enabled:
+            return
+        if path is not None:
+            dirname = os.path.dirname(os.path.abspath(path))
+            os.makedirs(dirname, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(self.report(), f, indent=2)
+            logger.info(f"saved the quantization profile to {path}")
+        logger.info(f"quantization profile:\n{self.table()}")
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import torch
+import torch.utils.checkpoint
 import transformers
 from auto_round.data_type import get_quant_func
 from .utils import (
@@ -110,12 +111,14 @@ class WrapperWALayer(torch.nn.Module):
 
 
 class WrapperLinear(torch.nn.Module):
-    def __init__(self, orig_layer, enable_minmax_tuning=True, device='cpu'):
+    def __init__(self, orig_layer, enable_minmax_tuning=True, device='cpu', enable_fused_qdq=False):
         """A wrapper module for linear layers that enables quantization and min-max tuning of weights.
 
         Args:
         - orig_layer (torch.nn.Module): The original linear layer to be wrapped.
         - enable_minmax_tuning (bool): Whether to enable min-max scaling tuning. Default is True.
+        - enable_fused_qdq (bool): Whether to fake quantize the weight with the fused QuantDequantSTE.
+          Default is False.
 
         Attributes:
         - orig_layer (torch.nn.Module): The original linear layer being wrapped.
@@ -126,10 +129,12 @@ class WrapperLinear(torch.nn.Module):
         - enable_minmax_tuning (bool): Whether min-max scaling tuning is enabled.
         - min_scale (torch.nn.Parameter or torch.Tensor): The minimum scale for min-max tuning.
         - max_scale (torch.nn.Parameter or torch.Tensor): The maximum scale for min-max tuning.
+        - weight_q (torch.Tensor): The fake quantized weight cached by cache_qdq_weights, None if not cached.
         """
         super(WrapperLinear, self).__init__()
         self.orig_layer = orig_layer
         self.device = device
+        self.enable_fused_qdq = enable_fused_qdq
         self.num_bits = self.orig_layer.bits
         self.group_size = self.orig_layer.group_size
         self.scale_dtype = self.orig_layer.scale_dtype
@@ -170,6 +175,8 @@ class WrapperLinear(torch.nn.Module):
         else:
             self.min_scale = torch.tensor(1.0, device=self.device, dtype=weight_dtype)
             self.max_scale = torch.tensor(1.0, device=self.device, dtype=weight_dtype)
+        self.weight_q = None
+        self.weight_q_leaf = None
 
     def unwrapper(self, v, min_scale, max_scale):
         """Unwrapper the layer to the original layer.
@@ -220,16 +227,7 @@ class WrapperLinear(torch.nn.Module):
         """
         from torch.functional import F
 
-        weight = self.orig_layer.weight
-        if weight.device.type == 'meta':
-            weight = self.orig_layer.get_weight().to(self.device)
-        self.min_scale.data.copy_(torch.clamp(self.min_scale.data, 0, 1.0))
-        self.max_scale.data.copy_(torch.clamp(self.max_scale.data, 0, 1.0))
-        weight_q, _, _ = quant_tensor(self.weight_quant_func, weight, self.num_bits, self.group_size, self.value,
-                                      self.min_scale,
-                                      self.max_scale, self.scale_dtype, self.weight_min, self.weight_max,
-                                      data_type=self.data_type)
-        weight_q = weight_q.to(weight.dtype)
+        weight_q = self.weight_q_leaf if self.weight_q_leaf is not None else self.quantize_weight()
         if self.act_quant:
             x, _, _ = quant_tensor(self.act_quant_func, x, self.act_bits, self.act_group_size,
                                    scale_dtype=self.scale_dtype, q_scale_thresh=self.q_scale_thresh,
@@ -240,9 +238,31 @@ class WrapperLinear(torch.nn.Module):
             bias = self.orig_layer.get_bias().to(self.device)
         return F.linear(x, weight_q, bias)
 
+    def quantize_weight(self):
+        """Fake quantizes the weight with the tuned rounding and min-max scales, which project_minmax_scale
+        keeps in [0, 1].
+
+        Returns:
+        - torch.Tensor: The fake quantized weight, in the dtype of the weight.
+        """
+        weight = self.orig_layer.weight
+        if weight.device.type == 'meta':
+            weight = self.orig_layer.get_weight().to(self.device)
+        weight_q, _, _ = quant_tensor(self.weight_quant_func, weight, self.num_bits, self.group_size, self.value,
+                                      self.min_scale,
+                                      self.max_scale, self.scale_dtype, self.weight_min, self.weight_max,
+                                      data_type=self.data_type, enable_fused_qdq=self.enable_fused_qdq)
+        return weight_q.to(weight.dtype)
+
+    @torch.no_grad()
+    def project_minmax_scale(self):
+        """Clamps the min-max scales to [0, 1], after every optimizer step."""
+        self.min_scale.clamp_(0, 1.0)
+        self.max_scale.clamp_(0, 1.0)
+
 
 class WrapperTransformerConv1d(torch.nn.Module):
-    def __init__(self, orig_layer, enable_minmax_tuning=True, device='cpu'):
+    def __init__(self, orig_layer, enable_minmax_tuning=True, device='cpu', enable_fused_qdq=False):
         """A wrapper module for transformers 1D convolutional layers used in transformers,
         enabling quantization and min-max tuning of weights.
 
@@ -252,6 +272,8 @@ class WrapperTransformerConv1d(torch.nn.Module):
         - group_size (int): The size of the groups for quantization.
         - sym (bool): Whether symmetric quantization is to be used.
         - enable_minmax_tuning (bool): Whether to enable min-max scaling tuning. Default is True.
+        - enable_fused_qdq (bool): Whether to fake quantize the weight with the fused QuantDequantSTE.
+          Default is False.
 
         Attributes:
         - orig_layer (torch.nn.Module): The original 1D convolutional layer being wrapped.
@@ -263,9 +285,11 @@ class WrapperTransformerConv1d(torch.nn.Module):
         - enable_minmax_tuning (bool): Whether min-max scaling tuning is enabled.
         - min_scale (torch.nn.Parameter or torch.Tensor): The minimum scale for min-max tuning.
         - max_scale (torch.nn.Parameter or torch.Tensor): The maximum scale for min-max tuning.
+        - weight_q (torch.Tensor): The fake quantized weight cached by cache_qdq_weights, None if not cached.
         """
         super(WrapperTransformerConv1d, self).__init__()
         self.orig_layer = orig_layer
+        self.enable_fused_qdq = enable_fused_qdq
         self.num_bits = self.orig_layer.bits
         self.group_size = self.orig_layer.group_size
         self.sym = self.orig_layer.sym
@@ -309,6 +333,8 @@ class WrapperTransformerConv1d(torch.nn.Module):
         else:
             self.min_scale = torch.tensor(1.0, device=device, dtype=weight_dtype)
             self.max_scale = torch.tensor(1.0, device=device, dtype=weight_dtype)
+        self.weight_q = None
+        self.weight_q_leaf = None
 
     def unwrapper(self, v=0, min_scale=1.0, max_scale=1.0):
         """Unwrapper the layer to the original conv1d layer.
@@ -356,13 +382,7 @@ class WrapperTransformerConv1d(torch.nn.Module):
         Returns:
         torch.Tensor: The output tensor after applying the convolutional transformation with quantized weights.
         """
-        with torch.no_grad():
-            self.min_scale.clamp_(0, 1.0)
-            self.max_scale.clamp_(0, 1.0)
-        weight_q, _, _ = quant_tensor(self.weight_quant_func, self.weight_t, self.num_bits, self.group_size, self.value,
-                                      self.min_scale, self.max_scale, self.scale_dtype, self.weight_min,
-                                      self.weight_max, data_type=self.data_type)
-        weight_q = weight_q.to(self.weight_t.dtype)
+        weight_q = self.weight_q_leaf if self.weight_q_leaf is not None else self.quantize_weight()
         size_out = x.size()[:-1] + (self.orig_layer.nf,)
         if self.act_quant:
             x, _, _ = quant_tensor(self.act_quant_func, x, self.act_bits, self.act_group_size,
@@ -372,21 +392,56 @@ class WrapperTransformerConv1d(torch.nn.Module):
         x = x.view(*size_out)
         return x
 
+    def quantize_weight(self):
+        """Fake quantizes the transposed weight with the tuned rounding and min-max scales, which
+        project_minmax_scale keeps in [0, 1].
+
+        Returns:
+        torch.Tensor: The fake quantized transposed weight, in the dtype of the weight.
+        """
+        weight_q, _, _ = quant_tensor(self.weight_quant_func, self.weight_t, self.num_bits, self.group_size, self.value,
+                                      self.min_scale, self.max_scale, self.scale_dtype, self.weight_min,
+                                      self.weight_max, data_type=self.data_type,
+                                      enable_fused_qdq=self.enable_fused_qdq)
+        return weight_q.to(self.weight_t.dtype)
+
+    @torch.no_grad()
+    def project_minmax_scale(self):
+        """Clamps the min-max scales to [0, 1], after every optimizer step."""
+        self.min_scale.clamp_(0, 1.0)
+        self.max_scale.clamp_(0, 1.0)
+
 
 class WrapperMultiblock(torch.nn.Module):
     """A wrapper for a list of modules to be act as a single block.
 
+    With checkpoint_granularity > 0, a forward with gradients keeps only the inputs of every segment of
+    checkpoint_granularity consecutive modules and recomputes the activations of a segment in the backward.
+
     Args:
     module_list: The list of modules to wrap.
+    checkpoint_granularity: The number of modules per checkpointed segment, 0 keeps every activation.
     """
 
-    def __init__(self, module_list):
+    def __init__(self, module_list, checkpoint_granularity=0):
         super(WrapperMultiblock, self).__init__()
         self.layers = torch.nn.ModuleList(module_list)
+        self.checkpoint_granularity = checkpoint_granularity
 
     def forward(self, x, **kwargs):
+        if self.checkpoint_granularity <= 0 or not torch.is_grad_enabled():
+            return self.forward_layers(x, 0, len(self.layers), **kwargs)
+        hidden_states = x
+        for start in range(0, len(self.layers), self.checkpoint_granularity):
+            hidden_states = torch.utils.checkpoint.checkpoint(
+                self.forward_layers, hidden_states, start, start + self.checkpoint_granularity, use_reentrant=False,
+                **kwargs)
+        return hidden_states
+
+    def forward_layers(self, x, start, end, **kwargs):
+        """Runs the modules from start to end."""
         hidden_states = x
-        for idx, decoder_layer in enumerate(self.layers):
+        for decoder_layer in self.layers[start:end]:
             layer_outputs = decoder_layer(hidden_states, **kwargs)
             hidden_states = layer_outputs
             if isinstance(hidden_states, tuple) or isinstance(hidden_states, list):
@@ -394,12 +449,56 @@ class WrapperMultiblock(torch.nn.Module):
         return hidden_states
 
 
-def wrapper_block(block, enable_minmax_tuning, device='cpu'):
+def get_tuned_wrappers(block):
+    """Returns the WrapperLinear and WrapperTransformerConv1d modules of the block, the block included."""
+    return [m for m in block.modules() if isinstance(m, (WrapperLinear, WrapperTransformerConv1d))]
+
+
+def cache_qdq_weights(block):
+    """Fake quantizes the weights of the wrapped layers of the block once for all the micro-batches of an
+    iteration.
+
+    The forwards use a detached copy of every fake quantized weight, on which the backwards of the micro-batches
+    accumulate the weight gradient, until release_qdq_weights backpropagates it to the tuned parameters.
+
+    Args:
+    block: The block with the wrapped layers.
+    """
+    for m in get_tuned_wrappers(block):
+        m.weight_q = m.quantize_weight()
+        m.weight_q_leaf = m.weight_q.detach().requires_grad_(m.weight_q.requires_grad)
+
+
+def release_qdq_weights(block):
+    """Backpropagates the weight gradients accumulated since cache_qdq_weights to the tuned parameters and
+    drops the cached weights.
+
+    Args:
+    block: The block with the wrapped layers.
+    """
+    for m in get_tuned_wrappers(block):
+        if m.weight_q_leaf is not None and m.weight_q_leaf.grad is not None:
+            m.weight_q.backward(m.weight_q_leaf.grad)
+        m.weight_q, m.weight_q_leaf = None, None
+
+
+def project_minmax_scales(block):
+    """Clamps the min-max scales of the wrapped layers of the block to [0, 1], after every optimizer step.
+
+    Args:
+    block: The block with the wrapped layers.
+    """
+    for m in get_tuned_wrappers(block):
+        m.project_minmax_scale()
+
+
+def wrapper_block(block, enable_minmax_tuning, device='cpu', enable_fused_qdq=False):
     """Wraps the layers in the given block with a custom Wrapper module.
 
     Args:
         block: The input block containing linear and conv1d layers to be wrapped.
         enable_minmax_tuning: A boolean indicating whether min-max tuning is enabled.
+        enable_fused_qdq: A boolean indicating whether the fused QuantDequantSTE is used for the weights.
 
     Returns:
         list: A list of names of the wrapped layers and unwrapped layers.
@@ -411,7 +510,8 @@ def wrapper_block(block, enable_minmax_tuning, device='cpu'):
             if not check_to_quantized(m):
                 unquantized_layers.append(n)
                 continue
-            new_m = WrapperLinear(m, enable_minmax_tuning=enable_minmax_tuning, device=device)
+            new_m = WrapperLinear(m, enable_minmax_tuning=enable_minmax_tuning, device=device,
+                                  enable_fused_qdq=enable_fused_qdq)
             set_module(block, n, new_m)
             quantized_layers.append(n)
 
@@ -419,7 +519,8 @@ def wrapper_block(block, enable_minmax_tuning, device='cpu'):
             if not check_to_quantized(m):
                 unquantized_layers.append(n)
                 continue
-            new_m = WrapperTransformerConv1d(m, enable_minmax_tuning=enable_minmax_tuning, device=device)
+            new_m = WrapperTransformerConv1d(m, enable_minmax_tuning=enable_minmax_tuning, device=device,
+                                             enable_fused_qdq=enable_fused_qdq)
             set_module(block, n, new_m)
             quantized_layers.append(n)
 
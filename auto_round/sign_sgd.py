@@ -172,7 +172,15 @@ class SignSGD(Optimizer):
         maximize (bool, optional): maximize the params based on the objective, instead of
             minimizing (default: False)
         foreach (bool, optional): whether foreach implementation of optimizer
-            is used (default: None)
+            is used, which updates all the parameters of a group with a few multi-tensor
+            kernels instead of a few kernels per parameter (default: None, which uses it
+            when all the parameters are on cuda and no gradient is sparse)
+        flatten (bool, optional): whether the parameters of every group are moved into
+            a single contiguous buffer, of which they become views, so that a step
+            updates a group with a single sign and add. zero_grad then also keeps the
+            gradients as views of a single zeroed buffer, which the backward accumulates
+            into, and a parameter that gets no gradient is updated with a zero one
+            (default: False)
 
     Example:
         >>> # xdoctest: +SKIP
@@ -221,6 +229,7 @@ class SignSGD(Optimizer):
         *,
         maximize=False,
         foreach: Optional[bool] = None,
+        flatten: bool = False,
         differentiable=False
     ):
         if lr is not required and lr < 0.0:
@@ -238,11 +247,15 @@ class SignSGD(Optimizer):
             nesterov=nesterov,
             maximize=maximize,
             foreach=foreach,
+            flatten=flatten,
             differentiable=differentiable,
         )
         if nesterov and (momentum <= 0 or dampening != 0):
             raise ValueError("Nesterov momentum requires a momentum and zero dampening")
         super(SignSGD, self).__init__(params, defaults)
+        if flatten:
+            for group in self.param_groups:
+                _flatten_params(group["params"])
 
     def __setstate__(self, state):
         super().__setstate__(state)
@@ -250,8 +263,16 @@ class SignSGD(Optimizer):
             group.setdefault("nesterov", False)
             group.setdefault("maximize", False)
             group.setdefault("foreach", None)
+            group.setdefault("flatten", False)
             group.setdefault("differentiable", False)
 
+    def zero_grad(self, set_to_none: bool = True):
+        """Resets the gradients, the ones of the flattened groups to views of a zeroed buffer."""
+        super().zero_grad(set_to_none)
+        for group in self.param_groups:
+            if group["flatten"]:
+                _zero_flat_grads(self.state, group)
+
     @_use_grad_for_differentiable
     def step(self, closure=None):
         """Performs a single optimization step.
@@ -266,6 +287,8 @@ class SignSGD(Optimizer):
                 loss = closure()
 
         for group in self.param_groups:
+            if group["flatten"] and _flat_step(self.state, group):
+                continue
             params_with_grad = []
             d_p_list = []
             momentum_buffer_list = []
@@ -328,16 +351,16 @@ def sgd(
     """
 
     if foreach is None:
-        # Placeholder for more complex foreach logic to be added when value is not set
-        foreach = False
+        ## the multi-tensor kernels only pay off on cuda, on cpu they loop over the tensors like the single tensor path
+        foreach = not has_sparse_grad and not torch.jit.is_scripting() and all(param.is_cuda for param in params)
 
     if foreach and torch.jit.is_scripting():
         raise RuntimeError("torch.jit.script not supported with foreach optimizers")
 
-    # if foreach and not torch.jit.is_scripting():
-    #     func = _multi_tensor_sgd
-    # else:
-    func = _single_tensor_sgd
+    if foreach and not has_sparse_grad:
+        func = _multi_tensor_sgd
+    else:
+        func = _single_tensor_sgd
 
     func(
         params,
@@ -387,3 +410,144 @@ def _single_tensor_sgd(
                 d_p = buf
 
         param.add_(torch.sign(d_p), alpha=-lr)
+
+
+def _multi_tensor_sgd(
+    params: List[Tensor],
+    grads: List[Tensor],
+    momentum_buffer_list: List[Optional[Tensor]],
+    *,
+    weight_decay: float,
+    momentum: float,
+    lr: float,
+    dampening: float,
+    nesterov: bool,
+    maximize: bool,
+    has_sparse_grad: bool
+):
+    if len(params) == 0:
+        return
+
+    grouped_indices = {}
+    for i, param in enumerate(params):
+        grouped_indices.setdefault((param.device, param.dtype), []).append(i)
+
+    for indices in grouped_indices.values():
+        device_params = [params[i] for i in indices]
+        device_grads = [grads[i] for i in indices]
+
+        if maximize:
+            device_grads = torch._foreach_neg(device_grads)
+
+        if weight_decay != 0:
+            device_grads = torch._foreach_add(device_grads, device_params, alpha=weight_decay)
+
+        if momentum != 0:
+            bufs = []
+            if all(momentum_buffer_list[i] is not None for i in indices):
+                bufs = [momentum_buffer_list[i] for i in indices]
+                torch._foreach_mul_(bufs, momentum)
+                torch._foreach_add_(bufs, device_grads, alpha=1 - dampening)
+            else:
+                for i, grad in zip(indices, device_grads):
+                    buf = momentum_buffer_list[i]
+                    if buf is None:
+                        buf = torch.clone(grad).detach()
+                        momentum_buffer_list[i] = buf
+                    else:
+                        buf.mul_(momentum).add_(grad, alpha=1 - dampening)
+                    bufs.append(buf)
+
+            if nesterov:
+                device_grads = torch._foreach_add(device_grads, bufs, alpha=momentum)
+            else:
+                device_grads = bufs
+
+        torch._foreach_add_(device_params, torch._foreach_sign(device_grads), alpha=-lr)
+
+
+@torch.no_grad()
+def _flatten_params(params: List[Tensor]):
+    """Moves the parameters into one contiguous buffer per device and dtype and makes them views of it."""
+    grouped_params = {}
+    for param in params:
+        grouped_params.setdefault((param.device, param.dtype), []).append(param)
+    for device_params in grouped_params.values():
+        flat = torch.cat([param.detach().reshape(-1) for param in device_params])
+        offset = 0
+        for param in device_params:
+            param.data = flat[offset: offset + param.numel()].view_as(param)
+            offset += param.numel()
+
+
+def _get_flat_buffer(tensors: List[Tensor]) -> Optional[Tensor]:
+    """Returns the buffer of which the tensors are consecutive views, None if there is none."""
+    first = tensors[0]
+    if first.is_sparse:
+        return None
+    storage_ptr = first.untyped_storage().data_ptr()
+    offset = first.storage_offset()
+    for tensor in tensors:
+        if (tensor.is_sparse or tensor.untyped_storage().data_ptr() != storage_ptr
+                or tensor.storage_offset() != offset or tensor.dtype != first.dtype or not tensor.is_contiguous()):
+            return None
+        offset += tensor.numel()
+    return first.detach().as_strided((offset - first.storage_offset(),), (1,), first.storage_offset())
+
+
+@torch.no_grad()
+def _zero_flat_grads(state, group):
+    """Sets the gradients of a flattened group to views of a zeroed buffer, kept in the state of its first
+    parameter."""
+    params = group["params"]
+    if len(params) == 0 or _get_flat_buffer(params) is None:
+        return
+    flat_state = state[params[0]]
+    flat_grad = flat_state.get("flat_grad")
+    numel = sum(param.numel() for param in params)
+    if flat_grad is None or flat_grad.numel() != numel or flat_grad.device != params[0].device:
+        flat_grad = torch.zeros(numel, dtype=params[0].dtype, device=params[0].device)
+        flat_state["flat_grad"] = flat_grad
+    else:
+        flat_grad.zero_()
+    offset = 0
+    for param in params:
+        param.grad = flat_grad[offset: offset + param.numel()].view_as(param)
+        offset += param.numel()
+
+
+@torch.no_grad()
+def _flat_step(state, group) -> bool:
+    """Updates a flattened group with a single sign and add on its buffer, returns False if the group is not a
+    single flattened buffer or a parameter has no dense gradient, which leaves it to the per parameter update."""
+    params = group["params"]
+    if len(params) == 0:
+        return False
+    if any(param.grad is None for param in params):
+        return False
+    flat = _get_flat_buffer(params)
+    if flat is None:
+        return False
+    ## the gradients are views of a single buffer once zero_grad has run
+    d_p = _get_flat_buffer([param.grad for param in params])
+    if d_p is None:
+        d_p = torch.cat([param.grad.reshape(-1) for param in params])
+    if group["maximize"]:
+        d_p = -d_p
+    if group["weight_decay"] != 0:
+        d_p = d_p.add(flat, alpha=group["weight_decay"])
+    momentum = group["momentum"]
+    if momentum != 0:
+        flat_state = state[params[0]]
+        buf = flat_state.get("flat_momentum_buffer")
+        if buf is None:
+            buf = torch.clone(d_p).detach()
+            flat_state["flat_momentum_buffer"] = buf
+        else:
+            buf.mul_(momentum).add_(d_p, alpha=1 - group["dampening"])
+        if group["nesterov"]:
+            d_p = d_p.add(buf, alpha=momentum)
+        else:
+            d_p = buf
+    flat.add_(torch.sign(d_p), alpha=-group["lr"])
+    return True
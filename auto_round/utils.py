@@ -27,6 +27,8 @@ from torch.amp import autocast
 
 from functools import lru_cache
 
+from .activation_store import ActivationStore
+
 
 @lru_cache(None)
 def warning_once(self, msg: str):
@@ -80,6 +82,12 @@ class LazyImport(object):
 
 auto_gptq = LazyImport("auto_gptq")
 htcore = LazyImport("habana_frameworks.torch.core")
+## optional integrations of the experiments, imported on first use to keep `import auto_round` light
+wandb = LazyImport("wandb")
+lm_eval = LazyImport("lm_eval")
+pd = LazyImport("pandas")
+go = LazyImport("plotly.graph_objects")
+scipy_stats = LazyImport("scipy.stats")
 
 
 
@@ -148,7 +156,7 @@ def to_device(input, device=torch.device("cpu")):
     """
     if input is None:
         return None
-    if isinstance(input, torch.Tensor):
+    if isinstance(input, (torch.Tensor, ActivationStore)):
         return input.to(device)
     if isinstance(input, dict) or isinstance(input, UserDict):
         for inp in input.keys():
@@ -203,6 +211,8 @@ def to_dtype(input, dtype=torch.float32):
         return None
     if isinstance(input, torch.Tensor):
         return input.to(dtype)
+    if isinstance(input, ActivationStore):
+        return input.to(dtype=dtype)
     if isinstance(input, dict) or isinstance(input, UserDict):
         for inp in input.keys():
             input[inp] = to_dtype(input[inp], dtype)
@@ -291,6 +301,35 @@ def collect_minmax_scale(block):
     return min_scales, max_scales
 
 
+@torch.no_grad()
+def update_best_params(block, best_params, improved):
+    """Updates the best round values and min-max scales of the wrapped modules in the given block on the device.
+
+    The values are selected with torch.where, so the best values are tracked without copying the loss to the host.
+    Until the first improvement they hold the defaults of unwrapper_block.
+
+    Args:
+    block: The input block.
+    best_params: A dictionary of round values, minimum and maximum scaling values keyed by v, min_scale and
+                 max_scale, the dictionaries are filled by the first call.
+    improved: A boolean tensor, whether the current values are the best ones.
+    """
+    for n, m in block.named_modules():
+        if hasattr(m, "orig_layer"):
+            current = {
+                "v": (m.value.data, 0.0),
+                "min_scale": (torch.clamp(m.min_scale.data, 0, 1.0), 1.0),
+                "max_scale": (torch.clamp(m.max_scale.data, 0, 1.0), 1.0),
+            }
+            for key, (value, default) in current.items():
+                best = best_params[key].get(n)
+                improved = improved.to(value.device)
+                if best is None:
+                    best_params[key][n] = torch.where(improved, value, torch.full_like(value, default))
+                else:
+                    best.copy_(torch.where(improved, value, best))
+
+
 @torch.no_grad()
 def sampling_inputs(input_ids, input_others, indices, seqlen,
                     share_attention_mask_flag=False, not_share_position_ids_flag=False, input_dim=0):
@@ -306,15 +345,20 @@ def sampling_inputs(input_ids, input_others, indices, seqlen,
     current_input_ids: The sampled input IDs.
     current_input_others: The sampled other input data.
     """
-    current_input_ids = [input_ids[i] for i in indices]
-    current_input_ids = torch.cat(current_input_ids, dim=input_dim)
+    if isinstance(input_ids, ActivationStore):
+        current_input_ids = input_ids.gather(indices)
+    else:
+        current_input_ids = [input_ids[i] for i in indices]
+        current_input_ids = torch.cat(current_input_ids, dim=input_dim)
 
     current_input_others = {"positional_inputs": input_others["positional_inputs"]}
     for key in input_others.keys():
         if not share_attention_mask_flag and ("attention_mask" in key or "alibi" in key) \
                 or (not_share_position_ids_flag and "position_ids" in key):
             current_input_others[key] = None
-            if input_others[key] is not None:
+            if isinstance(input_others[key], ActivationStore):
+                current_input_others[key] = input_others[key].gather(indices)
+            elif input_others[key] is not None:
                 current_input_others[key] = [input_others[key][i] for i in indices]
                 current_input_others[key] = torch.cat(current_input_others[key], dim=0)
         else:
@@ -326,6 +370,8 @@ def sampling_inputs(input_ids, input_others, indices, seqlen,
 def block_forward(block, input_ids, input_others, amp=False, amp_dtype=torch.float16, device=torch.device("cpu")):
     """Performs a forward pass through a block with the given inputs.
 
+    input_others is not modified, so the inputs of a batch can be shared by the forwards of several blocks.
+
     Args:
     block: The block to perform the forward pass on.
     input_ids: The input IDs.
@@ -339,25 +385,26 @@ def block_forward(block, input_ids, input_others, amp=False, amp_dtype=torch.flo
     """
     if input_ids.device != device:
         input_ids = to_device(input_ids, device)
-        input_others = to_device(input_others, device)
-    input_tuple = input_others.pop("positional_inputs", None)
+        input_others = to_device(dict(input_others), device)
+    input_tuple = input_others["positional_inputs"]
+    kwargs = {key: value for key, value in input_others.items() if key not in ["positional_inputs", "alibi"]}
     if "alibi" in input_others.keys():
-        alibi = input_others.pop("alibi")
+        alibi = input_others["alibi"]
         if alibi is not None:
             alibi = alibi.reshape(-1, alibi.shape[2], alibi.shape[3])
         if amp:
             with autocast(device_type=device.split(":")[0], dtype=amp_dtype):  # pragma: no cover
                 output = block(
-                    input_ids, alibi=alibi, *input_tuple, **input_others
+                    input_ids, alibi=alibi, *input_tuple, **kwargs
                 )  ##TODO is this correct for all models with alibi?
         else:
-            output = block(input_ids, alibi=alibi, *input_tuple, **input_others)
+            output = block(input_ids, alibi=alibi, *input_tuple, **kwargs)
     else:
         if amp:
             with autocast(device_type=device.split(":")[0], dtype=amp_dtype):  # pragma: no cover
-                output = block(input_ids, *input_tuple, **input_others)
+                output = block(input_ids, *input_tuple, **kwargs)
         else:
-            output = block(input_ids, *input_tuple, **input_others)
+            output = block(input_ids, *input_tuple, **kwargs)
     if isinstance(output, list) or isinstance(output, tuple):
         output = output[0]
     return output
@@ -0,0 +1,61 @@
+"""CPU benchmark of sampling a tuning batch from the cached block inputs, a list of per-sample tensors against the
+contiguous ActivationStore, in RAM or memory-mapped.
+
+Usage:
+    python benchmarks/bench_activation_store.py --nsamples 512 --seqlen 2048 --hidden_size 4096
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, ".")
+from auto_round.activation_store import ActivationStore
+
+
+def bench(sample_func, nsamples, batch_size, steps):
+    start = time.perf_counter()
+    for _ in range(steps):
+        indices = torch.randperm(nsamples)[:batch_size]
+        sample_func(indices)
+    return (time.perf_counter() - start) / steps * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nsamples", default=512, type=int)
+    parser.add_argument("--seqlen", default=512, type=int)
+    parser.add_argument("--hidden_size", default=1024, type=int)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--capture_batch_size", default=8, type=int)
+    parser.add_argument("--steps", default=50, type=int)
+    args = parser.parse_args()
+
+    batches = [torch.randn(args.capture_batch_size, args.seqlen, args.hidden_size, dtype=torch.bfloat16)
+               for _ in range(args.nsamples // args.capture_batch_size)]
+
+    start = time.perf_counter()
+    samples = []
+    for batch in batches:
+        samples.extend(list(torch.split(batch.clone(), 1, dim=0)))
+    list_capture = (time.perf_counter() - start) * 1000
+    list_sample = bench(lambda indices: torch.cat([samples[i] for i in indices], dim=0), args.nsamples,
+                        args.batch_size, args.steps)
+    del samples
+
+    results = {"list": (list_capture, list_sample)}
+    with tempfile.TemporaryDirectory() as memmap_dir:
+        for name, store_dir in [("store", None), ("memmap store", memmap_dir)]:
+            start = time.perf_counter()
+            store = ActivationStore(args.nsamples, memmap_dir=store_dir)
+            for batch in batches:
+                store.append(batch)
+            capture = (time.perf_counter() - start) * 1000
+            results[name] = (capture, bench(store.gather, args.nsamples, args.batch_size, args.steps))
+            del store
+
+    print(f"nsamples={args.nsamples} seqlen={args.seqlen} hidden_size={args.hidden_size} batch_size={args.batch_size}")
+    for name, (capture, sample) in results.items():
+        print(f"{name:>13}: capture {capture:8.1f} ms, sample {sample:6.2f} ms/step")
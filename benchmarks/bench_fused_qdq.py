@@ -0,0 +1,81 @@
+"""CPU benchmark of the tuning iterations of a wrapped Llama decoder block, with and without the fused QuantDequantSTE.
+
+Usage:
+    python benchmarks/bench_fused_qdq.py --hidden_size 4096 --intermediate_size 11008 --seqlen 512
+"""
+import argparse
+import copy
+import sys
+import time
+
+import torch
+import transformers
+
+sys.path.insert(0, ".")
+from auto_round.quantizer import wrapper_block
+from auto_round.sign_sgd import SignSGD
+
+
+def make_block(hidden_size, intermediate_size, num_heads, bits, group_size, sym):
+    """Builds a random Llama decoder block whose linear layers carry the quantization config, like AutoRound does."""
+    config = transformers.LlamaConfig(hidden_size=hidden_size, intermediate_size=intermediate_size,
+                                      num_attention_heads=num_heads, num_key_value_heads=num_heads)
+    torch.manual_seed(0)
+    block = transformers.models.llama.modeling_llama.LlamaDecoderLayer(config, layer_idx=0)
+    for m in block.modules():
+        if isinstance(m, torch.nn.Linear):
+            m.bits, m.group_size, m.sym, m.data_type, m.scale_dtype = bits, group_size, sym, "int", torch.float16
+            m.act_bits, m.act_group_size, m.act_sym, m.act_dynamic = 32, group_size, sym, True
+    return block, config
+
+
+def run(block, config, seqlen, iters, enable_fused_qdq):
+    block = copy.deepcopy(block)
+    for p in block.parameters():
+        p.requires_grad = False
+    wrapper_block(block, enable_minmax_tuning=True, device="cpu", enable_fused_qdq=enable_fused_qdq)
+    round_params = [m.value for m in block.modules() if hasattr(m, "orig_layer")]
+    minmax_params = [p for m in block.modules() if hasattr(m, "orig_layer") for p in (m.min_scale, m.max_scale)]
+    optimizer = SignSGD([{"params": round_params}, {"params": minmax_params}], lr=0.005, weight_decay=0)
+
+    torch.manual_seed(1)
+    x = torch.randn(1, seqlen, config.hidden_size)
+    target = torch.randn(1, seqlen, config.hidden_size)
+    position_ids = torch.arange(seqlen).unsqueeze(0)
+    rotary_emb = transformers.models.llama.modeling_llama.LlamaRotaryEmbedding(config=config)
+    position_embeddings = rotary_emb(x, position_ids)
+
+    losses = []
+    start = None
+    for i in range(iters + 1):
+        if i == 1:  ##the first iteration is a warmup
+            start = time.perf_counter()
+        out = block(x, position_ids=position_ids, position_embeddings=position_embeddings)[0]
+        loss = torch.nn.functional.mse_loss(out, target)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        losses.append(loss.item())
+    return iters / (time.perf_counter() - start), losses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden_size", default=1024, type=int)
+    parser.add_argument("--intermediate_size", default=2816, type=int)
+    parser.add_argument("--num_heads", default=8, type=int)
+    parser.add_argument("--seqlen", default=256, type=int)
+    parser.add_argument("--bits", default=4, type=int)
+    parser.add_argument("--group_size", default=128, type=int)
+    parser.add_argument("--sym", action="store_true")
+    parser.add_argument("--iters", default=5, type=int)
+    args = parser.parse_args()
+
+    block, config = make_block(args.hidden_size, args.intermediate_size, args.num_heads, args.bits,
+                               args.group_size, args.sym)
+    ref_speed, ref_losses = run(block, config, args.seqlen, args.iters, enable_fused_qdq=False)
+    fused_speed, fused_losses = run(block, config, args.seqlen, args.iters, enable_fused_qdq=True)
+    print(f"hidden_size={args.hidden_size} intermediate_size={args.intermediate_size} seqlen={args.seqlen} "
+          f"bits={args.bits} group_size={args.group_size} sym={args.sym}")
+    print(f"unfused: {ref_speed:.2f} iters/s, fused: {fused_speed:.2f} iters/s ({fused_speed / ref_speed:.2f}x)")
+    print(f"max loss difference: {max(abs(a - b) for a, b in zip(ref_losses, fused_losses)):.3e}")
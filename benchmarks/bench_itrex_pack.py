@@ -0,0 +1,237 @@
+"""Round-trip benchmark of the ITREX WeightOnlyLinear.pack/recover on CPU, vectorized against the former loops.
+
+Usage:
+    python benchmarks/bench_itrex_pack.py --in_features 4096 --out_features 4096 --group_size 128
+"""
+import argparse
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, ".")
+from auto_round.export.export_to_itrex.model_wrapper import WeightOnlyLinear
+from auto_round.utils import logger
+
+
+class LoopWeightOnlyLinear(WeightOnlyLinear):
+    """WeightOnlyLinear with the per-column pack/recover loops used before vectorization, kept as the reference."""
+
+    def pack(self, int_weight, scale, zp, bias):
+        if self.use_optimum_format:
+            self.scales = self.scales.t_().contiguous()
+            self.qweight = self.qweight.t_().contiguous()
+            self.qzeros = self.qzeros.t_().contiguous()
+
+        int_weight = int_weight.to(self.device)
+        if self.use_optimum_format and zp is None:
+            # to avoid overflow
+            int_weight = int_weight.type(torch.int32)
+            shift_bias = 2 ** (self.bits - 1)
+            int_weight += shift_bias
+            zp = torch.zeros_like(scale, dtype=torch.uint8) + shift_bias
+        if bias is not None:
+            assert hasattr(self, "bias"), "bias is not set when initializing."
+            self.bias = bias.type(self.float_type).to(self.device)
+        assert scale.shape == self.scales.shape, "Scale shape is mismatched."
+        self.scales = scale.type(self.float_type).to(self.device)
+        if not self.use_optimum_format and self.compression_dim == 0:
+            int_weight = int_weight.t_().contiguous()
+            self.qweight = self.qweight.t_().contiguous()
+        origin_shape = int_weight.shape
+        target_shape = self.qweight.shape
+        assert origin_shape[0] == target_shape[0], "output channels mismatch, please check."
+        mask = torch.tensor(2**self.bits - 1, dtype=self.compression_dtype).to(self.device)
+
+        # pack weight
+        for j in range(target_shape[1]):
+            start = self.n_pack * j
+            end = self.n_pack * (j + 1)
+            tmp = int_weight[:, start:end].type(self.compression_dtype)
+            for e in range(tmp.shape[1]):
+                tmp[:, e] &= mask
+                tmp[:, e] = tmp[:, e] << (self.bits * e)
+                self.qweight[:, j] |= tmp[:, e]
+        if not self.use_optimum_format and self.compression_dim == 0:
+            self.qweight = self.qweight.t_().contiguous()
+
+        if zp is not None:
+            zp = zp.to(self.device)
+            if self.use_optimum_format:
+                zp -= 1
+            if self.use_optimum_format or self.compression_dim == 0:
+                zp = zp.t_().contiguous()
+                self.qzeros = self.qzeros.t_().contiguous()
+            assert hasattr(self, "qzeros"), "zp is not set when initializing."
+            target_shape = self.qzeros.shape
+            for j in range(target_shape[1]):
+                start = self.n_pack * j
+                end = self.n_pack * (j + 1)
+                tmp = zp[:, start:end].type(self.compression_dtype)
+                for e in range(tmp.shape[1]):
+                    tmp[:, e] &= mask
+                    tmp[:, e] = tmp[:, e] << (self.bits * e)
+                    self.qzeros[:, j] |= tmp[:, e]
+            if self.use_optimum_format or self.compression_dim == 0:
+                self.qzeros = self.qzeros.t_().contiguous()
+        if self.use_optimum_format:
+            self.scales = self.scales.t_().contiguous()
+            self.qweight = self.qweight.t_().contiguous()
+            self.qzeros = self.qzeros.t_().contiguous()
+
+    def recover(self):
+        logger.debug(f"Recovering {self} weight")
+        scales = self.scales.t_().contiguous() if self.use_optimum_format else self.scales
+        qweight = self.qweight.t_().contiguous() if self.use_optimum_format else self.qweight
+
+        device = scales.device
+        fp32_weight = torch.zeros(self.out_features, self.in_features, dtype=self.float_type).to(device)
+        mask = torch.tensor(2**self.bits - 1, dtype=self.compression_dtype).to(device)
+        if hasattr(self, "qzeros"):
+            weight_dtype = torch.uint8
+        else:
+            weight_dtype = torch.int8
+        # unpack weight
+        weight = torch.zeros(self.out_features, self.in_features, dtype=weight_dtype).to(device)
+        if not self.use_optimum_format and self.compression_dim == 0:
+            weight = weight.t_().contiguous()
+            qweight = qweight.t_().contiguous()
+        origin_shape = weight.shape
+        target_shape = qweight.shape
+        for j in range(target_shape[1]):
+            for e in range(self.n_pack):
+                index = j * self.n_pack + e
+                if index >= origin_shape[1]:
+                    continue
+                tmp = qweight[:, j]
+                tmp = tmp << (self.compress_bits - self.bits * (e + 1))
+                tmp = tmp >> self.compress_bits - self.bits
+                if weight_dtype == torch.uint8:
+                    tmp &= mask  # remove sign bit
+                weight[:, index] = tmp.type(weight_dtype)
+        if not self.use_optimum_format and self.compression_dim == 0:
+            weight = weight.t_().contiguous()
+        if "int" not in self.dtype:
+            new_weight = torch.zeros(self.out_features, self.in_features).to(device)
+            for k, v in self.int2float_mapping.items():
+                new_weight += torch.where(weight == k, v, 0)
+            weight = new_weight
+        # unpack zero_point
+        if hasattr(self, "qzeros"):
+            zp_dtype = self.compression_dtype  # to avoid overflow when weight-zp
+            zp = torch.zeros(scales.shape, dtype=zp_dtype).to(device)
+            qzeros = self.qzeros.t_().contiguous() if self.use_optimum_format else self.qzeros
+            if self.use_optimum_format or self.compression_dim == 0:
+                zp = zp.t_().contiguous()
+                qzeros = qzeros.t_().contiguous()
+            origin_shape = zp.shape
+            target_shape = qzeros.shape
+            for j in range(target_shape[1]):
+                for e in range(self.n_pack):
+                    index = j * self.n_pack + e
+                    if index >= origin_shape[1]:
+                        continue
+                    tmp = qzeros[:, j]
+                    tmp = tmp << (self.compress_bits - self.bits * (e + 1))
+                    tmp = tmp >> self.compress_bits - self.bits
+                    tmp &= mask
+                    zp[:, index] = tmp.type(zp_dtype)
+            if self.use_optimum_format or self.compression_dim == 0:
+                zp = zp.t_().contiguous()
+            if self.use_optimum_format:
+                # zp -= 1 may cause zp == -1, after recover it becomes 2**self.bits - 1
+                zp += 1
+                zp = torch.where(zp > (2**self.bits - 1), 0, zp)
+            # recover fp32 weight with int_weight, scale, and zero_point
+            for idx in range(self.in_features):
+                g_idx = idx // self.groupsize
+                fp32_weight[:, idx] = (weight[:, idx] - zp[:, g_idx]) * scales[:, g_idx]
+        else:
+            # recover fp32 weight with int_weight, scale
+            for idx in range(self.in_features):
+                g_idx = idx // self.groupsize
+                fp32_weight[:, idx] = weight[:, idx] * scales[:, g_idx]
+        return fp32_weight
+
+
+CONFIGS = [
+    # (use_optimum_format, compression_dtype, compression_dim, zp)
+    (True, torch.int32, 1, True),
+    (True, torch.int32, 1, False),
+    (False, torch.int32, 1, True),
+    (False, torch.int32, 0, True),
+    (False, torch.int8, 0, False),
+]
+
+
+def make_inputs(bits, group_size, in_features, out_features, zp, seed=0):
+    torch.manual_seed(seed)
+    n_groups = -(-in_features // group_size)
+    scale = torch.rand(out_features, n_groups) * 0.01 + 0.001
+    if zp:
+        int_weight = torch.randint(0, 2**bits, (out_features, in_features), dtype=torch.int32)
+        zero = torch.randint(0, 2**bits, (out_features, n_groups), dtype=torch.int32)
+    else:
+        int_weight = torch.randint(-(2 ** (bits - 1)), 2 ** (bits - 1), (out_features, in_features), dtype=torch.int32)
+        zero = None
+    return int_weight, scale, zero
+
+
+def round_trip(cls, config, bits, group_size, in_features, out_features):
+    use_optimum_format, compression_dtype, compression_dim, zp = config
+    int_weight, scale, zero = make_inputs(bits, group_size, in_features, out_features, zp)
+    layer = cls(
+        in_features,
+        out_features,
+        bits,
+        group_size,
+        zp=zp,
+        compression_dtype=compression_dtype,
+        compression_dim=compression_dim,
+        use_optimum_format=use_optimum_format,
+    )
+    start = time.perf_counter()
+    layer.pack(int_weight, scale, zero, None)
+    pack_time = time.perf_counter() - start
+    packed = {name: buffer.clone() for name, buffer in layer.named_buffers()}
+    start = time.perf_counter()
+    weight = layer.recover()
+    recover_time = time.perf_counter() - start
+    return pack_time, recover_time, packed, weight
+
+
+def run(config, bits, group_size, in_features, out_features):
+    ref_pack, ref_recover, ref_packed, ref_weight = round_trip(
+        LoopWeightOnlyLinear, config, bits, group_size, in_features, out_features
+    )
+    vec_pack, vec_recover, packed, weight = round_trip(
+        WeightOnlyLinear, config, bits, group_size, in_features, out_features
+    )
+    identical = torch.equal(ref_weight, weight) and ref_packed.keys() == packed.keys()
+    identical = identical and all(torch.equal(ref_packed[k], packed[k]) for k in packed)
+    print(
+        f"optimum={config[0]} dtype={config[1]} dim={config[2]} zp={config[3]} bits={bits} "
+        f"pack: loop={ref_pack * 1000:.1f}ms vectorized={vec_pack * 1000:.1f}ms ({ref_pack / vec_pack:.1f}x) "
+        f"recover: loop={ref_recover * 1000:.1f}ms vectorized={vec_recover * 1000:.1f}ms "
+        f"({ref_recover / vec_recover:.1f}x) identical={identical}"
+    )
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--in_features", default=4096, type=int)
+    parser.add_argument("--out_features", default=4096, type=int)
+    parser.add_argument("--group_size", default=128, type=int)
+    parser.add_argument("--bits", default=[2, 4, 8], type=int, nargs="+")
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    all_identical = True
+    for bits in args.bits:
+        for config in CONFIGS:
+            if config[1] == torch.int8 and bits == 8:  ##the mask does not fit into int8
+                continue
+            all_identical &= run(config, bits, args.group_size, args.in_features, args.out_features)
+    if not all_identical:
+        sys.exit(1)
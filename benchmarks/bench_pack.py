@@ -0,0 +1,107 @@
+"""Micro-benchmark of QuantLinear.pack on CPU, the vectorized packing against the former per-column loop.
+
+Usage:
+    python benchmarks/bench_pack.py --infeatures 4096 --outfeatures 4096 --group_size 128
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, ".")
+from auto_round_extension.cuda.qliner_triton import QuantLinear
+
+
+def loop_pack(qlayer, linear, scales, zeros):
+    """The per-column/per-row loop QuantLinear.pack used before vectorization, kept as the reference."""
+    W = linear.weight.data.clone()
+    scales = scales.t().contiguous()
+    zeros = zeros.t().contiguous()
+    scale_zeros = zeros * scales
+    half_scales = scales.clone().half()
+    g_idx = qlayer.g_idx
+
+    intweight = []
+    for idx in range(qlayer.infeatures):
+        intweight.append(
+            torch.round((W[:, idx] + scale_zeros[g_idx[idx]]) / half_scales[g_idx[idx]]).to(torch.int)[:, None]
+        )
+    intweight = torch.cat(intweight, dim=1)
+    intweight = intweight.t().contiguous()
+    intweight = intweight.numpy().astype(np.uint32)
+
+    i = 0
+    row = 0
+    qweight = np.zeros((intweight.shape[0] // 32 * qlayer.bits, intweight.shape[1]), dtype=np.uint32)
+    while row < qweight.shape[0]:
+        for j in range(i, i + (32 // qlayer.bits)):
+            qweight[row] |= intweight[j] << (qlayer.bits * (j - i))
+        i += 32 // qlayer.bits
+        row += 1
+
+    zeros = zeros.numpy().astype(np.uint32)
+    qzeros = np.zeros((zeros.shape[0], zeros.shape[1] // 32 * qlayer.bits), dtype=np.uint32)
+    i = 0
+    col = 0
+    while col < qzeros.shape[1]:
+        for j in range(i, i + (32 // qlayer.bits)):
+            qzeros[:, col] |= zeros[:, j] << (qlayer.bits * (j - i))
+        i += 32 // qlayer.bits
+        col += 1
+    return torch.from_numpy(qweight.astype(np.int32)), torch.from_numpy(qzeros.astype(np.int32))
+
+
+def make_layer(bits, group_size, infeatures, outfeatures, seed=0):
+    """Builds a fp16 linear layer together with asym scale/zp in the layout of layer_config."""
+    torch.manual_seed(seed)
+    linear = torch.nn.Linear(infeatures, outfeatures, bias=False).to(torch.float16)
+    maxq = 2 ** bits - 1
+    group_size = group_size if group_size != -1 else infeatures
+    weight = linear.weight.data.float().reshape(outfeatures, -1, group_size)
+    wmin = torch.clamp(weight.min(-1)[0], max=0)
+    wmax = torch.clamp(weight.max(-1)[0], min=0)
+    scale = ((wmax - wmin) / maxq).to(torch.float16)
+    zp = torch.round(-wmin / scale).clamp(0, maxq)
+    q = torch.clamp(torch.round(weight / scale.float().unsqueeze(-1)) + zp.unsqueeze(-1), 0, maxq)
+    linear.weight.data.copy_(((q - zp.unsqueeze(-1)) * scale.float().unsqueeze(-1)).reshape(outfeatures, infeatures))
+    return linear, scale, zp.to(torch.float32)
+
+
+def run(bits, group_size, infeatures, outfeatures, repeat):
+    linear, scale, zp = make_layer(bits, group_size, infeatures, outfeatures)
+    qlayer = QuantLinear(bits, group_size, infeatures, outfeatures, bias=False)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        ref_qweight, ref_qzeros = loop_pack(qlayer, linear, scale, zp)
+    loop_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        qlayer.pack(linear, scale, zp, None)
+    vec_time = (time.perf_counter() - start) / repeat
+
+    identical = torch.equal(ref_qweight, qlayer.qweight) and torch.equal(ref_qzeros, qlayer.qzeros)
+    print(f"bits={bits} group_size={group_size} shape=({outfeatures}, {infeatures}) "
+          f"loop={loop_time * 1000:.1f}ms vectorized={vec_time * 1000:.1f}ms "
+          f"speedup={loop_time / vec_time:.1f}x identical={identical}")
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--infeatures", default=4096, type=int)
+    parser.add_argument("--outfeatures", default=4096, type=int)
+    parser.add_argument("--group_size", default=128, type=int)
+    parser.add_argument("--bits", default=[2, 4, 8], type=int, nargs="+")
+    parser.add_argument("--repeat", default=3, type=int)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    all_identical = True
+    for bits in args.bits:
+        all_identical &= run(bits, args.group_size, args.infeatures, args.outfeatures, args.repeat)
+    if not all_identical:
+        sys.exit(1)
@@ -0,0 +1,417 @@
+"""CPU benchmark suite of the quantization pipeline on tiny random Llama, OPT and GPT-2 models.
+
+It times AutoRound.quantize end to end, the tuning iterations of a block, quantize with the blocks tuned by 1, 2
+and 4 worker processes, quantize with the quantized inputs pipelined across the workers at several staleness
+windows, quantize with lookahead blocks with and without gradient checkpointing, the SignSGD step per parameter,
+with the multi-tensor kernels and on a flattened buffer, quant_tensor for int_asym, int_sym and mx_fp4 at several
+group sizes, the export of each format and the preprocessing of get_dataloader. Every entry is the median of
+--repeat runs, in seconds. The results are written to a json file, which a later run compares against with
+--compare, flagging the entries slower than the baseline by more than --threshold. The quality of the pipelined
+quantization, the logits mse to the full precision model relative to their variance, is written to the "quality"
+section of the json file, the peak memory growth of the quantize with gradient checkpointing, in MB, to its
+"memory" section.
+
+Usage:
+    python benchmarks/bench_suite.py --output benchmarks/baseline.json
+    python benchmarks/bench_suite.py --output /tmp/new.json --compare benchmarks/baseline.json --threshold 0.1
+    python benchmarks/bench_suite.py --only quant_tensor export
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import torch
+import transformers
+
+sys.path.insert(0, ".")
+from auto_round import AutoRound
+from auto_round.calib_dataset import get_dataloader
+from auto_round.data_type import get_quant_func
+from auto_round.quantizer import quant_tensor, reshape_tensor
+from auto_round.sign_sgd import SignSGD
+
+ARCHS = ["llama", "opt", "gpt2"]
+## the quality of the benchmarks that trade it for time, written next to the timings
+QUALITY = {}
+MEMORY = {}
+
+
+def build_model(arch, hidden_size=256, num_layers=4, vocab_size=512, seqlen=128, seed=0):
+    """Builds a small random causal language model of the architecture."""
+    if arch == "llama":
+        config = transformers.LlamaConfig(
+            vocab_size=vocab_size, hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+            num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=4,
+            max_position_embeddings=seqlen)
+        model_cls = transformers.LlamaForCausalLM
+    elif arch == "opt":
+        config = transformers.OPTConfig(
+            vocab_size=vocab_size, hidden_size=hidden_size, ffn_dim=hidden_size * 2, num_hidden_layers=num_layers,
+            num_attention_heads=4, max_position_embeddings=seqlen, word_embed_proj_dim=hidden_size)
+        model_cls = transformers.OPTForCausalLM
+    elif arch == "gpt2":
+        config = transformers.GPT2Config(
+            vocab_size=vocab_size, n_embd=hidden_size, n_layer=num_layers, n_head=4, n_positions=seqlen)
+        model_cls = transformers.GPT2LMHeadModel
+    else:
+        raise ValueError(f"unknown architecture {arch}")
+    torch.manual_seed(seed)
+    return model_cls(config).eval()
+
+
+def build_tokenizer(corpus, vocab_size=512):
+    """Trains a word level tokenizer on the corpus, so that no tokenizer has to be downloaded."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+    tokenizer = Tokenizer(models.WordLevel(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    trainer = trainers.WordLevelTrainer(vocab_size=vocab_size, special_tokens=["<unk>", "<s>", "</s>"])
+    tokenizer.train_from_iterator(corpus, trainer)
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="<unk>", bos_token="<s>", eos_token="</s>")
+
+
+def synthetic_corpus(nlines, words_per_line, vocab_size=400, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    ids = torch.randint(0, vocab_size, (nlines, words_per_line), generator=generator)
+    return [" ".join(f"w{i}" for i in line.tolist()) for line in ids]
+
+
+def timeit(func, repeat, warmup=1):
+    """Returns the median wall time of func over repeat runs, after warmup runs."""
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def make_autoround(arch, args, **kwargs):
+    model = build_model(arch, args.hidden_size, args.num_layers, seqlen=args.seqlen)
+    generator = torch.Generator().manual_seed(1)
+    data = [torch.randint(0, 512, (args.batch_size, args.seqlen), generator=generator)
+            for _ in range(args.nsamples // args.batch_size)]
+    return AutoRound(model, None, bits=4, group_size=args.group_size, dataset=data, seqlen=args.seqlen,
+                     nsamples=args.nsamples, batch_size=args.batch_size, iters=args.iters, device="cpu",
+                     layer_config={}, disable_wandb=True, **kwargs)
+
+
+def bench_quantize(args):
+    results = {}
+    for arch in ARCHS:
+        results[f"quantize/{arch}"] = timeit(lambda: make_autoround(arch, args).quantize(), args.repeat, warmup=0)
+    return results
+
+
+def bench_quant_block(args):
+    """The time of one tuning iteration of a block, from the profile of quantize."""
+    results = {}
+    for arch in ARCHS:
+        times = []
+        for _ in range(args.repeat):
+            autoround = make_autoround(arch, args, enable_profiling=True)
+            autoround.quantize()
+            tune = autoround.profiler.report()["phases"]["tune"]
+            times.append(tune["time"] / (tune["count"] * args.iters))
+        results[f"quant_block_iter/{arch}"] = statistics.median(times)
+    return results
+
+
+def bench_block_parallel(args):
+    """quantize of llama without quantized inputs, with the blocks tuned by 1, 2 and 4 worker processes."""
+    results = {}
+    for num_workers in [1, 2, 4]:
+        if num_workers > args.num_layers:
+            continue
+        results[f"block_parallel/llama/workers{num_workers}"] = timeit(
+            lambda: make_autoround(
+                "llama", args, enable_quanted_input=False, num_block_workers=num_workers).quantize(),
+            args.repeat, warmup=0)
+    for name, value in results.items():
+        print(f"{name}: speedup {results['block_parallel/llama/workers1'] / value:.2f}x")
+    return results
+
+
+@torch.no_grad()
+def logits_relative_mse(model, args):
+    """The mse of the logits of model to the ones of the full precision model, relative to their variance, on
+    held-out random tokens."""
+    fp_model = build_model("llama", args.hidden_size, args.num_layers, seqlen=args.seqlen)
+    generator = torch.Generator().manual_seed(2)
+    tokens = torch.randint(0, 512, (args.batch_size, args.seqlen), generator=generator)
+    fp_logits = fp_model(tokens).logits
+    return (torch.mean((model(tokens).logits - fp_logits) ** 2) / fp_logits.var()).item()
+
+
+def bench_pipeline(args):
+    """quantize of llama with quantized inputs, with the blocks tuned on round to nearest approximations of
+    their quantized inputs by --pipeline_workers worker processes, at the staleness windows 0, 1 and 3."""
+    results = {}
+    for staleness in [0, 1, 3]:
+        if staleness >= args.num_layers:
+            continue
+        name = f"pipeline/llama/staleness{staleness}"
+        autorounds = []
+
+        def run():
+            autorounds.append(make_autoround(
+                "llama", args, num_block_workers=args.pipeline_workers, pipeline_staleness=staleness))
+            autorounds[-1].quantize()
+
+        results[name] = timeit(run, args.repeat, warmup=0)
+        QUALITY[name] = logits_relative_mse(autorounds[-1].model, args)
+    print(f"{'benchmark':<40} {'time(s)':>10} {'speedup':>8} {'logits rel mse':>15}")
+    for name, value in results.items():
+        print(f"{name:<40} {value:>10.3f} {results['pipeline/llama/staleness0'] / value:>7.2f}x "
+              f"{QUALITY[name]:>15.6f}")
+    return results
+
+
+def run_checkpointing(args, checkpoint_granularity, queue):
+    """Runs quantize in a fresh process and puts its time and peak memory growth, in MB, in the queue."""
+    import resource
+
+    torch.set_num_threads(args.num_threads)
+    logging.getLogger("autoround").setLevel(logging.WARNING)
+    autoround = make_autoround(
+        "llama", args, nblocks=1, num_lookahead_blocks=args.num_layers - 1,
+        enable_gradient_checkpointing=checkpoint_granularity > 0, checkpoint_granularity=max(checkpoint_granularity, 1))
+    ## ru_maxrss is in KB on linux and in bytes on macos
+    unit = 1024 if platform.system() == "Darwin" else 1
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    autoround.quantize()
+    elapsed = time.perf_counter() - start
+    peak_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, (peak_after - peak_before) / unit / 1024))
+
+
+def bench_checkpointing(args):
+    """quantize of llama with a fine tune block and num_layers - 1 lookahead blocks, without gradient
+    checkpointing and with checkpointed segments of 1 and 2 blocks. Every run is in a fresh process, for its
+    peak memory."""
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for checkpoint_granularity in [0, 1, 2]:
+        name = f"checkpointing/llama/granularity{checkpoint_granularity}" if checkpoint_granularity > 0 else \
+            "checkpointing/llama/off"
+        times, memories = [], []
+        for _ in range(args.repeat):
+            queue = context.Queue()
+            process = context.Process(target=run_checkpointing, args=(args, checkpoint_granularity, queue))
+            process.start()
+            elapsed, memory = queue.get()
+            process.join()
+            times.append(elapsed)
+            memories.append(memory)
+        results[name] = statistics.median(times)
+        MEMORY[name] = statistics.median(memories)
+    print(f"{'benchmark':<40} {'time(s)':>10} {'slowdown':>9} {'peak growth(MB)':>16}")
+    for name, value in results.items():
+        print(f"{name:<40} {value:>10.3f} {value / results['checkpointing/llama/off']:>8.2f}x "
+              f"{MEMORY[name]:>16.1f}")
+    return results
+
+
+def bench_sign_sgd(args):
+    """The SignSGD step and zero_grad on the rounding and min-max scale parameters of the 7 linear layers of 1 and 4
+    llama blocks, per parameter, with the multi-tensor kernels and on a flattened buffer, without and with
+    momentum."""
+    hidden_size = args.hidden_size
+    shapes = [(hidden_size, hidden_size)] * 4 + [(hidden_size * 2, hidden_size)] * 2 + [(hidden_size, hidden_size * 2)]
+    results = {}
+    for num_blocks in [1, 4]:
+        torch.manual_seed(0)
+        round_params, minmax_params = [], []
+        for out_features, in_features in shapes * num_blocks:
+            ngroups = out_features * in_features // args.group_size
+            round_params.append(torch.nn.Parameter(torch.zeros(ngroups, args.group_size)))
+            minmax_params.extend(torch.nn.Parameter(torch.ones(ngroups)) for _ in range(2))
+        grads = [torch.randn_like(param) for param in round_params + minmax_params]
+        for momentum in [0, 0.9]:
+            for name, kwargs in [("single", {"foreach": False}), ("foreach", {"foreach": True}),
+                                 ("flatten", {"flatten": True})]:
+                optimizer = SignSGD([{"params": round_params}, {"params": minmax_params, "lr": 0.005}], lr=0.005,
+                                    momentum=momentum, **kwargs)
+
+                def run():
+                    ## like a backward, which accumulates into the gradients that zero_grad kept
+                    for param, grad in zip(round_params + minmax_params, grads):
+                        if param.grad is None:
+                            param.grad = grad
+                        else:
+                            param.grad.copy_(grad)
+                    optimizer.step()
+                    optimizer.zero_grad()
+
+                results[f"sign_sgd/{name}/momentum{momentum}/blocks{num_blocks}"] = timeit(run, args.repeat * 20)
+    return results
+
+
+def bench_quant_tensor(args):
+    """The forward and backward of quant_tensor on a weight, with the tuned rounding and minmax scales."""
+    results = {}
+    torch.manual_seed(0)
+    weight = torch.randn(args.weight_size, args.weight_size)
+    for data_type, sym in [("int", False), ("int", True), ("mx_fp4", True)]:
+        quant_func, key = get_quant_func(data_type, 4, sym)
+        for group_size in [32, 128, -1]:
+            if key.startswith("mx") and group_size == -1:
+                continue
+            weight_reshape = reshape_tensor(weight, group_size)
+            weight_min = torch.clamp(weight_reshape.min(1)[0], max=0)
+            weight_max = torch.clamp(weight_reshape.max(1)[0], min=0)
+            v = torch.zeros_like(weight_reshape, requires_grad=True)
+            min_scale = torch.ones(weight_reshape.shape[0], requires_grad=True)
+            max_scale = torch.ones(weight_reshape.shape[0], requires_grad=True)
+
+            def run():
+                qdq_weight, _, _ = quant_tensor(
+                    quant_func, weight, 4, group_size, v, min_scale, max_scale, torch.float16, weight_min,
+                    weight_max, data_type=key)
+                qdq_weight.sum().backward()
+
+            results[f"quant_tensor/{key}/gs{group_size}"] = timeit(run, args.repeat * 5)
+    return results
+
+
+def bench_export(args):
+    """save_quantized of a quantized llama in every format, the formats whose dependencies are missing are
+    skipped."""
+    from auto_round.export import EXPORT_FORMAT
+
+    results = {}
+    autoround = make_autoround("llama", args)
+    autoround.quantize()
+    output_dir = tempfile.mkdtemp()
+    try:
+        for format in EXPORT_FORMAT:
+            try:
+                results[f"export/{format}"] = timeit(
+                    lambda: autoround.save_quantized(output_dir, format=format, inplace=False), args.repeat)
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"skip export/{format}: {type(error).__name__}: {error}")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def bench_dataloader(args):
+    """get_dataloader on a local json corpus with a locally trained tokenizer."""
+    corpus = synthetic_corpus(args.nsamples * 8, args.seqlen * 2)
+    tokenizer = build_tokenizer(corpus)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "calib.json")
+        with open(path, "w") as f:
+            json.dump([{"text": line} for line in corpus], f)
+
+        def run():
+            dataloader = get_dataloader(tokenizer, args.seqlen, dataset_name=path, bs=args.batch_size,
+                                        nsamples=args.nsamples)
+            for _ in dataloader:
+                pass
+
+        return {"get_dataloader/local_json": timeit(run, args.repeat)}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "quantize": bench_quantize,
+    "quant_block": bench_quant_block,
+    "block_parallel": bench_block_parallel,
+    "pipeline": bench_pipeline,
+    "checkpointing": bench_checkpointing,
+    "sign_sgd": bench_sign_sgd,
+    "quant_tensor": bench_quant_tensor,
+    "export": bench_export,
+    "dataloader": bench_dataloader,
+}
+
+
+def compare(results, baseline, threshold):
+    """Prints the ratio of every entry to the baseline and returns the entries slower by more than threshold."""
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline(s)':>12} {'current(s)':>12} {'ratio':>8}")
+    for name, value in results.items():
+        if name not in baseline:
+            print(f"{name:<40} {'-':>12} {value:>12.5f} {'new':>8}")
+            continue
+        ratio = value / baseline[name]
+        flag = " REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{name:<40} {baseline[name]:>12.5f} {value:>12.5f} {ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", default=list(BENCHMARKS), nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--output", default="benchmarks/results.json", type=str)
+    parser.add_argument("--compare", default=None, type=str, help="baseline json to compare against")
+    parser.add_argument("--threshold", default=0.1, type=float, help="relative slowdown flagged as a regression")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--num_threads", default=4, type=int)
+    parser.add_argument("--hidden_size", default=256, type=int)
+    parser.add_argument("--num_layers", default=4, type=int)
+    parser.add_argument("--seqlen", default=128, type=int)
+    parser.add_argument("--nsamples", default=32, type=int)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--iters", default=20, type=int)
+    parser.add_argument("--group_size", default=128, type=int)
+    parser.add_argument("--weight_size", default=1024, type=int)
+    parser.add_argument("--pipeline_workers", default=2, type=int)
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+    logging.getLogger("autoround").setLevel(logging.WARNING)
+
+    results = {}
+    for name in args.only:
+        print(f"running {name}")
+        try:
+            results.update(BENCHMARKS[name](args))
+        except ImportError as error:
+            print(f"skip {name}: {error}")
+    report = {
+        "meta": {
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "num_threads": args.num_threads,
+            "args": vars(args),
+        },
+        "results": results,
+        "quality": QUALITY,
+        "memory": MEMORY,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {len(results)} results to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        ignored_args = ["only", "output", "compare", "threshold"]
+        for key, value in vars(args).items():
+            if key not in ignored_args and baseline["meta"]["args"].get(key) != value:
+                print(f"warning: the baseline was run with {key}={baseline['meta']['args'].get(key)}, not {value}")
+        regressions = compare(results, baseline["results"], args.threshold)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regressions: {regressions}")
+            sys.exit(1)
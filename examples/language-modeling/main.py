@@ -164,9 +164,79 @@ if __name__ == '__main__':
     parser.add_argument("--wandb_project_name", default=WANDB_PROJECT_NAME, type=str)
     parser.add_argument("--disable_wandb", action='store_true', default=False)
     parser.add_argument("--wandb_offline", action='store_true', default=False)
+    parser.add_argument("--metrics_sink", default=None, type=str, choices=["memory", "jsonl", "wandb"],
+                        help="destination of the tuning metrics, defaults to wandb unless --disable_wandb is set")
+    parser.add_argument("--metrics_path", default=None, type=str,
+                        help="file of the jsonl metrics sink, defaults to metrics.jsonl in the output dir")
+    parser.add_argument("--metrics_flush_interval", default=50, type=int,
+                        help="number of iterations whose losses are copied from the device and logged at once")
+    parser.add_argument("--enable_profiling", action='store_true', default=False,
+                        help="record the wall time and peak memory of the quantization phases per block")
+    parser.add_argument("--profile_record_function", action='store_true', default=False,
+                        help="also wrap the profiled phases in torch.profiler record_function ranges")
+    parser.add_argument("--profile_path", default=None, type=str,
+                        help="json file of the profile, defaults to profile.json in the output dir")
+    parser.add_argument("--enable_early_stop", action='store_true', default=False,
+                        help="stop tuning a block once its smoothed loss has stopped changing")
+    parser.add_argument("--early_stop_threshold", default=1e-3, type=float,
+                        help="relative slope and change of the smoothed loss under which an iteration is flat")
+    parser.add_argument("--early_stop_patience", default=10, type=int,
+                        help="number of consecutive flat iterations after which the tuning of a block stops")
+    parser.add_argument("--early_stop_window", default=5, type=int,
+                        help="moving average window of the loss for the early stopping")
+    parser.add_argument("--enable_budget_scheduler", action='store_true', default=False,
+                        help="split the tuning iterations of all blocks according to short probe runs per block")
+    parser.add_argument("--budget_probe_iters", default=10, type=int,
+                        help="number of iterations of the probe run of a block")
+    parser.add_argument("--budget_min_iters", default=None, type=int,
+                        help="minimum number of iterations of a block, defaults to iters // 4")
+    parser.add_argument("--budget_max_iters", default=None, type=int,
+                        help="maximum number of iterations of a block, defaults to 4 * iters")
     parser.add_argument("--lm_eval_random_seed", default=0, type=int)
     parser.add_argument("--lm_eval_numpy_random_seed", default=1234, type=int)
     parser.add_argument("--lm_eval_torch_random_seed", default=1234, type=int)
+    parser.add_argument("--enable_fused_qdq", action='store_true', default=False,
+                        help="fake quantize the weights with a fused forward and STE backward during tuning")
+    parser.add_argument("--calib_cache_dir", default=None, type=str,
+                        help="directory to cache the calibration inputs on disk across runs")
+    parser.add_argument("--activation_memmap_dir", default=None, type=str,
+                        help="directory of the memory-mapped files backing the cached block inputs and outputs")
+    parser.add_argument("--enable_prefetch", action='store_true', default=False,
+                        help="move the blocks of the next tuning window to the device on a background thread")
+    parser.add_argument("--num_ablation_workers", default=1, type=int,
+                        help="number of worker processes running the attach loss variants of the isolation experiment, "
+                             "every spawned worker holds its own copy of the model in memory")
+    parser.add_argument("--num_block_workers", default=1, type=int,
+                        help="number of worker processes tuning the blocks concurrently, needs "
+                             "--disable_quanted_input or --pipeline_staleness, every spawned worker holds its own "
+                             "copy of the model in memory")
+    parser.add_argument("--enable_gradient_checkpointing", action='store_true',
+                        help="recompute the activations of the tuned blocks in the backward to save memory")
+    parser.add_argument("--checkpoint_granularity", default=1, type=int,
+                        help="number of blocks per checkpointed segment")
+    parser.add_argument("--observe_schedule", default=None, type=str, choices=["step", "every", "end", "never"],
+                        help="when the observe block mse is computed, on the training batch of every step, every "
+                             "--observe_interval steps, at the end or never, step if the metrics are logged and "
+                             "never otherwise by default")
+    parser.add_argument("--observe_interval", default=10, type=int,
+                        help="number of steps between the observations of --observe_schedule every")
+    parser.add_argument("--observe_nsamples", default=None, type=int,
+                        help="number of samples of the observations, the train batch size by default")
+    parser.add_argument("--pipeline_staleness", default=0, type=int,
+                        help="number of blocks still tuning when a block starts tuning on their round to nearest "
+                             "outputs, 0 tunes the blocks one by one on their exact quantized inputs")
+    parser.add_argument("--pipeline_retune_iters", default=0, type=int,
+                        help="number of steps re-tuning the blocks tuned on stale inputs of --pipeline_staleness "
+                             "on their exact quantized inputs, 0 disables it")
+    parser.add_argument("--enable_early_exit_eval", action='store_true', default=False,
+                        help="whether the isolation experiment evaluates the wikitext2 perplexity by running only "
+                             "the blocks from the fine tune block on, the window length is --eval_ppl_seqlen")
+    parser.add_argument("--eval_ppl_in_process", action='store_true', default=False,
+                        help="evaluate the wikitext2/ptb/c4 perplexity of the in-memory quantized model before saving it")
+    parser.add_argument("--eval_ppl_seqlen", default=2048, type=int,
+                        help="window length of the in-process perplexity evaluation")
+    parser.add_argument("--eval_ppl_bs", default=1, type=int,
+                        help="number of windows per forward of the in-process perplexity evaluation")
     
 
     args = parser.parse_args()
@@ -379,6 +449,15 @@ if __name__ == '__main__':
             dir=WANDB_LOG_DIR,
         )
         
+    metrics_sink = args.metrics_sink
+    if metrics_sink == "jsonl":
+        from auto_round.metrics import JsonlMetricsSink
+
+        metrics_path = args.metrics_path
+        if metrics_path is None:
+            metrics_path = os.path.join(args.output_dir, "metrics.jsonl")
+        metrics_sink = JsonlMetricsSink(metrics_path)
+
     model_name = args.model_name.rstrip("/")
     autoround = round(model, tokenizer, model_name, args.bits, args.group_size, sym=args.sym, round_to_nearest=args.round_to_nearest,
                       batch_size=args.train_bs, dataset=args.dataset, seqlen=seqlen, 
@@ -397,6 +476,35 @@ if __name__ == '__main__':
                       low_cpu_mem_usage=low_cpu_mem_usage, data_type=args.data_type,
                       not_use_best_mse=not args.use_best_mse,
                       disable_wandb=args.disable_wandb,
+                      metrics_sink=metrics_sink,
+                      metrics_flush_interval=args.metrics_flush_interval,
+                      enable_profiling=args.enable_profiling,
+                      profile_record_function=args.profile_record_function,
+                      profile_path=args.profile_path if args.profile_path is not None else os.path.join(
+                          args.output_dir, "profile.json"),
+                      enable_early_stop=args.enable_early_stop,
+                      early_stop_threshold=args.early_stop_threshold,
+                      early_stop_patience=args.early_stop_patience,
+                      early_stop_window=args.early_stop_window,
+                      enable_budget_scheduler=args.enable_budget_scheduler,
+                      budget_probe_iters=args.budget_probe_iters,
+                      budget_min_iters=args.budget_min_iters,
+                      budget_max_iters=args.budget_max_iters,
+                      enable_fused_qdq=args.enable_fused_qdq,
+                      calib_cache_dir=args.calib_cache_dir,
+                      activation_memmap_dir=args.activation_memmap_dir,
+                      enable_prefetch=args.enable_prefetch,
+                      num_ablation_workers=args.num_ablation_workers,
+                      num_block_workers=args.num_block_workers,
+                      pipeline_staleness=args.pipeline_staleness,
+                      pipeline_retune_iters=args.pipeline_retune_iters,
+                      enable_gradient_checkpointing=args.enable_gradient_checkpointing,
+                      checkpoint_granularity=args.checkpoint_granularity,
+                      observe_schedule=args.observe_schedule,
+                      observe_interval=args.observe_interval,
+                      observe_nsamples=args.observe_nsamples,
+                      enable_early_exit_eval=args.enable_early_exit_eval,
+                      early_exit_eval_seqlen=args.eval_ppl_seqlen,
                     )
     model, _ = autoround.quantize()
     if args.low_cpu_mem_mode == 1 or args.low_cpu_mem_mode == 2:
@@ -407,6 +515,16 @@ if __name__ == '__main__':
     if "cpu" not in device_str:
         torch.cuda.empty_cache()
 
+    if args.eval_ppl_in_process and not args.disable_eval:
+        from auto_round.eval import eval_datasets_perplexity
+        ppl_tasks = [task for task in args.tasks.split(',') if task in ["wikitext2", "ptb", "c4"]]
+        ppl_results = eval_datasets_perplexity(model.to(device_str), tokenizer, ppl_tasks, seqlen=args.eval_ppl_seqlen,
+                                               batch_size=args.eval_ppl_bs)
+        model = model.to("cpu")
+        print(ppl_results)
+        if not args.disable_wandb:
+            wandb.log({f"ppl/{task}": ppl for task, ppl in ppl_results.items()})
+
     output_dir = os.path.join(args.output_dir, run_name.replace("=", "::"))
     export_dir = output_dir + "_export"
 
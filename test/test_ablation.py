@@ -0,0 +1,63 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.ablation import AblationScheduler
+from auto_round.utils import to_dtype
+from helpers import get_tiny_llama
+
+
+def square(x, device="cpu", in_worker=False):
+    return x * x, in_worker
+
+
+def scale(factor, x, device="cpu", in_worker=False):
+    return factor * x
+
+
+class TestAblationScheduler(unittest.TestCase):
+    def test_run(self):
+        jobs = [(i,) for i in range(6)]
+        serial = dict(AblationScheduler(1).run(square, jobs))
+        parallel = dict(AblationScheduler(3).run(square, jobs))
+        self.assertEqual({job: res[0] for job, res in serial.items()}, {job: res[0] for job, res in parallel.items()})
+        self.assertFalse(any(res[1] for res in serial.values()))
+        self.assertTrue(all(res[1] for res in parallel.values()))
+
+    def test_shared(self):
+        jobs = [(i,) for i in range(4)]
+        for num_workers in [1, 2]:
+            results = dict(AblationScheduler(num_workers).run(scale, jobs, shared=(3,)))
+            self.assertEqual(results, {(i,): 3 * i for i in range(4)})
+
+    def test_keep_workers(self):
+        with AblationScheduler(2) as scheduler:
+            self.assertEqual(dict(scheduler.run(scale, [(1,), (2,)], shared=(3,))), {(1,): 3, (2,): 6})
+            executor = scheduler.executor
+            self.assertEqual(dict(scheduler.run(scale, [(4,)], shared=(3,))), {(4,): 12})
+            self.assertIs(scheduler.executor, executor)
+        self.assertIsNone(scheduler.executor)
+
+    def test_isolation_variants(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                              batch_size=2, iters=3, device="cpu", layer_config={}, disable_wandb=True)
+        block_names = [f"model.layers.{i}" for i in range(3)]
+        inputs = autoround.try_cache_inter_data_gpucpu([block_names[0]], autoround.nsamples)[block_names[0]]
+        input_ids = to_dtype(inputs.pop("input_ids"), torch.float32)
+        shared = (autoround.model, block_names, input_ids, inputs)
+        jobs = [(0, idx, 2) for idx in range(3)]
+        serial = {job[1]: res for job, res in AblationScheduler(1).run(autoround.run_isolation_variant, jobs, shared)}
+        parallel = {
+            job[1]: res for job, res in AblationScheduler(2).run(autoround.run_isolation_variant, jobs, shared)}
+        for idx in range(3):
+            self.assertEqual(serial[idx]["attach_loss_block_name"], block_names[idx])
+            self.assertEqual(serial[idx]["mses_observe_block"], parallel[idx]["mses_observe_block"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round.activation_store import ActivationStore
+from auto_round.utils import sampling_inputs, to_device, to_dtype
+
+
+class TestActivationStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.memmap_dir = "./saved_activation_memmap"
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.memmap_dir, ignore_errors=True)
+
+    def _check_store(self, dim, memmap_dir=None):
+        torch.manual_seed(0)
+        shape = [3, 8, 16] if dim == 0 else [8, 3, 16]
+        batches = [torch.randn(shape) for _ in range(3)]
+        store = ActivationStore(4, dim=dim, memmap_dir=memmap_dir)  # grows past the capacity
+        samples = []
+        for batch in batches:
+            store.append(batch)
+            samples.extend(torch.split(batch, 1, dim=dim))
+        self.assertEqual(len(store), len(samples))
+        indices = torch.randperm(len(samples))[:4]
+        self.assertTrue(torch.equal(store.gather(indices), torch.cat([samples[i] for i in indices], dim=dim)))
+        self.assertTrue(torch.equal(store[5], samples[5]))
+
+        half = to_dtype(store, torch.float16)
+        self.assertEqual(half.dtype, torch.float16)
+        self.assertTrue(torch.equal(half.gather(indices), store.gather(indices).half()))
+        self.assertIs(to_device(store, "cpu"), store)
+
+        for i in range(len(store)):
+            store[i] = None
+        self.assertIsNone(store.data)
+
+    def test_store(self):
+        self._check_store(0)
+        self._check_store(1)
+
+    def test_memmap(self):
+        self._check_store(0, self.memmap_dir)
+        self.assertEqual(len(os.listdir(self.memmap_dir)), 0)  # the mapped files are unlinked
+
+    def test_sampling_inputs(self):
+        input_ids = ActivationStore(4)
+        input_ids.append(torch.randn(4, 8, 16))
+        attention_mask = ActivationStore(4)
+        attention_mask.append(torch.randn(4, 1, 8, 8))
+        input_others = {"positional_inputs": (), "attention_mask": attention_mask, "position_ids": torch.arange(8)}
+        indices = torch.tensor([3, 1])
+        current_input_ids, current_input_others = sampling_inputs(input_ids, input_others, indices, 8)
+        self.assertTrue(torch.equal(current_input_ids, input_ids.view()[indices]))
+        self.assertTrue(torch.equal(current_input_others["attention_mask"], attention_mask.view()[indices]))
+        self.assertIs(current_input_others["position_ids"], input_others["position_ids"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round.utils import block_forward
+
+
+class AlibiBlock(torch.nn.Module):
+    def forward(self, x, scale, alibi=None, bias=None):
+        return x * scale + alibi.sum() + bias
+
+
+class TestBlockForward(unittest.TestCase):
+    def test_input_others_not_modified(self):
+        alibi = torch.ones(2, 4, 3, 3)
+        input_others = {"positional_inputs": (2.0,), "alibi": alibi, "bias": torch.tensor(1.0)}
+        expected = dict(input_others)
+        x = torch.ones(2, 3)
+        outputs = [block_forward(AlibiBlock(), x, input_others) for _ in range(2)]
+        self.assertEqual(input_others.keys(), expected.keys())
+        for key, value in expected.items():
+            self.assertIs(input_others[key], value)
+        self.assertTrue(torch.equal(outputs[0], outputs[1]))
+        self.assertTrue(torch.equal(outputs[0], torch.full((2, 3), 75.0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from helpers import get_tiny_llama
+
+
+def quantize(**kwargs):
+    torch.manual_seed(1)
+    data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+    autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                          batch_size=2, iters=5, device="cpu", layer_config={}, disable_wandb=True,
+                          enable_quanted_input=False, **kwargs)
+    model, layer_config = autoround.quantize()
+    return model, layer_config
+
+
+class TestBlockParallel(unittest.TestCase):
+    def test_matches_serial(self):
+        for kwargs in [{}, {"num_lookahead_blocks": 1}]:
+            serial_model, serial_config = quantize(**kwargs)
+            parallel_model, parallel_config = quantize(num_block_workers=2, **kwargs)
+            serial_state_dict = serial_model.state_dict()
+            for name, value in parallel_model.state_dict().items():
+                self.assertTrue(torch.allclose(value, serial_state_dict[name], atol=1e-6), name)
+            for name in ["model.layers.0.self_attn.q_proj", "model.layers.2.mlp.down_proj"]:
+                self.assertTrue(torch.allclose(parallel_config[name]["scale"], serial_config[name]["scale"]))
+                self.assertTrue(torch.equal(parallel_config[name]["zp"], serial_config[name]["zp"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
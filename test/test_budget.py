@@ -0,0 +1,60 @@
+import json
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.budget import IterationBudgetScheduler, allocate_iters
+from helpers import get_tiny_llama
+
+
+class TestBudgetScheduler(unittest.TestCase):
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree("./saved_budget", ignore_errors=True)
+
+    def test_allocate_iters(self):
+        self.assertEqual(allocate_iters([1, 1, 1, 1], 400, 10, 1000), [100] * 4)
+        self.assertEqual(allocate_iters([1, 2, 3, 4], 100, 1, 1000), [10, 20, 30, 40])
+        ## the clamped entries leave the rest of the budget to the others
+        self.assertEqual(allocate_iters([0, 1, 100], 100, 10, 60), [10, 30, 60])
+        self.assertEqual(sum(allocate_iters([0.3, 0.7, 1.1], 100, 5, 100)), 100)
+        self.assertEqual(allocate_iters([1, 2], 1000, 10, 100), [100, 100])
+
+    def test_scheduler(self):
+        scheduler = IterationBudgetScheduler(3, 100, probe_iters=10)
+        scheduler.add_probe("flat", [1.0] * 10)
+        scheduler.add_probe("falling", [0.9 ** i for i in range(10)])
+        scheduler.add_probe("large", [4.0 * 0.95 ** i for i in range(10)])
+        allocation = scheduler.allocate()
+        self.assertEqual(list(allocation), ["flat", "falling", "large"])
+        self.assertEqual(sum(allocation.values()), 3 * 90)
+        self.assertLess(allocation["flat"], allocation["falling"])
+        self.assertLess(allocation["falling"], allocation["large"])
+
+    def test_quantize(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                              batch_size=2, iters=12, device="cpu", layer_config={}, disable_wandb=True,
+                              metrics_sink="memory", enable_budget_scheduler=True, budget_probe_iters=4,
+                              budget_min_iters=2)
+        autoround.quantize()
+        self.assertEqual(list(autoround.block_iters), [f"model.layers.{i:03d}" for i in range(3)])
+        self.assertEqual(sum(autoround.block_iters.values()), 3 * (12 - 4))
+        ## the probes log no metrics, the tuning of every block logs its allocated iterations
+        for name, iters in autoround.block_iters.items():
+            self.assertEqual(len(autoround.metrics.history[f"iter_count/{name}->{name}"]), iters)
+
+        autoround.save_quantized("./saved_budget", format="auto_round", inplace=True)
+        with open("./saved_budget/config.json") as f:
+            quantization_config = json.load(f)["quantization_config"]
+        self.assertEqual(quantization_config["block_iters"], dict(autoround.block_iters))
+        self.assertEqual(quantization_config["budget_probe_iters"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import shutil
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.activation_store import ActivationStore
+from auto_round.calib_cache import CalibInputsCache, get_model_fingerprint
+from helpers import get_tiny_llama
+
+
+class FakeTokenizer:
+    name_or_path = "fake-tokenizer"
+
+
+def get_fake_dataloader(**kwargs):
+    torch.manual_seed(1)
+    return [torch.randint(0, 128, (kwargs["bs"], kwargs["seqlen"])) for _ in range(kwargs["nsamples"] // kwargs["bs"])]
+
+
+def assert_nested_equal(test, a, b):
+    test.assertEqual(type(a), type(b))
+    if isinstance(a, torch.Tensor):
+        test.assertTrue(torch.equal(a, b))
+    elif isinstance(a, ActivationStore):
+        test.assertEqual(a.dim, b.dim)
+        test.assertTrue(torch.equal(a.view(), b.view()))
+    elif isinstance(a, (list, tuple)):
+        test.assertEqual(len(a), len(b))
+        for item_a, item_b in zip(a, b):
+            assert_nested_equal(test, item_a, item_b)
+    elif isinstance(a, dict):
+        test.assertEqual(a.keys(), b.keys())
+        for key in a:
+            assert_nested_equal(test, a[key], b[key])
+    else:
+        test.assertEqual(a, b)
+
+
+class TestCalibCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.cache_dir = "./saved_calib_cache"
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_round_trip(self):
+        cache = CalibInputsCache(self.cache_dir)
+        mask = torch.ones(2, 1, 8, 8)
+        inputs = {"block": {"input_ids": ActivationStore.from_tensor(torch.randn(2, 8, 4)), "positional_inputs": (),
+                            "attention_mask": list(torch.split(mask, 1)) + [mask[0:1]], "position_ids": None,
+                            "use_cache": False}}
+        spec = {"dataset": "fake", "nsamples": 2}
+        self.assertEqual(cache.load(spec), (None, None))
+        self.assertTrue(cache.save(spec, inputs, {"input_dim": 0}))
+        loaded, flags = cache.load(spec)
+        assert_nested_equal(self, inputs, loaded)
+        self.assertEqual(flags, {"input_dim": 0})
+        self.assertEqual(cache.load(dict(spec, nsamples=4)), (None, None))
+        self.assertFalse(cache.save(dict(spec, nsamples=4), {"block": object()}, {}))
+
+    def test_fingerprint(self):
+        model = get_tiny_llama()
+        fingerprint = get_model_fingerprint(model)
+        self.assertEqual(fingerprint, get_model_fingerprint(get_tiny_llama()))
+        with torch.no_grad():
+            model.model.layers[0].mlp.up_proj.weight[0, 0] += 1
+        self.assertNotEqual(fingerprint, get_model_fingerprint(model))
+
+    def test_autoround_reuse(self):
+        def get_inputs():
+            autoround = AutoRound(get_tiny_llama(), FakeTokenizer(), bits=4, group_size=32, dataset="fake",
+                                  seqlen=16, nsamples=4, batch_size=2, iters=2, device="cpu", disable_wandb=True,
+                                  calib_cache_dir=self.cache_dir)
+            block_names = ["model.layers.0"]
+            inputs = autoround.try_cache_inter_data_gpucpu(block_names, autoround.nsamples)
+            return inputs, (autoround.input_dim, autoround.share_attention_mask_flag,
+                            autoround.not_share_position_ids_flag)
+
+        with mock.patch("auto_round.autoround.get_dataloader", side_effect=get_fake_dataloader) as dataloader:
+            ref_inputs, ref_flags = get_inputs()
+            self.assertEqual(dataloader.call_count, 1)
+            inputs, flags = get_inputs()
+            self.assertEqual(dataloader.call_count, 1)  # served from the disk cache
+        assert_nested_equal(self, ref_inputs, inputs)
+        self.assertEqual(ref_flags, flags)
+
+
+if __name__ == "__main__":
+    unittest.main()
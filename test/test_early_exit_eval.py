@@ -0,0 +1,51 @@
+import copy
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.eval import EarlyExitEvaluator, eval_perplexity
+from helpers import get_tiny_llama
+
+
+class TestEarlyExitEvaluator(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        self.model = get_tiny_llama(4).eval()
+        self.autoround = AutoRound(self.model, None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                                   batch_size=2, iters=2, device="cpu", layer_config={}, disable_wandb=True)
+        self.block_names = [f"model.layers.{i}" for i in range(4)]
+        self.tokens = torch.randint(0, 128, (16 * 6 + 3,))
+
+    def test_same_as_full_forward(self):
+        evaluator = EarlyExitEvaluator(self.autoround, self.tokens, self.block_names, 2, seqlen=16, batch_size=4)
+        ref = eval_perplexity(self.model, self.tokens, seqlen=16)
+        self.assertAlmostEqual(evaluator.evaluate(self.model), ref, places=4)
+
+        ## a variant changing the block at start_block_idx, the blocks before it are not run
+        variant = copy.deepcopy(self.model)
+        with torch.no_grad():
+            variant.model.layers[2].mlp.down_proj.weight.mul_(1.5)
+        ref_variant = eval_perplexity(variant, self.tokens, seqlen=16)
+        self.assertNotAlmostEqual(ref_variant, ref, places=4)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("a prefix block was run")
+
+        for i in range(2):
+            variant.model.layers[i].forward = fail
+        self.assertAlmostEqual(evaluator.evaluate(variant), ref_variant, places=4)
+
+    def test_first_block(self):
+        evaluator = EarlyExitEvaluator(self.autoround, self.tokens, self.block_names, 0, seqlen=16, batch_size=1)
+        self.assertEqual(len(evaluator.input_ids), 6)
+        ref = eval_perplexity(self.model, self.tokens, seqlen=16)
+        self.assertAlmostEqual(evaluator.evaluate(self.model), ref, places=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.learning_curve_stats_utils import ConvergenceDetector
+from helpers import get_tiny_llama
+
+
+def first_converged_iter(detector, loss_values):
+    for i, loss in enumerate(loss_values):
+        if detector.update(loss):
+            return i
+    return -1
+
+
+class TestEarlyStop(unittest.TestCase):
+    def test_convergence_detector(self):
+        ## the smoothed values need 2 * window - 1 losses, then patience flat iters
+        detector = ConvergenceDetector(threshold=1e-3, patience=3, window=4)
+        self.assertEqual(first_converged_iter(detector, [1.0] * 20), 2 * 4 - 1 + 3 - 2)
+
+        decreasing = [0.99 ** i for i in range(200)]
+        self.assertEqual(first_converged_iter(ConvergenceDetector(threshold=1e-3), decreasing), -1)
+        plateau = decreasing[:50] + [decreasing[49]] * 50
+        converged_iter = first_converged_iter(ConvergenceDetector(threshold=1e-3), plateau)
+        self.assertGreater(converged_iter, 50)
+        self.assertLess(converged_iter, 80)
+
+        ## a single jump resets the count of flat iters
+        detector = ConvergenceDetector(threshold=1e-3, patience=5, window=2)
+        self.assertEqual(first_converged_iter(detector, [1.0] * 5 + [2.0] + [1.0] * 5), -1)
+
+    def test_quantize(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        autoround = AutoRound(get_tiny_llama(), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                              batch_size=2, iters=50, device="cpu", layer_config={}, disable_wandb=True,
+                              not_use_best_mse=True, enable_early_stop=True, early_stop_threshold=10.0,
+                              early_stop_patience=2, early_stop_window=2)
+        _, layer_config = autoround.quantize()
+        self.assertEqual(autoround.early_stopped_iters, {"model.layers.000": (4, 50), "model.layers.001": (4, 50)})
+        ## the tuned values of the stopping iteration are kept
+        for name in ["model.layers.0.self_attn.q_proj", "model.layers.1.mlp.down_proj"]:
+            self.assertIn("scale", layer_config[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
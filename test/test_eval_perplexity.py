@@ -0,0 +1,80 @@
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round.eval import EVAL_DATASETS, eval_perplexity, get_eval_tokens, register_eval_dataset
+from helpers import get_tiny_llama
+
+
+class FakeTokenizer:
+    name_or_path = "fake-tokenizer"
+
+    def __call__(self, text, return_tensors=None):
+        input_ids = [ord(c) % 128 for c in text]
+        return {"input_ids": torch.tensor([input_ids]) if return_tensors == "pt" else input_ids}
+
+
+class TestEvalPerplexity(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.cache_dir = "./saved_eval_cache"
+        self.model = get_tiny_llama().eval()
+        torch.manual_seed(1)
+        self.tokens = torch.randint(0, 128, (16 * 10 + 5,))
+        self.load_count = 0
+
+        @register_eval_dataset("fake")
+        def get_fake_tokens(tokenizer, seqlen):
+            self.load_count += 1
+            return tokenizer("fake corpus " * 20, return_tensors="pt")["input_ids"][0]
+
+    @classmethod
+    def tearDownClass(self):
+        EVAL_DATASETS.pop("fake")
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_same_with_gptq(self):
+        seqlen = 16
+        nlls = []
+        nsamples = self.tokens.numel() // seqlen
+        for i in range(nsamples):
+            batch = self.tokens[i * seqlen:(i + 1) * seqlen].unsqueeze(0)
+            logits = self.model(batch).logits[:, :-1, :]
+            loss = torch.nn.CrossEntropyLoss()(logits.reshape(-1, logits.shape[-1]), batch[:, 1:].reshape(-1))
+            nlls.append(loss.float() * seqlen)
+        ref = torch.exp(torch.stack(nlls).sum() / (nsamples * seqlen)).item()
+        for batch_size in [1, 3]:
+            ppl = eval_perplexity(self.model, self.tokens, seqlen=seqlen, batch_size=batch_size)
+            self.assertAlmostEqual(ppl, ref, places=3)
+
+    def test_strided(self):
+        seqlen, stride = 16, 4
+        nll, cnt, prev_end = 0.0, 0, 0
+        for start in range(0, self.tokens.numel() - seqlen + 1, stride):
+            end = start + seqlen
+            batch = self.tokens[start:end].unsqueeze(0)
+            labels = batch.clone()
+            labels[:, :max(prev_end - start, 1)] = -100
+            logits = self.model(batch).logits[:, :-1, :]
+            nll += torch.nn.functional.cross_entropy(
+                logits.reshape(-1, logits.shape[-1]), labels[:, 1:].reshape(-1), reduction="sum").item()
+            cnt += int((labels != -100).sum())
+            prev_end = end
+        ref = torch.exp(torch.tensor(nll / cnt)).item()
+        ppl = eval_perplexity(self.model, self.tokens, seqlen=seqlen, stride=stride, batch_size=4)
+        self.assertAlmostEqual(ppl, ref, places=3)
+
+    def test_tokens_cache(self):
+        tokens = get_eval_tokens("fake", FakeTokenizer(), seqlen=16, cache_dir=self.cache_dir)
+        cached_tokens = get_eval_tokens("fake", FakeTokenizer(), seqlen=16, cache_dir=self.cache_dir)
+        self.assertTrue(torch.equal(tokens, cached_tokens))
+        self.assertEqual(self.load_count, 1)
+        get_eval_tokens("fake", FakeTokenizer(), seqlen=32, cache_dir=self.cache_dir)
+        self.assertEqual(self.load_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+from safetensors.torch import load_file
+
+from auto_round.export.export_to_autoround.export import pack_layer, save_quantized_as_autoround
+from auto_round.utils import get_layer_names_in_block, set_module
+from helpers import get_tiny_llama
+
+
+def get_layer_config(model, bits=4, group_size=32):
+    layer_config = {}
+    for name in get_layer_names_in_block(model):
+        weight = model.get_submodule(name).weight
+        shape = (weight.shape[0], weight.shape[1] // group_size)
+        layer_config[name] = {
+            "bits": bits, "group_size": group_size, "sym": False, "data_type": "int",
+            "scale": (torch.rand(shape) * 0.01 + 0.001).to(torch.float16),
+            "zp": torch.randint(0, 2 ** bits, shape).to(torch.float32)}
+    return layer_config
+
+
+def load_safetensors(save_dir):
+    state_dict = {}
+    for file in os.listdir(save_dir):
+        if file.endswith(".safetensors"):
+            state_dict.update(load_file(os.path.join(save_dir, file)))
+    return state_dict
+
+
+class TestStreamingExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.save_dir = "./saved_streaming"
+        self.ref_dir = "./saved_streaming_ref"
+        self.backend = "auto_round:exllamav2"
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.save_dir, ignore_errors=True)
+        shutil.rmtree(self.ref_dir, ignore_errors=True)
+
+    def save_reference(self, model, layer_config):
+        for name in layer_config:
+            set_module(model, name, pack_layer(name, model, layer_config, self.backend))
+        model.save_pretrained(self.ref_dir, safe_serialization=True)
+        return load_safetensors(self.ref_dir)
+
+    def export(self, model, layer_config, **kwargs):
+        serialization_dict = {"bits": 4, "group_size": 32, "sym": False, "data_type": "int"}
+        save_quantized_as_autoround(
+            self.save_dir, model=model, layer_config=layer_config, serialization_dict=serialization_dict,
+            tokenizer=None, multimodal=False, backend=self.backend, **kwargs)
+
+    def test_sharded_export(self):
+        model = get_tiny_llama().to(torch.float16)
+        layer_config = get_layer_config(model)
+        self.export(model, layer_config, inplace=False, num_workers=4, max_shard_size="20KB")
+        ref = self.save_reference(get_tiny_llama().to(torch.float16), layer_config)
+
+        with open(os.path.join(self.save_dir, "model.safetensors.index.json")) as f:
+            index = json.load(f)
+        shards = set(index["weight_map"].values())
+        self.assertGreater(len(shards), 1)
+        self.assertEqual(shards, {file for file in os.listdir(self.save_dir) if file.endswith(".safetensors")})
+
+        state_dict = load_safetensors(self.save_dir)
+        self.assertEqual(set(state_dict.keys()), set(ref.keys()))
+        for key in ref:
+            self.assertTrue(torch.equal(state_dict[key], ref[key]), key)
+
+        ##not inplace, the model is left unpacked
+        self.assertIsInstance(model.model.layers[0].mlp.up_proj, torch.nn.Linear)
+        with open(os.path.join(self.save_dir, "config.json")) as f:
+            config = json.load(f)
+        self.assertEqual(config["quantization_config"]["quant_method"], "intel/auto-round")
+
+    def test_inplace_export(self):
+        model = get_tiny_llama().to(torch.float16)
+        layer_config = get_layer_config(model)
+        self.export(model, layer_config, inplace=True, num_workers=2)
+        self.assertTrue(os.path.exists(os.path.join(self.save_dir, "model.safetensors")))
+        self.assertTrue(hasattr(model.model.layers[0].mlp.up_proj, "qweight"))
+        state_dict = load_safetensors(self.save_dir)
+        self.assertTrue(torch.equal(state_dict["model.layers.1.self_attn.q_proj.qweight"],
+                                    model.model.layers[1].self_attn.q_proj.qweight))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round.data_type.int import quant_tensor_asym, quant_tensor_sym
+from auto_round.quantizer import quant_tensor
+
+
+class TestFusedQDQ(unittest.TestCase):
+    def _check(self, quant_func, weight_dtype, group_size=32):
+        torch.manual_seed(0)
+        weight = torch.randn(64, 128).to(weight_dtype)
+        weight_reshape = weight.reshape(-1, group_size)
+        weight_min = torch.clamp(weight_reshape.min(1)[0], max=0).float()
+        weight_max = torch.clamp(weight_reshape.max(1)[0], min=0).float()
+        v = torch.empty(weight_reshape.shape).uniform_(-0.5, 0.5)
+        min_scale = torch.empty(weight_reshape.shape[0]).uniform_(0.7, 1.0)
+        max_scale = torch.empty(weight_reshape.shape[0]).uniform_(0.7, 1.0)
+        grad = torch.randn(64, 128)
+
+        results = []
+        for enable_fused_qdq in [False, True]:
+            params = [t.clone().requires_grad_() for t in (v, min_scale, max_scale)]
+            qdq_weight, scale, zp = quant_tensor(quant_func, weight, 4, group_size, *params, torch.float16,
+                                                 weight_min.clone(), weight_max.clone(), 1e-5,
+                                                 enable_fused_qdq=enable_fused_qdq)
+            (qdq_weight.to(weight_dtype).float() * grad).sum().backward()
+            results.append((qdq_weight.detach(), scale.detach(), zp.detach()) + tuple(p.grad for p in params))
+
+        ref, fused = results
+        for idx in range(4):  # weight, scale, zp and the grad of v are bit-identical
+            self.assertTrue(torch.equal(ref[idx], fused[idx]), idx)
+        for idx in range(4, 6):  # the scale grads are summed in a different order
+            self.assertLess((ref[idx] - fused[idx]).abs().max(), 1e-2 * ref[idx].abs().max(), idx)
+
+    def test_asym(self):
+        self._check(quant_tensor_asym, torch.float32)
+        self._check(quant_tensor_asym, torch.float16)
+
+    def test_sym(self):
+        self._check(quant_tensor_sym, torch.float32)
+        self._check(quant_tensor_sym, torch.float16)
+
+
+if __name__ == "__main__":
+    unittest.main()
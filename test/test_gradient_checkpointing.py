@@ -0,0 +1,51 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.quantizer import WrapperMultiblock
+from helpers import get_tiny_llama
+
+
+def quantize(**kwargs):
+    torch.manual_seed(1)
+    data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+    autoround = AutoRound(get_tiny_llama(4), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                          batch_size=2, iters=5, device="cpu", layer_config={}, disable_wandb=True, nblocks=2,
+                          num_lookahead_blocks=1, **kwargs)
+    model, layer_config = autoround.quantize()
+    return model, layer_config
+
+
+class TestGradientCheckpointing(unittest.TestCase):
+    def test_multiblock_gradients(self):
+        torch.manual_seed(0)
+        layers = [torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.GELU()) for _ in range(3)]
+        x = torch.randn(4, 8)
+        gradients = []
+        for checkpoint_granularity in [0, 1, 2, 3]:
+            block = WrapperMultiblock(layers, checkpoint_granularity=checkpoint_granularity)
+            block.zero_grad()
+            block(x).pow(2).sum().backward()
+            gradients.append([param.grad.clone() for param in block.parameters()])
+        for checkpoint_gradients in gradients[1:]:
+            for gradient, checkpoint_gradient in zip(gradients[0], checkpoint_gradients):
+                self.assertTrue(torch.allclose(gradient, checkpoint_gradient, atol=1e-6))
+
+    def test_quantize_matches(self):
+        model, layer_config = quantize()
+        state_dict = model.state_dict()
+        for checkpoint_granularity in [1, 2]:
+            checkpoint_model, checkpoint_layer_config = quantize(
+                enable_gradient_checkpointing=True, checkpoint_granularity=checkpoint_granularity)
+            for name, value in checkpoint_model.state_dict().items():
+                self.assertTrue(torch.allclose(value, state_dict[name], atol=1e-5), name)
+            for name in ["model.layers.0.self_attn.q_proj", "model.layers.3.mlp.down_proj"]:
+                self.assertTrue(torch.allclose(
+                    checkpoint_layer_config[name]["scale"], layer_config[name]["scale"], atol=1e-6))
+
+
+if __name__ == "__main__":
+    unittest.main()
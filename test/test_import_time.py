@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+
+## seconds `import auto_round` may add on top of its required dependencies, torch and transformers
+IMPORT_TIME_BUDGET = float(os.environ.get("AUTO_ROUND_IMPORT_TIME_BUDGET", "1.0"))
+LAZY_MODULES = ["wandb", "lm_eval", "pandas", "plotly", "scipy.stats"]
+
+
+def cold_import_time(statement):
+    """Runs the import in a fresh interpreter and returns its wall time and the modules it loaded."""
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(sys.modules))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.abspath(".."), os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.check_output([sys.executable, "-c", code], env=env, text=True).strip().splitlines()
+    return float(output[-2]), set(output[-1].split(","))
+
+
+class TestImportTime(unittest.TestCase):
+    def test_import_budget(self):
+        ## best of a few runs, a cold start is noisy
+        base_time = min(cold_import_time("import torch, transformers")[0] for _ in range(3))
+        import_time, modules = min(cold_import_time("import auto_round") for _ in range(3))
+        for name in LAZY_MODULES:
+            self.assertNotIn(name, modules, f"`import auto_round` imports {name}")
+        self.assertLess(
+            import_time - base_time, IMPORT_TIME_BUDGET,
+            f"`import auto_round` took {import_time:.2f}s, {base_time:.2f}s of it for torch and transformers")
+
+
+if __name__ == "__main__":
+    unittest.main()
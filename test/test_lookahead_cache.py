@@ -0,0 +1,33 @@
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from helpers import get_tiny_llama
+
+
+class TestLookaheadOutputCache(unittest.TestCase):
+    def test_each_block_computed_once(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        autoround = AutoRound(get_tiny_llama(4), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                              batch_size=2, iters=2, device="cpu", layer_config={}, disable_wandb=True,
+                              num_lookahead_blocks=1, num_observe_blocks=1, enable_quanted_input=False)
+        computed_blocks = []
+        get_block_outputs = autoround.get_block_outputs
+
+        def count_block_outputs(block, *args, **kwargs):
+            computed_blocks.append(block)
+            return get_block_outputs(block, *args, **kwargs)
+
+        with mock.patch.object(autoround, "get_block_outputs", side_effect=count_block_outputs):
+            autoround.quantize()
+        self.assertEqual(len(computed_blocks), 4)
+        self.assertEqual(len(set(map(id, computed_blocks))), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
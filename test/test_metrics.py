@@ -0,0 +1,83 @@
+import json
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.eval import EarlyExitEvaluator
+from auto_round.metrics import InMemoryMetricsSink, JsonlMetricsSink, MetricsBuffer, MetricsSink, get_metrics_sink
+from auto_round.utils import to_dtype
+from helpers import get_tiny_llama
+
+
+class TestMetrics(unittest.TestCase):
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree("./saved_metrics", ignore_errors=True)
+
+    def test_buffer(self):
+        sink = InMemoryMetricsSink()
+        buffer = MetricsBuffer(sink, flush_interval=2)
+        for i in range(5):
+            buffer.log({"step": i, "loss": torch.tensor(i / 2), "lr": 0.1})
+        self.assertEqual(sink.history["step"], [0, 1, 2, 3])
+        self.assertEqual(buffer.values("loss"), [0.0, 0.5, 1.0, 1.5, 2.0])
+        self.assertEqual(sink.history["lr"], [0.1] * 5)
+        self.assertIsInstance(sink.history["loss"][0], float)
+
+    def test_buffer_sparse(self):
+        sink = InMemoryMetricsSink()
+        buffer = MetricsBuffer(sink, flush_interval=3)
+        for i in range(4):
+            record = {"step": i, "loss": torch.tensor(float(i))}
+            if i % 2 == 0:
+                record["observe"] = torch.tensor(i * 10.0)
+            buffer.log(record)
+        self.assertEqual(buffer.values("loss"), [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual(buffer.values("observe"), [0.0, 20.0])
+
+    def test_jsonl(self):
+        sink = get_metrics_sink("jsonl", path="./saved_metrics/metrics.jsonl")
+        sink.log({"loss": 0.5})
+        sink.log_table("stats", ["a", "b"], [[1, 2]])
+        sink.log_table("stats", ["a", "b"], [[1, 2], [3, torch.tensor(4.0)]])
+        with open("./saved_metrics/metrics.jsonl") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records, [{"loss": 0.5}, {"table": "stats", "a": 1, "b": 2},
+                                   {"table": "stats", "a": 3, "b": 4.0}])
+
+    def test_sink_interface(self):
+        class LossSink(MetricsSink):
+            def log(self, data):
+                pass
+
+        with self.assertRaises(TypeError):
+            LossSink()
+
+    def test_isolation_variant(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                              batch_size=2, iters=5, device="cpu", layer_config={}, disable_wandb=True,
+                              metrics_sink="memory", metrics_flush_interval=2)
+        block_names = [f"model.layers.{i}" for i in range(3)]
+        inputs = autoround.try_cache_inter_data_gpucpu([block_names[0]], autoround.nsamples)[block_names[0]]
+        input_ids = to_dtype(inputs.pop("input_ids"), torch.float32)
+        autoround.early_exit_evaluator = EarlyExitEvaluator(
+            autoround, torch.randint(0, 128, (64,)), block_names, 0, seqlen=16, batch_size=2, device="cpu")
+        result = autoround.run_isolation_variant(
+            autoround.model, block_names, input_ids, inputs, 0, 1, 2, device="cpu")
+        history = autoround.metrics.history
+        self.assertEqual(history["iter_count/model.layers.000->model.layers.002"], list(range(5)))
+        self.assertEqual(history["observe_block_mse/model.layers.000->model.layers.002/model.layers.001"],
+                         result["mses_observe_block"])
+        self.assertTrue(all(isinstance(mse, float) for mse in result["mses_observe_block"]))
+        self.assertGreater(result["wikitext_token_perplexity"], 1.0)
+        self.assertNotIn("wikitext_perplexity", result)
+
+
+if __name__ == "__main__":
+    unittest.main()
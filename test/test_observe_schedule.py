@@ -0,0 +1,73 @@
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.utils import block_forward
+from helpers import get_tiny_llama
+
+
+def quantize(**kwargs):
+    torch.manual_seed(1)
+    data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+    autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                          batch_size=2, iters=5, device="cpu", layer_config={}, disable_wandb=True,
+                          metrics_sink="memory", num_observe_blocks=1, **kwargs)
+    model, _ = autoround.quantize()
+    history = {name: values for name, values in autoround.metrics.history.items()
+               if name.startswith("observe_block_mse/")}
+    return model, history
+
+
+class TestObserveSchedule(unittest.TestCase):
+    def test_schedules(self):
+        step_model, step_history = quantize()
+        step_state_dict = step_model.state_dict()
+        self.assertEqual(len(step_history), 3)
+        for schedule, num_observations in [("every", 3), ("end", 1), ("never", 0)]:
+            model, history = quantize(observe_schedule=schedule, observe_interval=2, observe_nsamples=4)
+            ## the observations do not change the tuning
+            for name, value in model.state_dict().items():
+                self.assertTrue(torch.equal(value, step_state_dict[name]), name)
+            self.assertEqual(sorted(history), sorted(step_history) if num_observations > 0 else [])
+            for values in history.values():
+                self.assertEqual(len(values), num_observations)
+                self.assertTrue(all(value > 0 for value in values))
+
+    def test_default_schedule(self):
+        ## the observe block mse is only computed by default if something consumes it
+        for kwargs, schedule in [({}, "never"), ({"metrics_sink": "memory"}, "step"),
+                                 ({"isolation_experiment_v2": True}, "step")]:
+            autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=[], seqlen=16, nsamples=8,
+                                  batch_size=2, iters=5, device="cpu", layer_config={}, disable_wandb=True, **kwargs)
+            self.assertEqual(autoround.observe_schedule, schedule)
+
+    def test_observe_outputs(self):
+        ## without the output cache of quant_blocks, the full precision observe block outputs are only computed
+        ## for the observed samples
+        with mock.patch.object(AutoRound, "get_block_outputs", autospec=True,
+                               side_effect=AutoRound.get_block_outputs) as get_block_outputs:
+            quantize(observe_schedule="end", observe_nsamples=4, pipeline_staleness=1)
+        observed = [call.kwargs["indices"] for call in get_block_outputs.call_args_list
+                    if call.kwargs.get("indices") is not None]
+        self.assertEqual(len(observed), 3)
+        self.assertTrue(all(len(indices) == 4 for indices in observed))
+
+    def test_step_no_grad(self):
+        ## the "step" observation runs on the quantized output of the attach loss block, without gradients
+        calls = []
+
+        def record_block_forward(block, input_ids, *args, **kwargs):
+            calls.append((torch.is_grad_enabled(), input_ids.requires_grad))
+            return block_forward(block, input_ids, *args, **kwargs)
+
+        with mock.patch("auto_round.autoround.block_forward", side_effect=record_block_forward):
+            quantize(observe_schedule="step")
+        self.assertIn((False, True), calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
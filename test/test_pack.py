@@ -0,0 +1,53 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round_extension.cuda.qliner_triton import QuantLinear
+
+
+def unpack(packed, bits, dim):
+    pack_num = 32 // bits
+    shifts = torch.arange(0, 32, bits, dtype=torch.int32)
+    if dim == 0:
+        values = (packed.unsqueeze(1) >> shifts[None, :, None]) & (2 ** bits - 1)
+        return values.reshape(-1, packed.shape[1])
+    values = (packed.unsqueeze(2) >> shifts[None, None, :]) & (2 ** bits - 1)
+    return values.reshape(packed.shape[0], packed.shape[1] * pack_num)
+
+
+class TestQuantLinearPack(unittest.TestCase):
+    def _check_pack(self, bits, group_size, infeatures=256, outfeatures=64):
+        torch.manual_seed(0)
+        maxq = 2 ** bits - 1
+        n_groups = infeatures // group_size
+        scale = (torch.rand(outfeatures, n_groups) * 0.01 + 0.001).to(torch.float16)
+        zp = torch.randint(0, maxq + 1, (outfeatures, n_groups)).to(torch.float32)
+        int_weight = torch.randint(0, maxq + 1, (outfeatures, infeatures))
+        g_idx = torch.arange(infeatures) // group_size
+        weight = (int_weight - zp[:, g_idx]) * scale[:, g_idx].float()
+        linear = torch.nn.Linear(infeatures, outfeatures, bias=False)
+        linear.weight.data.copy_(weight)
+        linear = linear.to(torch.float16)
+
+        qlayer = QuantLinear(bits, group_size, infeatures, outfeatures, bias=False)
+        qlayer.pack(linear, scale, zp, None)
+
+        self.assertEqual(qlayer.qweight.shape, (infeatures // 32 * bits, outfeatures))
+        self.assertEqual(qlayer.qzeros.shape, (n_groups, outfeatures // 32 * bits))
+        self.assertTrue(torch.equal(unpack(qlayer.qweight, bits, 0), int_weight.t().to(torch.int32)))
+        self.assertTrue(torch.equal(unpack(qlayer.qzeros, bits, 1), zp.t().to(torch.int32)))
+
+    def test_pack_2bits(self):
+        self._check_pack(2, 32)
+
+    def test_pack_4bits(self):
+        self._check_pack(4, 128)
+
+    def test_pack_8bits(self):
+        self._check_pack(8, 64)
+
+
+if __name__ == "__main__":
+    unittest.main()
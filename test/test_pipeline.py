@@ -0,0 +1,70 @@
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from helpers import get_tiny_llama
+
+
+def quantize(**kwargs):
+    torch.manual_seed(1)
+    data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+    autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                          batch_size=2, iters=5, device="cpu", layer_config={}, disable_wandb=True, **kwargs)
+    model, layer_config = autoround.quantize()
+    return model, layer_config
+
+
+@torch.no_grad()
+def logits_relative_mse(model):
+    torch.manual_seed(2)
+    tokens = torch.randint(0, 128, (2, 16))
+    fp_logits = get_tiny_llama(3)(tokens).logits
+    return (torch.mean((model(tokens).logits - fp_logits) ** 2) / fp_logits.var()).item()
+
+
+class TestPipeline(unittest.TestCase):
+    def test_staleness_zero_matches_serial(self):
+        serial_model, _ = quantize()
+        ## waves of a single window, each tuned by a worker on its exact quantized input
+        with mock.patch.object(AutoRound, "is_block_parallel", return_value=True), \
+                mock.patch.object(AutoRound, "quant_blocks_parallel", autospec=True,
+                                  side_effect=AutoRound.quant_blocks_parallel) as quant_blocks_parallel:
+            pipeline_model, _ = quantize(num_block_workers=2, pipeline_staleness=0)
+        quant_blocks_parallel.assert_called_once()
+        serial_state_dict = serial_model.state_dict()
+        for name, value in pipeline_model.state_dict().items():
+            self.assertTrue(torch.equal(value, serial_state_dict[name]), name)
+
+    def test_pipeline(self):
+        serial_mse = logits_relative_mse(quantize()[0])
+        configs = [(1, 1, 0), (2, 1, 0), (1, 5, 0), (2, 1, 2)]
+        for num_block_workers, pipeline_staleness, pipeline_retune_iters in configs:
+            model, layer_config = quantize(num_block_workers=num_block_workers, pipeline_staleness=pipeline_staleness,
+                                           pipeline_retune_iters=pipeline_retune_iters)
+            for name in ["model.layers.0.self_attn.q_proj", "model.layers.2.mlp.down_proj"]:
+                self.assertIn("scale", layer_config[name])
+            self.assertLess(logits_relative_mse(model), 2 * serial_mse)
+
+    def test_staleness_of_one_worker_matches_workers(self):
+        ## the windows of a wave are tuned on the same inputs whatever the number of workers
+        one_worker_model, _ = quantize(pipeline_staleness=1)
+        two_workers_model, _ = quantize(num_block_workers=2, pipeline_staleness=1)
+        one_worker_state_dict = one_worker_model.state_dict()
+        for name, value in two_workers_model.state_dict().items():
+            self.assertTrue(torch.allclose(value, one_worker_state_dict[name], atol=1e-6), name)
+
+    def test_retune(self):
+        ## the re-tuning runs in the current process, from the tuned values the workers send back
+        one_worker_model, _ = quantize(pipeline_staleness=2, pipeline_retune_iters=2)
+        two_workers_model, _ = quantize(num_block_workers=2, pipeline_staleness=2, pipeline_retune_iters=2)
+        one_worker_state_dict = one_worker_model.state_dict()
+        for name, value in two_workers_model.state_dict().items():
+            self.assertTrue(torch.allclose(value, one_worker_state_dict[name], atol=1e-6), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
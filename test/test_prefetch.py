@@ -0,0 +1,60 @@
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.autoround import get_block_indices, get_window_block_names
+from auto_round.prefetch import BlockPrefetcher
+from helpers import get_tiny_llama
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetcher(self):
+        model = get_tiny_llama(3)
+        prefetcher = BlockPrefetcher(model, "meta")
+        prefetcher.prefetch(["model.layers.1", "model.layers.2"])
+        prefetcher.wait()
+        self.assertEqual(model.model.layers[0].mlp.up_proj.weight.device.type, "cpu")
+        self.assertEqual(model.model.layers[1].mlp.up_proj.weight.device.type, "meta")
+        self.assertEqual(model.model.layers[2].mlp.up_proj.weight.device.type, "meta")
+        prefetcher.close()
+
+    def test_window_block_names(self):
+        block_names = [f"model.layers.{i}" for i in range(4)]
+        windows = list(get_block_indices(nblocks=1, num_lookahead_blocks=1, num_observe_blocks=0, block_step_size=1,
+                                         total_num_blocks=4))
+        self.assertEqual(get_window_block_names(block_names, windows[0], 1), block_names[0:2])
+        self.assertEqual(get_window_block_names(block_names, windows[2], 1), block_names[1:4])
+        self.assertEqual(get_window_block_names(block_names, windows[3], 1), block_names[2:4])
+
+    def test_quantize(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        results = []
+        for enable_prefetch in [False, True]:
+            autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                                  batch_size=2, iters=2, device="cpu", layer_config={}, disable_wandb=True,
+                                  num_lookahead_blocks=1, enable_prefetch=enable_prefetch)
+            model, _ = autoround.quantize()
+            results.append(model.state_dict())
+        for key in results[0]:
+            self.assertTrue(torch.equal(results[0][key], results[1][key]), key)
+
+    def test_close_on_error(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        autoround = AutoRound(get_tiny_llama(3), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                              batch_size=2, iters=2, device="cpu", layer_config={}, disable_wandb=True,
+                              num_lookahead_blocks=1, enable_prefetch=True)
+        with mock.patch.object(AutoRound, "quant_block_with_lookahead", side_effect=RuntimeError("tuning failed")), \
+                mock.patch.object(BlockPrefetcher, "close", autospec=True, side_effect=BlockPrefetcher.close) as close:
+            with self.assertRaises(RuntimeError):
+                autoround.quantize()
+        close.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
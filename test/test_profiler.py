@@ -0,0 +1,56 @@
+import json
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round import AutoRound
+from auto_round.profiler import PhaseProfiler
+from helpers import get_tiny_llama
+
+
+class TestPhaseProfiler(unittest.TestCase):
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree("./saved_profile", ignore_errors=True)
+
+    def test_nested_phases(self):
+        profiler = PhaseProfiler(enabled=True)
+        with profiler.phase("outer"):
+            for block in ["b0", "b1"]:
+                with profiler.phase("inner", block=block):
+                    pass
+        report = profiler.report()
+        self.assertEqual(report["phases"]["inner"]["count"], 2)
+        self.assertEqual(list(report["blocks"]), ["b0", "b1", "-"])
+        self.assertGreaterEqual(report["phases"]["outer"]["time"], report["phases"]["inner"]["time"])
+        self.assertEqual([record["depth"] for record in report["records"]], [1, 1, 0])
+
+        disabled = PhaseProfiler()
+        with disabled.phase("outer"):
+            pass
+        self.assertEqual(disabled.records, [])
+
+    def test_quantize(self):
+        torch.manual_seed(1)
+        data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+        autoround = AutoRound(get_tiny_llama(), None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8,
+                              batch_size=2, iters=2, device="cpu", layer_config={}, disable_wandb=True,
+                              enable_profiling=True, profile_record_function=True,
+                              profile_path="./saved_profile/profile.json")
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as prof:
+            autoround.quantize()
+        with open("./saved_profile/profile.json") as f:
+            report = json.load(f)
+        for phase in ["cache_inputs", "fp_outputs", "tune", "unwrap", "q_outputs"]:
+            self.assertIn(phase, report["phases"])
+        for block in ["model.layers.000", "model.layers.001"]:
+            self.assertEqual(list(report["blocks"][block]), ["fp_outputs", "tune", "unwrap", "q_outputs"])
+        event_names = set(event.name for event in prof.events())
+        self.assertIn("autoround::tune", event_names)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, "..")
+import torch
+import transformers
+
+from auto_round import AutoRound
+from auto_round.quantizer import (
+    WrapperLinear,
+    WrapperTransformerConv1d,
+    cache_qdq_weights,
+    project_minmax_scales,
+    release_qdq_weights,
+)
+from auto_round.utils import collect_minmax_scale, collect_round_v, update_best_params
+
+
+def get_tiny_gpt2():
+    config = transformers.GPT2Config(vocab_size=128, n_embd=64, n_layer=2, n_head=4, n_positions=64)
+    torch.manual_seed(0)
+    return transformers.GPT2LMHeadModel(config)
+
+
+def quantize(model, **kwargs):
+    torch.manual_seed(1)
+    data = [torch.randint(0, 128, (2, 16)) for _ in range(4)]
+    autoround = AutoRound(model, None, bits=4, group_size=32, dataset=data, seqlen=16, nsamples=8, batch_size=1,
+                          gradient_accumulate_steps=2, iters=5, device="cpu", layer_config={}, disable_wandb=True,
+                          **kwargs)
+    model, _ = autoround.quantize()
+    return model
+
+
+def get_wrappers():
+    torch.manual_seed(0)
+    wrappers = []
+    for layer in [torch.nn.Linear(64, 32), transformers.modeling_utils.Conv1D(32, 64)]:
+        layer.requires_grad_(False)
+        for key, value in {"bits": 4, "group_size": 32, "sym": False, "scale_dtype": torch.float32,
+                           "data_type": "int", "act_bits": 32, "act_group_size": 32, "act_sym": False,
+                           "act_dynamic": True}.items():
+            setattr(layer, key, value)
+        wrapper_cls = WrapperLinear if isinstance(layer, torch.nn.Linear) else WrapperTransformerConv1d
+        wrapper = wrapper_cls(layer, enable_minmax_tuning=True)
+        with torch.no_grad():
+            wrapper.value.uniform_(-0.5, 0.5)
+            wrapper.min_scale.uniform_(0.5, 1.0)
+            wrapper.max_scale.uniform_(0.5, 1.0)
+        wrappers.append(wrapper)
+    return wrappers
+
+
+class TestQdqWeightCache(unittest.TestCase):
+    def test_gradients_match(self):
+        inputs = [torch.randn(4, 64) for _ in range(3)]
+        for cached in [False, True]:
+            gradients = []
+            for wrapper in get_wrappers():
+                if cached:
+                    cache_qdq_weights(wrapper)
+                for x in inputs:
+                    wrapper(x).pow(2).sum().backward()
+                release_qdq_weights(wrapper)
+                self.assertIsNone(wrapper.weight_q_leaf)
+                gradients.append(
+                    [param.grad.clone() for param in [wrapper.value, wrapper.min_scale, wrapper.max_scale]])
+            if not cached:
+                expected = gradients
+        for wrapper_gradients, expected_gradients in zip(gradients, expected):
+            for gradient, expected_gradient in zip(wrapper_gradients, expected_gradients):
+                self.assertTrue(torch.allclose(gradient, expected_gradient, rtol=1e-5, atol=1e-6))
+
+    def test_projection(self):
+        for wrapper in get_wrappers():
+            with torch.no_grad():
+                wrapper.min_scale.add_(1.0)
+                wrapper.max_scale.sub_(2.0)
+            project_minmax_scales(wrapper)
+            self.assertTrue(torch.all(wrapper.min_scale == 1.0))
+            self.assertTrue(torch.all(wrapper.max_scale == 0.0))
+
+    def test_best_params(self):
+        block = torch.nn.Sequential(*get_wrappers())
+        best_params = {"v": {}, "min_scale": {}, "max_scale": {}}
+        update_best_params(block, best_params, torch.tensor(False))
+        self.assertTrue(all(torch.all(v == 0.0) for v in best_params["v"].values()))
+        self.assertTrue(all(torch.all(scale == 1.0) for scale in best_params["min_scale"].values()))
+        update_best_params(block, best_params, torch.tensor(True))
+        best_v = collect_round_v(block)
+        best_min_scale, best_max_scale = collect_minmax_scale(block)
+        with torch.no_grad():
+            for wrapper in block:
+                wrapper.value.add_(0.1)
+                wrapper.max_scale.sub_(0.1)
+        update_best_params(block, best_params, torch.tensor(False))
+        for name, v in best_v.items():
+            self.assertTrue(torch.equal(best_params["v"][name], v))
+            self.assertTrue(torch.equal(best_params["min_scale"][name], best_min_scale[name]))
+            self.assertTrue(torch.equal(best_params["max_scale"][name], best_max_scale[name]))
+
+    def test_quantize_matches_uncached(self):
+        ## without the cache every micro-batch forward fake quantizes the weights again
+        model = quantize(get_tiny_gpt2())
+        with mock.patch("auto_round.autoround.cache_qdq_weights", lambda block: None):
+            uncached_model = quantize(get_tiny_gpt2())
+        uncached_state_dict = uncached_model.state_dict()
+        for name, value in model.state_dict().items():
+            self.assertTrue(torch.allclose(value, uncached_state_dict[name], atol=1e-6), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round.sign_sgd import SignSGD
+
+
+def get_params():
+    torch.manual_seed(0)
+    return [torch.nn.Parameter(torch.randn(shape)) for shape in [(8, 32), (8,), (8,), (4, 32), (4,)]]
+
+
+def run(steps=4, **kwargs):
+    params = get_params()
+    optimizer = SignSGD([{"params": params[:3]}, {"params": params[3:], "lr": 0.02}], lr=0.005, **kwargs)
+    torch.manual_seed(1)
+    for _ in range(steps):
+        for param in params:
+            param.grad = torch.randn_like(param)
+        optimizer.step()
+        optimizer.zero_grad()
+    return params
+
+
+class TestSignSGD(unittest.TestCase):
+    def test_variants_match(self):
+        configs = [{}, {"momentum": 0.9}, {"momentum": 0.9, "nesterov": True}, {"momentum": 0.5, "dampening": 0.1},
+                   {"weight_decay": 0.01, "maximize": True}]
+        for config in configs:
+            expected = run(foreach=False, **config)
+            for variant in [{"foreach": True}, {"flatten": True}]:
+                params = run(**variant, **config)
+                for param, expected_param in zip(params, expected):
+                    self.assertTrue(torch.equal(param, expected_param), (config, variant))
+
+    def test_flat_grads(self):
+        ## with flatten, the backward accumulates into views of a single gradient buffer after zero_grad
+        results = []
+        for variant in [{"foreach": False}, {"flatten": True}]:
+            params = get_params()
+            optimizer = SignSGD(params, lr=0.005, momentum=0.9, **variant)
+            torch.manual_seed(1)
+            for _ in range(3):
+                targets = [torch.randn_like(param) for param in params]
+                sum(((param - target) ** 2).sum() for param, target in zip(params, targets)).backward()
+                optimizer.step()
+                optimizer.zero_grad()
+            results.append(params)
+        self.assertTrue(all(param.grad is not None for param in results[1]))
+        for param, expected_param in zip(results[1], results[0]):
+            self.assertTrue(torch.equal(param, expected_param))
+
+    def test_flatten(self):
+        params = get_params()
+        values = [param.detach().clone() for param in params]
+        SignSGD(params, lr=0.005, flatten=True)
+        storage_ptr = params[0].untyped_storage().data_ptr()
+        for param, value in zip(params, values):
+            self.assertEqual(param.untyped_storage().data_ptr(), storage_ptr)
+            self.assertTrue(torch.equal(param, value))
+
+    def test_missing_grad(self):
+        ## a parameter without gradient is skipped, as by the per parameter update
+        for variant in [{"foreach": False}, {"foreach": True}, {"flatten": True}]:
+            params = get_params()
+            values = [param.detach().clone() for param in params]
+            optimizer = SignSGD(params, lr=0.005, momentum=0.9, **variant)
+            params[0].grad = torch.ones_like(params[0])
+            optimizer.step()
+            self.assertTrue(torch.equal(params[0], values[0] - 0.005))
+            for param, value in zip(params[1:], values[1:]):
+                self.assertTrue(torch.equal(param, value))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import sys
+import unittest
+
+sys.path.insert(0, "..")
+import torch
+
+from auto_round.export.export_to_itrex.model_wrapper import WeightOnlyLinear, set_weight_cache
+
+
+class TestWeightOnlyLinear(unittest.TestCase):
+    def _check_round_trip(self, bits, group_size, use_optimum_format, compression_dtype, compression_dim, zp):
+        torch.manual_seed(0)
+        in_features, out_features = 256, 96
+        n_groups = -(-in_features // group_size)
+        scale = (torch.rand(out_features, n_groups) * 0.01 + 0.001).to(torch.float16)
+        if zp:
+            int_weight = torch.randint(0, 2**bits, (out_features, in_features), dtype=torch.int32)
+            zero = torch.randint(0, 2**bits, (out_features, n_groups), dtype=torch.int32)
+        else:
+            int_weight = torch.randint(-(2 ** (bits - 1)), 2 ** (bits - 1), (out_features, in_features),
+                                       dtype=torch.int32)
+            zero = None
+        g_idx = torch.arange(in_features) // group_size
+        expected = int_weight - zero[:, g_idx] if zp else int_weight
+        expected = (expected * scale[:, g_idx]).to(torch.float16)
+
+        layer = WeightOnlyLinear(in_features, out_features, bits, group_size, zp=zp,
+                                 compression_dtype=compression_dtype, compression_dim=compression_dim,
+                                 use_optimum_format=use_optimum_format)
+        shapes = {name: buffer.shape for name, buffer in layer.named_buffers()}
+        layer.pack(int_weight, scale, zero, None)
+        for name, buffer in layer.named_buffers():
+            self.assertEqual(buffer.shape, shapes[name], name)
+        self.assertTrue(torch.equal(layer.recover(), expected))
+        ##recover must not change the packed buffers
+        self.assertTrue(torch.equal(layer.recover(), expected))
+
+    def test_optimum_format(self):
+        for bits in [2, 3, 4, 8]:
+            self._check_round_trip(bits, 32, True, torch.int32, 1, True)
+            self._check_round_trip(bits, 32, True, torch.int32, 1, False)
+
+    def test_compression_dim(self):
+        for compression_dim in [0, 1]:
+            for compression_dtype in [torch.int16, torch.int32, torch.int64]:
+                self._check_round_trip(4, 32, False, compression_dtype, compression_dim, True)
+                self._check_round_trip(4, 32, False, compression_dtype, compression_dim, False)
+
+    def test_group_size_not_divisible(self):
+        self._check_round_trip(4, 96, True, torch.int32, 1, True)
+        self._check_round_trip(4, 96, False, torch.int32, 0, False)
+
+    def _get_packed_layers(self, num_layers, features=64):
+        torch.manual_seed(0)
+        layers = torch.nn.Sequential()
+        for _ in range(num_layers):
+            layer = WeightOnlyLinear(features, features, 4, 32, zp=True, bias=True)
+            layer.pack(torch.randint(0, 16, (features, features), dtype=torch.int32),
+                       (torch.rand(features, 2) * 0.01).to(torch.float16),
+                       torch.randint(0, 16, (features, 2), dtype=torch.int32), torch.rand(features))
+            layers.append(layer)
+        return layers
+
+    def test_weight_cache(self):
+        layers = self._get_packed_layers(3)
+        x = torch.rand(2, 64)
+        ref = layers(x)
+        ##each weight is 64 * 64 * 4 bytes in fp32, the budget holds two of them
+        cache = set_weight_cache(layers, max_bytes=2 * 64 * 64 * 4)
+        self.assertFalse(hasattr(layers[0], "weight"))
+        self.assertTrue(torch.equal(layers(x), ref))
+        self.assertEqual(cache.stats()["misses"], 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLessEqual(cache.cached_bytes, cache.max_bytes)
+        layers[2](x)
+        self.assertEqual(cache.hits, 1)
+        self.assertTrue(torch.equal(layers(x), ref))
+        self.assertEqual(len(cache.cache), 2)
+
+        set_weight_cache(layers, max_bytes=None)
+        self.assertIsNone(layers[0].weight_cache)
+        self.assertTrue(torch.equal(layers(x), ref))
+
+    def test_global_weight_cache(self):
+        layers = self._get_packed_layers(2)
+        x = torch.rand(2, 64)
+        ref = layers(x)
+        self.assertTrue(hasattr(layers[0], "weight"))
+        model_cache = set_weight_cache(layers[:1], max_bytes=64 * 64 * 4)
+        try:
+            ##the recovered weights of the layers which already ran are dropped
+            cache = set_weight_cache(max_bytes=2 * 64 * 64 * 4)
+            self.assertFalse(any(hasattr(layer, "weight") for layer in layers))
+            self.assertIs(layers[0].weight_cache, cache)
+            self.assertTrue(torch.equal(layers(x), ref))
+            self.assertEqual(cache.misses, 2)
+            self.assertEqual(model_cache.misses, 0)
+        finally:
+            set_weight_cache(max_bytes=None)
+        self.assertIsNone(layers[0].weight_cache)
+        self.assertTrue(torch.equal(layers(x), ref))
+
+    def test_weight_cache_too_small(self):
+        layers = self._get_packed_layers(1)
+        cache = set_weight_cache(layers, max_bytes=1024)
+        layers(torch.rand(2, 64))
+        layers(torch.rand(2, 64))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(len(cache.cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()